@@ -0,0 +1,344 @@
+"""
+Endpoint benchmark suite with regression thresholds
+
+Seeds deterministic synthetic datasets of increasing size into a separate
+database (MONGO_DB_NAME, default octofit_bench), then requests every GET
+route in urls.py in-process through Django's test client, recording
+latency percentiles, throughput and the number of MongoDB commands each
+request issues. The async routes are requested through Django's ASGI test
+client on one event loop per route, as an ASGI worker serves them.
+Results are written as JSON and compared with a stored baseline; any route
+slower than the baseline by more than the tolerance, issuing more MongoDB
+commands or missing from the baseline, fails the run with exit status 1,
+as does a missing baseline unless --update-baseline is passed to record
+one, or a GET route the suite does not request.
+
+    python benchmarks/endpoints.py --sizes 1k,100k --output benchmarks/results.json
+    python benchmarks/endpoints.py --sizes 1k,100k --update-baseline
+
+The response cache is cleared before every request so each measurement
+includes its database work; pass --warm-cache to measure cache hits.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import date
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
+os.environ.setdefault('MONGO_DB_NAME', 'octofit_bench')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from django.db import connections  # noqa: E402
+from django.test import AsyncClient, Client, override_settings  # noqa: E402
+from django.urls import get_resolver, reverse  # noqa: E402
+from pymongo import monitoring  # noqa: E402
+from octofit_tracker import analytics, leaderboard, response_cache, synthetic, user_stats  # noqa: E402
+from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(HERE, 'baseline.json')
+
+# dataset name: (teams, users, activities per user)
+DATASETS = {
+    '1k': (5, 10, 100),
+    '100k': (10, 1000, 100),
+    '1m': (20, 10000, 100),
+}
+# POST-only routes and the browsable API index
+SKIPPED_ROUTES = {'activity-bulk', 'api-root'}
+# Routes served by async views, requested over ASGI
+ASYNC_ROUTE_PREFIX = 'async-'
+SEED = 2024
+END_DATE = date(2024, 6, 30)
+WORKOUTS = [
+    {'name': f'Workout {index}', 'description': 'Benchmark workout', 'activity_type': activity_type,
+     'difficulty': difficulty, 'duration': 30 + index, 'calories_estimate': 300 + index * 10}
+    for index, (activity_type, difficulty) in enumerate(
+        (activity_type, difficulty)
+        for activity_type in synthetic.ACTIVITY_PROFILES
+        for difficulty in ('Easy', 'Medium', 'Hard')
+    )
+]
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts the MongoDB commands sent while a request is measured"""
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def seed(name):
+    """Load a dataset and rebuild every derived collection"""
+    teams, users, per_user = DATASETS[name]
+    started = time.perf_counter()
+    parallel = os.cpu_count() or 1
+    synthetic.generate(teams, users, per_user, SEED, END_DATE, parallel=parallel)
+    Workout.objects.all().delete()
+    Workout.objects.bulk_create([Workout(**workout) for workout in WORKOUTS])
+    leaderboard.rebuild_daily_totals()
+    user_stats.rebuild_user_stats()
+    leaderboard.rebuild_leaderboard(parallel=parallel)
+    response_cache.bump(User, Team, Activity)
+    analytics.invalidate_snapshot()
+    print(f'seeded {name} in {time.perf_counter() - started:.1f}s')
+
+
+def routes():
+    """Return (label, url name, args, query) for every GET route, with ids from the data"""
+    user = User.objects.order_by('_id').first()
+    team = Team.objects.order_by('_id').first()
+    activity = Activity.objects.order_by('_id').first()
+    entry = Leaderboard.objects.order_by('rank').first()
+    workout = Workout.objects.order_by('_id').first()
+    user_id, team_id = str(user._id), str(team._id)
+    user_ids = ','.join(str(_id) for _id in User.objects.order_by('_id').values_list('_id', flat=True)[:50])
+    return [
+        ('users list', 'user-list', [], {}),
+        ('users detail', 'user-detail', [user_id], {}),
+        ('users stats', 'user-stats', [user_id], {}),
+        ('users batch', 'user-batch', [], {'ids': user_ids}),
+        ('users by_team', 'user-by-team', [], {'team_id': team_id}),
+        ('users by_email', 'user-by-email', [], {'email': user.email}),
+        ('teams list', 'team-list', [], {}),
+        ('teams detail', 'team-detail', [team_id], {}),
+        ('teams members', 'team-members', [team_id], {}),
+        ('teams stats', 'team-stats', [team_id], {}),
+        ('teams dashboard', 'team-dashboard', [team_id], {}),
+        ('teams batch', 'team-batch', [], {'ids': team_id}),
+        ('activities list', 'activity-list', [], {}),
+        ('activities detail', 'activity-detail', [str(activity._id)], {}),
+        ('activities by_user', 'activity-by-user', [], {'user_id': user_id}),
+        ('activities by_type', 'activity-by-type', [], {'activity_type': activity.activity_type}),
+        ('activities export', 'activity-export', [], {'format': 'ndjson', 'user_id': user_id}),
+        ('leaderboard list', 'leaderboard-list', [], {}),
+        ('leaderboard list 7d', 'leaderboard-list', [], {'window': '7d'}),
+        ('leaderboard detail', 'leaderboard-detail', [str(entry._id)], {}),
+        ('leaderboard top', 'leaderboard-top', [], {}),
+        ('leaderboard top 30d', 'leaderboard-top', [], {'window': '30d'}),
+        ('leaderboard top expand', 'leaderboard-top', [], {'expand': 'user,team'}),
+        ('leaderboard by_team', 'leaderboard-by-team', [], {'team_id': team_id}),
+        ('leaderboard around', 'leaderboard-around', [], {'user_id': entry.user_id}),
+        ('workouts list', 'workout-list', [], {}),
+        ('workouts detail', 'workout-detail', [str(workout._id)], {}),
+        ('workouts by_difficulty', 'workout-by-difficulty', [], {'difficulty': 'Hard'}),
+        ('workouts by_activity_type', 'workout-by-activity-type', [], {'activity_type': 'Running'}),
+        ('analytics list', 'analytics-list', [], {}),
+        ('analytics durations', 'analytics-durations', [], {}),
+        ('analytics calories-per-minute', 'analytics-calories-per-minute', [], {}),
+        ('analytics teams', 'analytics-teams', [], {}),
+        ('async leaderboard top', 'async-leaderboard-top', [], {}),
+        ('async activities by_user', 'async-activities-by-user', [], {'user_id': user_id}),
+        ('async teams stats', 'async-team-stats', [team_id], {}),
+        ('internal mongo-pool', 'mongo-pool', [], {}),
+        ('metrics', 'metrics', [], {}),
+    ]
+
+
+def uncovered(covered):
+    """Names of routed GET views the suite does not request"""
+    names = {name for name in get_resolver().reverse_dict if isinstance(name, str)}
+    return sorted(name for name in names - covered - SKIPPED_ROUTES)
+
+
+def percentile(samples, percent):
+    ordered = sorted(samples)
+    position = (len(ordered) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarise(timings, commands, status_code):
+    return {
+        'status': status_code,
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p90_ms': round(percentile(timings, 90) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+        'mean_ms': round(statistics.fmean(timings) * 1000, 3),
+        'throughput_rps': round(len(timings) / sum(timings), 1),
+        'mongo_commands': max(commands),
+    }
+
+
+def measure(client, counter, url, iterations, warmup, warm_cache):
+    """Request a URL repeatedly and summarise latency, throughput and MongoDB commands"""
+    timings, commands, status_code = [], [], None
+    for iteration in range(warmup + iterations):
+        if not warm_cache:
+            cache.clear()
+        counter.count = 0
+        started = time.perf_counter()
+        response = client.get(url, HTTP_ACCEPT='application/json')
+        if response.streaming:
+            b''.join(response.streaming_content)
+        elapsed = time.perf_counter() - started
+        status_code = response.status_code
+        if iteration >= warmup:
+            timings.append(elapsed)
+            commands.append(counter.count)
+    return summarise(timings, commands, status_code)
+
+
+async def measure_async(counter, url, iterations, warmup, warm_cache):
+    """measure() for an async route, requested over ASGI on the running event loop"""
+    client = AsyncClient()
+    timings, commands, status_code = [], [], None
+    for iteration in range(warmup + iterations):
+        if not warm_cache:
+            cache.clear()
+        counter.count = 0
+        started = time.perf_counter()
+        # AsyncClient sends extra headers under their raw names
+        response = await client.get(url, accept='application/json')
+        elapsed = time.perf_counter() - started
+        status_code = response.status_code
+        if iteration >= warmup:
+            timings.append(elapsed)
+            commands.append(counter.count)
+    return summarise(timings, commands, status_code)
+
+
+def compare(results, baseline, tolerance):
+    """Return a message for every route slower than baseline, issuing more commands or missing from it"""
+    failures = []
+    for dataset, measured in results.items():
+        for label, result in measured.items():
+            expected = baseline.get(dataset, {}).get(label)
+            if expected is None:
+                failures.append(f'{dataset} {label}: no baseline; run with --update-baseline to record one')
+                continue
+            for metric in ('p50_ms', 'p90_ms'):
+                limit = expected[metric] * (1 + tolerance)
+                if result[metric] > limit:
+                    failures.append(
+                        f'{dataset} {label}: {metric} {result[metric]:.2f} > {limit:.2f} '
+                        f'(baseline {expected[metric]:.2f})'
+                    )
+            if result['mongo_commands'] > expected['mongo_commands']:
+                failures.append(
+                    f"{dataset} {label}: {result['mongo_commands']} MongoDB commands "
+                    f"(baseline {expected['mongo_commands']})"
+                )
+            if result['status'] != expected['status']:
+                failures.append(f"{dataset} {label}: status {result['status']} (baseline {expected['status']})")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='1k,100k', help=f"Comma-separated datasets from {', '.join(DATASETS)}")
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--skip-seed', action='store_true', help='Reuse the data already in the database')
+    parser.add_argument('--warm-cache', action='store_true', help='Keep the response cache between requests')
+    parser.add_argument('--output', default=os.path.join(HERE, 'results.json'))
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown, 0.25 = 25%%')
+    parser.add_argument('--update-baseline', action='store_true', help='Store these results as the baseline')
+    args = parser.parse_args()
+
+    sizes = [size.strip() for size in args.sizes.split(',') if size.strip()]
+    unknown = [size for size in sizes if size not in DATASETS]
+    if unknown:
+        parser.error(f"unknown dataset(s): {', '.join(unknown)}")
+
+    if not args.update_baseline and not os.path.exists(args.baseline):
+        sys.exit(f'no baseline at {args.baseline}; run with --update-baseline to create one')
+
+    counter = CommandCounter()
+    monitoring.register(counter)
+    # Listeners only attach to clients created after registration
+    connections.close_all()
+    # Outside the test runner ALLOWED_HOSTS applies; allow the test clients' host
+    override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']).enable()
+    client = Client()
+
+    results = {}
+    if len(sizes) > 1 and args.skip_seed:
+        parser.error('--skip-seed only makes sense with a single dataset')
+    for size in sizes:
+        if not args.skip_seed:
+            seed(size)
+        planned = routes()
+        missing = uncovered({name for _, name, _, _ in planned})
+        if missing:
+            sys.exit(f"routes not benchmarked: {', '.join(missing)}; add them to routes() or SKIPPED_ROUTES")
+        results[size] = {}
+        for label, name, url_args, query in planned:
+            url = reverse(name, args=url_args)
+            if query:
+                url += '?' + urlencode(query)
+            if name.startswith(ASYNC_ROUTE_PREFIX):
+                result = asyncio.run(measure_async(counter, url, args.iterations, args.warmup, args.warm_cache))
+            else:
+                result = measure(client, counter, url, args.iterations, args.warmup, args.warm_cache)
+            results[size][label] = result
+            print(
+                f"{size:>5} {label:<32} {result['status']} p50 {result['p50_ms']:8.2f} ms  "
+                f"p90 {result['p90_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  "
+                f"{result['throughput_rps']:8.1f} req/s  {result['mongo_commands']} cmds"
+            )
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'machine': platform.machine(),
+            'iterations': args.iterations,
+            'warm_cache': args.warm_cache,
+            'seed': SEED,
+            'end_date': END_DATE.isoformat(),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+    print(f'results written to {args.output}')
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as stored:
+                baseline = json.load(stored)
+        baseline.setdefault('results', {}).update(results)
+        baseline['meta'] = report['meta']
+        with open(args.baseline, 'w') as output:
+            json.dump(baseline, output, indent=2, sort_keys=True)
+        print(f'baseline updated: {args.baseline}')
+        return
+
+    with open(args.baseline) as stored:
+        baseline = json.load(stored)['results']
+    failures = compare(results, baseline, args.tolerance)
+    if failures:
+        print('\nREGRESSIONS')
+        for failure in failures:
+            print(f'  {failure}')
+        sys.exit(1)
+    print('no regressions against the baseline')
+
+
+if __name__ == '__main__':
+    main()
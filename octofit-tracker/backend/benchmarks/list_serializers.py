@@ -0,0 +1,104 @@
+"""
+Benchmark the fast list serializers against per-row ModelSerializer output
+
+Builds in-memory activities and leaderboard entries (no database needed),
+checks both paths render byte-identical JSON and reports the timings.
+
+    python benchmarks/list_serializers.py --rows 10000
+"""
+import argparse
+import os
+import sys
+import timeit
+from datetime import date, datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from bson import ObjectId  # noqa: E402
+from rest_framework import serializers  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+from octofit_tracker.models import Activity, Leaderboard  # noqa: E402
+from octofit_tracker.serializers import ActivitySerializer, LeaderboardSerializer  # noqa: E402
+
+
+def activities(count):
+    now = datetime.now(timezone.utc)
+    return [
+        Activity(
+            _id=ObjectId(),
+            user_id=f'user-{index % 500}',
+            activity_type=('Running', 'Cycling', 'Swimming')[index % 3],
+            duration=20 + index % 60,
+            calories_burned=150 + index % 400,
+            distance=None if index % 4 == 0 else round(1 + index % 13 * 0.7, 2),
+            date=date.today() - timedelta(days=index % 365),
+            created_at=now - timedelta(minutes=index),
+        )
+        for index in range(count)
+    ]
+
+
+def leaderboard_entries(count):
+    now = datetime.now(timezone.utc)
+    return [
+        Leaderboard(
+            _id=ObjectId(),
+            user_id=f'user-{index}',
+            team_id=f'team-{index % 20}',
+            total_activities=index % 90,
+            total_duration=index * 7 % 5000,
+            total_calories=count - index,
+            total_distance=index * 0.37,
+            rank=index + 1,
+            updated_at=now,
+        )
+        for index in range(count)
+    ]
+
+
+def compare(label, serializer_class, rows, dict_rows, repeat):
+    renderer = JSONRenderer()
+
+    def slow():
+        return serializers.ListSerializer(rows, child=serializer_class()).data
+
+    def fast():
+        return serializer_class(rows, many=True).data
+
+    def fast_values():
+        return serializer_class(dict_rows, many=True).data
+
+    expected = renderer.render(slow())
+    if renderer.render(fast()) != expected or renderer.render(fast_values()) != expected:
+        raise SystemExit(f'{label}: fast path output differs from ModelSerializer')
+
+    baseline = min(timeit.repeat(slow, number=1, repeat=repeat))
+    print(f'{label} ({len(rows)} rows)')
+    print(f'  ModelSerializer      {baseline * 1000:8.1f} ms')
+    for name, run in (('fast, instances', fast), ('fast, values() rows', fast_values)):
+        best = min(timeit.repeat(run, number=1, repeat=repeat))
+        print(f'  {name:<20} {best * 1000:8.1f} ms  ({baseline / best:.1f}x)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for label, serializer_class, rows in (
+        ('activities', ActivitySerializer, activities(args.rows)),
+        ('leaderboard', LeaderboardSerializer, leaderboard_entries(args.rows)),
+    ):
+        columns = [field.source for field in serializer_class().fields.values()]
+        dict_rows = [{column: getattr(row, column) for column in columns} for row in rows]
+        compare(label, serializer_class, rows, dict_rows, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
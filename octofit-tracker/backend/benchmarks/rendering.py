@@ -0,0 +1,64 @@
+"""
+Benchmark JSON rendering and response compression for a large list
+
+Serializes in-memory activities, renders them with DRF's JSONRenderer and
+with ORJSONRenderer (checking the bytes match), then reports the size on
+the wire uncompressed, gzipped and, if Brotli is installed, brotli'd.
+
+    python benchmarks/rendering.py --rows 10000
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.utils.text import compress_string  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+from octofit_tracker.middleware import BROTLI_QUALITY, brotli  # noqa: E402
+from octofit_tracker.renderers import ORJSONRenderer  # noqa: E402
+from octofit_tracker.serializers import ActivitySerializer  # noqa: E402
+from list_serializers import activities  # noqa: E402
+
+
+def best(run, repeat):
+    return min(timeit.repeat(run, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    data = ActivitySerializer(activities(args.rows), many=True).data
+    before, after = JSONRenderer(), ORJSONRenderer()
+    body = before.render(data)
+    if after.render(data) != body:
+        raise SystemExit('ORJSONRenderer output differs from JSONRenderer')
+
+    baseline = best(lambda: before.render(data), args.repeat)
+    fast = best(lambda: after.render(data), args.repeat)
+    print(f'render {args.rows} activities')
+    print(f'  JSONRenderer    {baseline * 1000:8.1f} ms')
+    print(f'  ORJSONRenderer  {fast * 1000:8.1f} ms  ({baseline / fast:.1f}x)')
+
+    print('bytes on the wire')
+    print(f'  identity        {len(body):10,d}')
+    encoders = [('gzip', compress_string)]
+    if brotli is not None:
+        encoders.append(('br', lambda content: brotli.compress(content, quality=BROTLI_QUALITY)))
+    for name, compress in encoders:
+        size = len(compress(body))
+        elapsed = best(lambda: compress(body), args.repeat)
+        print(f'  {name:<15} {size:10,d}  ({size / len(body):.0%}, {elapsed * 1000:.1f} ms)')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Team, Activity, Leaderboard, Workout
+from .models import User, Team, Activity, Leaderboard, DailyTotal, UserStats, Workout
 
 
 @admin.register(User)
@@ -41,6 +41,25 @@ class LeaderboardAdmin(admin.ModelAdmin):
     readonly_fields = ('_id', 'updated_at')
 
 
+@admin.register(DailyTotal)
+class DailyTotalAdmin(admin.ModelAdmin):
+    """Admin interface for DailyTotal model"""
+    list_display = ('user_id', 'team_id', 'day', 'total_activities', 'total_duration', 'total_calories', 'total_distance', 'updated_at')
+    list_filter = ('team_id', 'day')
+    search_fields = ('user_id', 'team_id')
+    ordering = ('-day',)
+    readonly_fields = ('_id', 'updated_at')
+
+
+@admin.register(UserStats)
+class UserStatsAdmin(admin.ModelAdmin):
+    """Admin interface for UserStats model"""
+    list_display = ('user_id', 'longest_streak', 'updated_at')
+    search_fields = ('user_id',)
+    ordering = ('-updated_at',)
+    readonly_fields = ('_id', 'updated_at')
+
+
 @admin.register(Workout)
 class WorkoutAdmin(admin.ModelAdmin):
     """Admin interface for Workout model"""
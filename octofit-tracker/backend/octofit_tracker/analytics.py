@@ -0,0 +1,224 @@
+"""
+Vectorized activity analytics for OctoFit Tracker
+
+Activity columns are loaded once through a projected cursor into a cached
+columnar snapshot of NumPy arrays. Grouped aggregates, percentiles and
+histograms are then computed over whole arrays instead of model instances.
+The snapshot is reloaded after any write to the activities or users
+collections, through the same collection versions the response cache uses.
+"""
+import threading
+import time
+import numpy as np
+from django.conf import settings
+from .models import User, Activity
+from . import response_cache
+
+SNAPSHOT_FIELDS = ('user_id', 'activity_type', 'duration', 'calories_burned', 'distance', 'date')
+
+
+class Snapshot:
+    """Columnar copy of the activities collection"""
+
+    def __init__(self, documents, user_teams):
+        types, users = {}, {}
+        type_codes, user_codes = [], []
+        durations, calories, distances, dates = [], [], [], []
+        for document in documents:
+            type_codes.append(types.setdefault(document.get('activity_type'), len(types)))
+            user_codes.append(users.setdefault(document.get('user_id'), len(users)))
+            durations.append(document.get('duration') or 0)
+            calories.append(document.get('calories_burned') or 0)
+            distance = document.get('distance')
+            distances.append(np.nan if distance is None else distance)
+            dates.append(document.get('date'))
+
+        self.activity_types = np.array(list(types), dtype=object)
+        self.user_ids = np.array(list(users), dtype=object)
+        self.type_code = np.array(type_codes, dtype=np.int32)
+        self.user_code = np.array(user_codes, dtype=np.int32)
+        self.duration = np.array(durations, dtype=np.float64)
+        self.calories = np.array(calories, dtype=np.float64)
+        self.distance = np.array(distances, dtype=np.float64)
+        self.date = np.array(dates, dtype='datetime64[D]')
+
+        teams = {}
+        user_team = [teams.setdefault(user_teams.get(user_id, ''), len(teams)) for user_id in users]
+        self.team_ids = np.array(list(teams), dtype=object)
+        self.user_team = np.array(user_team, dtype=np.int32)
+        self.team_code = self.user_team[self.user_code]
+        self.loaded_at = time.monotonic()
+        self.version = None
+
+    def __len__(self):
+        return len(self.type_code)
+
+    def mask(self, activity_type=None, since=None):
+        """Boolean row filter by activity type and first day"""
+        selected = np.ones(len(self), dtype=bool)
+        if activity_type is not None:
+            codes = np.flatnonzero(self.activity_types == activity_type)
+            selected &= np.isin(self.type_code, codes)
+        if since is not None:
+            selected &= self.date >= np.datetime64(since, 'D')
+        return selected
+
+
+# Version name bumped in the shared collection versions to invalidate every process's snapshot
+SNAPSHOT_VERSION = 'analytics_snapshot'
+# Sources the snapshot is read from; a write to any of them makes it stale
+SNAPSHOT_SOURCES = (SNAPSHOT_VERSION, Activity, User)
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def load_snapshot(batch_size=10000):
+    """Read the activity columns through a projected cursor"""
+    user_teams = {str(_id): team_id or '' for _id, team_id in User.objects.values_list('_id', 'team_id')}
+    cursor = Activity.objects.mongo_find(
+        {}, {field: True for field in SNAPSHOT_FIELDS} | {'_id': False}
+    ).batch_size(batch_size)
+    return Snapshot(cursor, user_teams)
+
+
+def _is_current(snapshot, version):
+    max_age = getattr(settings, 'ANALYTICS_SNAPSHOT_TTL', 300)
+    return (
+        snapshot is not None
+        and snapshot.version == version
+        and time.monotonic() - snapshot.loaded_at <= max_age
+    )
+
+
+def get_snapshot():
+    """
+    Return the cached snapshot, reloading it once it is older than
+    ANALYTICS_SNAPSHOT_TTL, was invalidated by any process or activities or
+    users were written since it was loaded
+    """
+    global _snapshot
+    with _snapshot_lock:
+        # Read before loading, so an invalidation during the load forces another
+        version = response_cache.versions(SNAPSHOT_SOURCES)
+        if not _is_current(_snapshot, version):
+            _snapshot = load_snapshot()
+            _snapshot.version = version
+        return _snapshot
+
+
+def snapshot_loaded_at():
+    """Return when the cached snapshot was loaded, or None if it is missing, expired or invalidated"""
+    snapshot = _snapshot
+    if not _is_current(snapshot, response_cache.versions(SNAPSHOT_SOURCES)):
+        return None
+    return snapshot.loaded_at
+
+
+def invalidate_snapshot():
+    """Make every process reload its snapshot on its next request"""
+    global _snapshot
+    response_cache.bump(SNAPSHOT_VERSION)
+    with _snapshot_lock:
+        _snapshot = None
+
+
+def grouped_percentiles(codes, values, group_count, percentiles):
+    """
+    Linear-interpolated percentiles of values per group code, for every
+    group at once: shape (group_count, len(percentiles)), NaN for empty groups
+    """
+    order = np.lexsort((values, codes))
+    codes, values = codes[order], values[order]
+    counts = np.bincount(codes, minlength=group_count)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    fractions = np.asarray(percentiles, dtype=np.float64) / 100.0
+
+    positions = starts[:, None] + fractions[None, :] * np.maximum(counts - 1, 0)[:, None]
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.ceil(positions).astype(np.int64)
+    empty = counts == 0
+    lower[empty] = upper[empty] = 0
+    if not len(values):
+        return np.full((group_count, len(fractions)), np.nan)
+    result = values[lower] + (values[upper] - values[lower]) * (positions - lower)
+    result[empty] = np.nan
+    return result
+
+
+def _clean(value, digits=2):
+    """Convert a NumPy scalar to a JSON-friendly number, None for NaN"""
+    value = float(value)
+    return None if np.isnan(value) else round(value, digits)
+
+
+def duration_percentiles(snapshot, percentiles=(50, 90), since=None):
+    """Duration percentiles per activity type"""
+    selected = snapshot.mask(since=since)
+    codes, durations = snapshot.type_code[selected], snapshot.duration[selected]
+    group_count = len(snapshot.activity_types)
+    table = grouped_percentiles(codes, durations, group_count, percentiles)
+    counts = np.bincount(codes, minlength=group_count)
+    return {
+        activity_type: {
+            'count': int(counts[code]),
+            **{f'p{p:g}': _clean(table[code, column]) for column, p in enumerate(percentiles)},
+        }
+        for code, activity_type in enumerate(snapshot.activity_types)
+        if counts[code]
+    }
+
+
+def calories_per_minute_histogram(snapshot, bins=20, activity_type=None, since=None):
+    """Histogram of calories burned per minute of activity"""
+    selected = snapshot.mask(activity_type, since) & (snapshot.duration > 0)
+    rates = snapshot.calories[selected] / snapshot.duration[selected]
+    counts, edges = np.histogram(rates, bins=bins)
+    return {
+        'count': int(rates.size),
+        'mean': _clean(rates.mean()) if rates.size else None,
+        'bins': [
+            {'min': _clean(edges[i]), 'max': _clean(edges[i + 1]), 'count': int(count)}
+            for i, count in enumerate(counts)
+        ],
+    }
+
+
+def team_comparison(snapshot, activity_type=None, since=None):
+    """Grouped totals, means and calories-per-minute percentiles per team"""
+    selected = snapshot.mask(activity_type, since)
+    codes = snapshot.team_code[selected]
+    group_count = len(snapshot.team_ids)
+    counts = np.bincount(codes, minlength=group_count)
+    duration = np.bincount(codes, weights=snapshot.duration[selected], minlength=group_count)
+    calories = np.bincount(codes, weights=snapshot.calories[selected], minlength=group_count)
+    distance = np.bincount(
+        codes, weights=np.nan_to_num(snapshot.distance[selected]), minlength=group_count
+    )
+    members = np.bincount(
+        snapshot.user_team[np.unique(snapshot.user_code[selected])], minlength=group_count
+    )
+    active = snapshot.duration[selected] > 0
+    rates = grouped_percentiles(
+        codes[active],
+        snapshot.calories[selected][active] / snapshot.duration[selected][active],
+        group_count,
+        (50, 90),
+    )
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_calories = calories / counts
+    return [
+        {
+            'team_id': team_id,
+            'active_members': int(members[code]),
+            'total_activities': int(counts[code]),
+            'total_duration': int(duration[code]),
+            'total_calories': int(calories[code]),
+            'total_distance': _clean(distance[code]),
+            'mean_calories': _clean(mean_calories[code]),
+            'calories_per_minute_p50': _clean(rates[code, 0]),
+            'calories_per_minute_p90': _clean(rates[code, 1]),
+        }
+        for code, team_id in enumerate(snapshot.team_ids)
+        if counts[code]
+    ]
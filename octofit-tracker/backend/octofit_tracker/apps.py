@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class OctofitTrackerConfig(AppConfig):
+    name = 'octofit_tracker'
+    
+    def ready(self):
+        from . import instrumentation, monitoring, signals  # noqa: F401
+        monitoring.register()
+        instrumentation.register()
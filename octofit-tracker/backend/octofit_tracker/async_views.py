@@ -0,0 +1,133 @@
+"""
+Async read endpoints for OctoFit Tracker
+
+Served under /api/async/, these mirror the hottest polling endpoints with
+native async views backed by motor instead of djongo's blocking client,
+so an ASGI worker keeps many requests waiting on MongoDB at once:
+
+    uvicorn octofit_tracker.asgi:application --workers 4
+
+They are meant to be served over ASGI. Under WSGI each request runs on a
+fresh event loop with its own motor client and connection pool, opened and
+closed for that request alone, which is slower than the DRF endpoints.
+
+Responses are byte-identical to the matching DRF endpoints. Sparse
+fieldsets and ?expand= are only offered by the DRF endpoints.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.http import HttpResponse
+from rest_framework.utils.urls import replace_query_param
+from .models import Team, Activity, Leaderboard, DailyTotal
+from .pagination import ActivityPagination
+from .renderers import ORJSONRenderer
+from .serializers import ActivitySerializer, LeaderboardSerializer
+from . import leaderboard, mongo
+
+
+def json_response(data, status=200):
+    return HttpResponse(
+        ORJSONRenderer().render(data), status=status, content_type=ORJSONRenderer.media_type
+    )
+
+
+def error_response(message, status=400):
+    return json_response({'error': message}, status)
+
+
+def not_found(detail='Not found.'):
+    # Same body as DRF's NotFound
+    return json_response({'detail': detail}, 404)
+
+
+async def collection(model):
+    return (await mongo.get_async_database())[model._meta.db_table]
+
+
+async def leaderboard_top(request):
+    """Get top N entries from leaderboard, all-time or over a ?window="""
+    try:
+        limit = int(request.GET.get('limit', 10))
+    except ValueError:
+        limit = None
+    # limit(0) and negative limits mean "no limit" to MongoDB
+    if limit is None or not 1 <= limit <= leaderboard.MAX_TOP_LIMIT:
+        return error_response(f'limit must be an integer between 1 and {leaderboard.MAX_TOP_LIMIT}')
+    window = request.GET.get('window')
+    if window is not None:
+        if window not in leaderboard.WINDOWS:
+            return error_response(f"window must be one of: {', '.join(leaderboard.WINDOWS)}")
+        cursor = (await collection(DailyTotal)).aggregate(leaderboard.windowed_pipeline(window, limit=limit))
+        return json_response(leaderboard.ranked_board(await cursor.to_list(None), window))
+    cursor = (await collection(Leaderboard)).find({}).sort([(leaderboard.RANK_FIELD, -1), ('_id', 1)]).limit(limit)
+    entries = leaderboard.ranks_from_top(await cursor.to_list(None))
+    return json_response(LeaderboardSerializer(entries, many=True).data)
+
+
+def _decode_cursor(encoded):
+    """Decode a keyset cursor issued by ActivityPagination into (day, ObjectId)"""
+    day, oid = json.loads(urlsafe_b64decode(encoded.encode()))
+    return leaderboard.mongo_day(date.fromisoformat(day)), ObjectId(oid)
+
+
+def _encode_cursor(document):
+    values = [document['date'].date().isoformat(), str(document['_id'])]
+    return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+async def activities_by_user(request):
+    """Get one keyset page of a user's activities, newest first"""
+    user_id = request.GET.get('user_id')
+    if not user_id:
+        return error_response('user_id parameter is required')
+    paginator = ActivityPagination
+    try:
+        page_size = min(max(int(request.GET[paginator.page_size_query_param]), 1), paginator.max_page_size)
+    except (KeyError, ValueError):
+        page_size = paginator.page_size
+
+    query = {'user_id': user_id}
+    encoded = request.GET.get(paginator.cursor_query_param)
+    if encoded is not None:
+        try:
+            day, oid = _decode_cursor(encoded)
+        except Exception:
+            return not_found(paginator.invalid_cursor_message)
+        query['$or'] = [{'date': {'$lt': day}}, {'date': day, '_id': {'$gt': oid}}]
+
+    cursor = (await collection(Activity)).find(query).sort([('date', -1), ('_id', 1)]).limit(page_size + 1)
+    documents = await cursor.to_list(None)
+    page = documents[:page_size]
+    next_link = None
+    if len(documents) > page_size:
+        next_link = replace_query_param(
+            request.build_absolute_uri(), paginator.cursor_query_param, _encode_cursor(page[-1])
+        )
+    return json_response({
+        'next': next_link,
+        'results': ActivitySerializer(page, many=True).data,
+    })
+
+
+async def team_stats(request, pk):
+    """Get team statistics in a single database round trip"""
+    try:
+        team_oid = ObjectId(pk)
+    except (InvalidId, TypeError):
+        return not_found()
+    teams = await collection(Team)
+    parts = await teams.aggregate(leaderboard.team_stats_pipeline(team_oid)).to_list(None)
+    stats = leaderboard.merge_team_stats(team_oid, parts)
+    if stats is None:
+        return not_found()
+    return json_response({
+        'team_id': stats['team_id'],
+        'team_name': stats['team_name'],
+        'total_activities': stats['total_activities'],
+        'total_calories': stats['total_calories'],
+        'total_distance': stats['total_distance'],
+        'member_count': stats['member_count'],
+    })
@@ -0,0 +1,124 @@
+"""
+Conditional GET for OctoFit Tracker ViewSets
+
+ETags and Last-Modified dates are derived from the per-collection version
+documents of the response cache, which every process shares, so
+If-None-Match / If-Modified-Since are answered with 304 Not Modified
+before any queryset is evaluated.
+
+CompressionMiddleware keeps compressed ETags strong by tagging them with
+the content coding ("<digest>-gzip"), so validators sent back by clients
+are stripped of that suffix before they are compared. Last-Modified has
+one second resolution while versions change with every write, so it is
+only sent once the second it names is over; clients that send an ETag
+are answered from the ETag alone.
+"""
+import time
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags
+from . import response_cache
+
+# Content codings CompressionMiddleware can append to a strong ETag
+ENCODINGS = ('br', 'gzip')
+
+
+def encoded_etag(etag, coding):
+    """Return the strong ETag of `etag`'s representation compressed with `coding`"""
+    if not etag.startswith('"'):
+        return etag
+    return f'{etag[:-1]}-{coding}"'
+
+
+def representation_etag(etag):
+    """Strip the content coding suffix encoded_etag adds, leaving other ETags alone"""
+    for coding in ENCODINGS:
+        suffix = f'-{coding}"'
+        if etag.startswith('"') and etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
+
+
+def _strip_encodings(request, header):
+    """Rewrite an If-None-Match/If-Match header to the uncompressed ETags; return the tags sent"""
+    value = request.META.get(header)
+    if not value:
+        return []
+    sent = parse_etags(value)
+    if sent != ['*']:
+        request.META[header] = ', '.join(representation_etag(etag) for etag in sent)
+    return sent
+
+
+class ConditionalResponse(Exception):
+    """Short-circuits a request with a 304 or 412 response"""
+
+    def __init__(self, response):
+        super().__init__(response.status_code)
+        self.response = response
+
+
+class ConditionalGetMixin:
+    """Adds strong ETags and Last-Modified to GET responses and honours conditional requests"""
+    
+    # Models whose collections a ViewSet's responses read; defaults to the queryset model
+    etag_models = None
+    
+    def get_etag_models(self):
+        if self.etag_models is not None:
+            return self.etag_models
+        return (self.queryset.model,)
+    
+    def get_etag_extra(self):
+        """Other state the responses depend on, or None to skip validators for this request"""
+        return ()
+    
+    def validators(self, request):
+        """Return (etag, last_modified) for a read request, or None"""
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        extra = self.get_etag_extra()
+        if extra is None:
+            return None
+        digest, last_modified = response_cache.validators(
+            request, self.get_etag_models(), request.accepted_media_type, *extra
+        )
+        if int(last_modified) >= int(time.time()):
+            # A write later this second would not change the header
+            return f'"{digest}"', None
+        return f'"{digest}"', int(last_modified)
+    
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.conditional = self.validators(request)
+        if self.conditional is not None:
+            etag, last_modified = self.conditional
+            sent = _strip_encodings(request, 'HTTP_IF_NONE_MATCH')
+            _strip_encodings(request, 'HTTP_IF_MATCH')
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is not None:
+                if response.status_code == 304:
+                    # A 304 carries the validators the full response would have
+                    # sent, including the coding of the copy the client holds
+                    matched = [tag for tag in sent if representation_etag(tag) == etag]
+                    response.headers['ETag'] = matched[0] if matched else etag
+                    if last_modified is not None:
+                        response.headers['Last-Modified'] = http_date(last_modified)
+                raise ConditionalResponse(response)
+    
+    def handle_exception(self, exc):
+        if isinstance(exc, ConditionalResponse):
+            return exc.response
+        return super().handle_exception(exc)
+    
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method in ('GET', 'HEAD') and response.status_code == 200:
+            # Validators taken before the handler ran can only be older than the
+            # body, never newer; recompute only when there were none yet
+            conditional = getattr(self, 'conditional', None) or self.validators(request)
+            if conditional is not None:
+                etag, last_modified = conditional
+                response.headers.setdefault('ETag', etag)
+                if last_modified is not None:
+                    response.headers.setdefault('Last-Modified', http_date(last_modified))
+        return response
@@ -0,0 +1,82 @@
+"""
+Streaming activity exports for OctoFit Tracker
+
+Rows are read through a server-side MongoDB cursor in fixed-size batches
+and written out batch by batch, so memory stays flat however many
+activities are exported and the first bytes leave immediately.
+"""
+import csv
+import io
+import json
+import zlib
+from .models import Activity
+from .mongo import chunked
+
+EXPORT_FIELDS = (
+    '_id', 'user_id', 'activity_type', 'duration', 'calories_burned',
+    'distance', 'date', 'created_at',
+)
+
+
+def _datetime(value):
+    # Matches DRF's DateTimeField output for UTC values
+    return value.isoformat() + 'Z' if value is not None else None
+
+
+def _date(value):
+    return value.date().isoformat() if value is not None else None
+
+
+CONVERTERS = {
+    '_id': str,
+    'date': _date,
+    'created_at': _datetime,
+}
+
+
+def activity_documents(query, batch_size):
+    """Yield export rows for the activities matching a MongoDB filter, newest first"""
+    cursor = (
+        Activity.objects.mongo_find(query, {field: True for field in EXPORT_FIELDS})
+        .sort([('date', -1), ('_id', 1)])
+        .batch_size(batch_size)
+    )
+    try:
+        for document in cursor:
+            row = {}
+            for field in EXPORT_FIELDS:
+                value = document.get(field)
+                convert = CONVERTERS.get(field)
+                row[field] = convert(value) if convert and value is not None else value
+            yield row
+    finally:
+        cursor.close()
+
+
+def csv_chunks(rows, batch_size):
+    """Yield CSV text one batch of rows at a time, header first"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    yield buffer.getvalue()
+    for batch in chunked(rows, batch_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(batch)
+        yield buffer.getvalue()
+
+
+def ndjson_chunks(rows, batch_size):
+    """Yield NDJSON text one batch of rows at a time"""
+    for batch in chunked(rows, batch_size):
+        yield ''.join(json.dumps(row) + '\n' for row in batch)
+
+
+def gzip_chunks(chunks):
+    """Gzip a stream of text chunks incrementally"""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode('utf-8'))
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,191 @@
+"""
+Per-request database and rendering timings for OctoFit Tracker
+
+A pymongo CommandListener charges every MongoDB command to the request
+being served, which is tracked in a context variable by
+ServerTimingMiddleware. Serializers and the middleware add the time spent
+serializing and rendering, so each response can report where its time
+went. The listener is registered globally before any client is opened, so
+motor's clients carry it too; motor runs each command on a worker thread
+in a copy of the awaiting task's context, so commands from the async views
+are charged to their request like any other.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pymongo import monitoring
+
+# Longest filter shape logged for a slow command
+MAX_FILTER_LENGTH = 200
+
+_current = ContextVar('request_timings', default=None)
+
+
+def query_shape(value):
+    """Replace the values in a filter with '?', keeping its field names and operators"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in map(query_shape, value):
+            if item not in shapes:
+                shapes.append(item)
+        return shapes
+    return '?'
+
+
+def _command_filter(name, command):
+    if name in ('update', 'delete'):
+        statements = command.get(f'{name}s') or [{}]
+        return statements[0].get('q')
+    if name == 'aggregate':
+        pipeline = command.get('pipeline') or [{}]
+        return pipeline[0].get('$match')
+    return command.get('filter', command.get('query'))
+
+
+def filter_summary(name, command):
+    """
+    The shape of a command's filter, truncated, or None if it has none
+
+    Only field names and operators are kept, so logs never carry user data
+    from filters or from the documents being written.
+    """
+    query = _command_filter(name, command)
+    if not isinstance(query, dict):
+        return None
+    summary = json.dumps(query_shape(query), default=str)
+    if len(summary) > MAX_FILTER_LENGTH:
+        summary = summary[:MAX_FILTER_LENGTH - 3] + '...'
+    return summary
+
+
+class RequestTimings:
+    """Query count and time spent per phase while serving one request"""
+
+    def __init__(self, slow_query_seconds=None):
+        self.started = time.perf_counter()
+        self.slow_query_seconds = slow_query_seconds
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.render_seconds = 0.0
+        self.slow_queries = []
+        self._pending = {}
+        self._phases = {}
+        # Motor's worker threads can finish commands of one request concurrently
+        self._lock = threading.Lock()
+
+    def command_started(self, event):
+        self._pending[event.request_id] = event
+
+    def command_finished(self, event, failed=False):
+        started = self._pending.pop(event.request_id, None)
+        seconds = event.duration_micros / 1e6
+        with self._lock:
+            self.queries += 1
+            self.db_seconds += seconds
+        if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds and started:
+            collection = started.command.get(started.command_name)
+            self.slow_queries.append({
+                'command': started.command_name,
+                'database': started.database_name,
+                'collection': collection if isinstance(collection, str) else None,
+                'filter': filter_summary(started.command_name, started.command),
+                'duration_ms': round(seconds * 1000, 3),
+                'failed': failed,
+            })
+
+    def begin(self, name):
+        """Start timing a phase; returns False if it is already being timed"""
+        if name in self._phases:
+            return False
+        self._phases[name] = (time.perf_counter(), self.db_seconds)
+        return True
+
+    def end(self, name):
+        """Add the time since begin() to `<name>_seconds`, less database time inside it"""
+        started, db_before = self._phases.pop(name)
+        elapsed = time.perf_counter() - started - (self.db_seconds - db_before)
+        setattr(self, f'{name}_seconds', getattr(self, f'{name}_seconds') + max(elapsed, 0.0))
+
+    @contextmanager
+    def phase(self, name):
+        """Time a block as `name`; nested blocks of the same phase count once"""
+        if not self.begin(name):
+            yield
+            return
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    @property
+    def total_seconds(self):
+        return time.perf_counter() - self.started
+
+    def metrics(self):
+        """Return (name, milliseconds, description) for each Server-Timing metric"""
+        return [
+            ('db', self.db_seconds * 1000, f'{self.queries} quer{"y" if self.queries == 1 else "ies"}'),
+            ('serialize', self.serialize_seconds * 1000, None),
+            ('render', self.render_seconds * 1000, None),
+            ('total', self.total_seconds * 1000, None),
+        ]
+
+
+def start(slow_query_seconds=None):
+    """Begin timing a request in the current context"""
+    timings = RequestTimings(slow_query_seconds)
+    _current.set(timings)
+    return timings
+
+
+def stop():
+    # Not a token reset: async middleware may stop in a different context copy
+    _current.set(None)
+
+
+def current():
+    """Return the timings of the request being served, or None"""
+    return _current.get()
+
+
+@contextmanager
+def phase(name):
+    """Time a block against the current request, if there is one"""
+    timings = _current.get()
+    if timings is None:
+        yield
+    else:
+        with timings.phase(name):
+            yield
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Charges each MongoDB command to the request that sent it"""
+
+    def started(self, event):
+        timings = _current.get()
+        if timings is not None:
+            timings.command_started(event)
+
+    def succeeded(self, event):
+        timings = _current.get()
+        if timings is not None:
+            timings.command_finished(event)
+
+    def failed(self, event):
+        timings = _current.get()
+        if timings is not None:
+            timings.command_finished(event, failed=True)
+
+
+command_timer = CommandTimer()
+
+
+def register():
+    """Attach the command listener to every MongoClient created from now on, motor's included"""
+    monitoring.register(command_timer)
@@ -0,0 +1,663 @@
+"""
+Leaderboard maintenance for OctoFit Tracker
+
+Totals are kept current incrementally: every Activity write applies a delta
+to the owning user's entry with a single atomic ``$inc`` instead of
+recomputing the board. Live ranks come from an in-process RankEngine that
+follows the same writes, and per-day buckets back the time-windowed boards.
+"""
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from pymongo import ReturnDocument, UpdateOne
+from .models import User, Team, Activity, Leaderboard, DailyTotal
+from . import mongo, response_cache
+from .ranking import RankEngine
+
+RANK_FIELD = 'total_calories'
+WINDOWS = ('7d', '30d', 'month')
+# Most entries a top board returns
+MAX_TOP_LIMIT = 1000
+WINDOWED_FIELDS = (
+    'user_id', 'team_id', 'total_activities', 'total_duration', 'total_calories',
+    'total_distance', 'rank', 'window',
+)
+
+# Sync window overlap absorbing clock skew between the writers' updated_at stamps
+SYNC_OVERLAP = timedelta(seconds=30)
+
+# Holds activity writes back while a rebuild swaps in its board
+FENCE_COLLECTION = 'leaderboard_fence'
+# Seconds an activity write that passed the fence just before it was raised may still take
+FENCE_GRACE_SECONDS = 2
+FENCE_POLL_SECONDS = 0.05
+
+_engine = RankEngine()
+_engine_synced_at = None
+_engine_checked_at = None
+
+
+def _engine_scores(query=None):
+    for entry in Leaderboard.objects.mongo_find(query or {}, {'_id': False, 'user_id': True, RANK_FIELD: True}):
+        yield entry['user_id'], entry.get(RANK_FIELD, 0)
+
+
+def rank_engine():
+    """
+    Return the process-wide RankEngine
+
+    The engine is loaded once and then follows this process's writes through
+    apply_delta and the leaderboard signals. At most every
+    LEADERBOARD_RANK_REFRESH_SECONDS it also catches up on entries other
+    processes updated since the last sync, using the updated_at index, and
+    reloads only when the entry count shows deletions it cannot see.
+    """
+    global _engine_synced_at, _engine_checked_at
+    with _engine.lock:
+        checked = time.monotonic()
+        if _engine_checked_at is not None and checked - _engine_checked_at <= settings.LEADERBOARD_RANK_REFRESH_SECONDS:
+            return _engine
+        started = timezone.now()
+        if _engine_synced_at is None:
+            _engine.load(_engine_scores())
+        else:
+            for user_id, score in _engine_scores({'updated_at': {'$gte': _engine_synced_at - SYNC_OVERLAP}}):
+                _engine.update(user_id, score)
+            if Leaderboard.objects.mongo_estimated_document_count() != len(_engine):
+                _engine.load(_engine_scores())
+        _engine_synced_at, _engine_checked_at = started, checked
+    return _engine
+
+
+def reset_rank_engine():
+    """Force the next rank_engine() call to reload from the database"""
+    global _engine_synced_at, _engine_checked_at
+    with _engine.lock:
+        _engine.clear()
+        _engine_synced_at = _engine_checked_at = None
+
+
+def entry_saved(entry):
+    """Keep the rank engine in step with a directly written leaderboard entry"""
+    if _engine_synced_at is not None:
+        _engine.update(entry.user_id, getattr(entry, RANK_FIELD))
+
+
+def entry_deleted(entry):
+    """Drop a deleted leaderboard entry from the rank engine"""
+    if _engine_synced_at is not None:
+        _engine.remove(entry.user_id)
+
+
+def _score(row):
+    return row[RANK_FIELD] if isinstance(row, dict) else getattr(row, RANK_FIELD)
+
+
+def _set_rank(row, rank):
+    if isinstance(row, dict):
+        row['rank'] = rank
+    else:
+        row.rank = rank
+
+
+def live_ranks(rows):
+    """Set the rank of leaderboard rows (dicts or entries) from the rank engine"""
+    engine = rank_engine()
+    for row in rows:
+        _set_rank(row, engine.rank_for_score(_score(row)))
+    return rows
+
+
+def ranks_from_top(rows):
+    """Give rows read best first from the top of the board their competition ranks"""
+    rank, previous_score = 0, None
+    for position, row in enumerate(rows, start=1):
+        if _score(row) != previous_score:
+            rank, previous_score = position, _score(row)
+        _set_rank(row, rank)
+    return rows
+
+
+def activity_delta(activity, sign=1):
+    """Return the totals contributed (sign=1) or withdrawn (sign=-1) by an activity"""
+    return {
+        'total_activities': sign,
+        'total_duration': sign * activity.duration,
+        'total_calories': sign * activity.calories_burned,
+        'total_distance': sign * (activity.distance or 0.0),
+    }
+
+
+def merge_deltas(*deltas):
+    """Sum several deltas field by field"""
+    merged = {}
+    for delta in deltas:
+        for field, value in delta.items():
+            merged[field] = merged.get(field, 0) + value
+    return merged
+
+
+def team_id_for(user_id):
+    """Look up the team of a user, or '' if the user is unknown"""
+    try:
+        oid = ObjectId(user_id)
+    except (InvalidId, TypeError):
+        return ''
+    team_id = User.objects.filter(_id=oid).values_list('team_id', flat=True).first()
+    return team_id or ''
+
+
+def mongo_day(day):
+    """Return a date as the naive midnight datetime djongo stores DateFields as"""
+    return datetime(day.year, day.month, day.day)
+
+
+def _increment(manager, key, delta, now, projection=None):
+    """Atomically $inc a document matched by key, upserting it with the user's team on first write"""
+    document = manager.mongo_find_one_and_update(
+        key,
+        {'$inc': delta, '$set': {'updated_at': now}},
+        projection=projection,
+        return_document=ReturnDocument.AFTER,
+    )
+    if document is None:
+        # First write for this key: the key is unique, so concurrent first
+        # writers converge on a single document
+        document = mongo.upsert(
+            manager.mongo_find_one_and_update,
+            key,
+            {
+                '$inc': delta,
+                '$set': {'updated_at': now},
+                '$setOnInsert': {'team_id': team_id_for(key['user_id'])},
+            },
+            projection=projection,
+            return_document=ReturnDocument.AFTER,
+            upsert=True,
+        )
+    return document
+
+
+def teams_for(user_ids):
+    """Map user ids to their team ids with a single query"""
+    oids = []
+    for user_id in user_ids:
+        try:
+            oids.append(ObjectId(user_id))
+        except (InvalidId, TypeError):
+            pass
+    return {
+        str(_id): team_id or ''
+        for _id, team_id in User.objects.filter(_id__in=oids).values_list('_id', 'team_id')
+    }
+
+
+def apply_delta(user_id, delta, day=None):
+    """Atomically increment a user's all-time totals and, given a day, that day's bucket"""
+    now = timezone.now()
+    entry = _increment(
+        Leaderboard.objects, {'user_id': user_id}, delta, now, projection={RANK_FIELD: True},
+    )
+    if day is not None:
+        _increment(
+            DailyTotal.objects, {'user_id': user_id, 'day': mongo_day(day)}, delta, now,
+            projection={'_id': True},
+        )
+    response_cache.bump(Leaderboard, DailyTotal)
+    if _engine_synced_at is not None:
+        _engine.update(user_id, entry[RANK_FIELD])
+
+
+def activity_created(activity):
+    """Add a new activity to its owner's totals"""
+    apply_delta(activity.user_id, activity_delta(activity), activity.date)
+
+
+def activities_created(activities):
+    """Add many new activities to their owners' totals with one bulk write per collection"""
+    user_deltas, day_deltas = {}, {}
+    for activity in activities:
+        delta = activity_delta(activity)
+        user_deltas[activity.user_id] = merge_deltas(user_deltas.get(activity.user_id, {}), delta)
+        day_key = (activity.user_id, activity.date)
+        day_deltas[day_key] = merge_deltas(day_deltas.get(day_key, {}), delta)
+    if not user_deltas:
+        return
+
+    teams = teams_for(user_deltas)
+    now = timezone.now()
+    mongo.bulk_upsert(Leaderboard.objects.mongo_bulk_write, [
+        UpdateOne(
+            {'user_id': user_id},
+            {
+                '$inc': delta,
+                '$set': {'updated_at': now},
+                '$setOnInsert': {'team_id': teams.get(user_id, '')},
+            },
+            upsert=True,
+        )
+        for user_id, delta in user_deltas.items()
+    ])
+    mongo.bulk_upsert(DailyTotal.objects.mongo_bulk_write, [
+        UpdateOne(
+            {'user_id': user_id, 'day': mongo_day(day)},
+            {
+                '$inc': delta,
+                '$set': {'updated_at': now},
+                '$setOnInsert': {'team_id': teams.get(user_id, '')},
+            },
+            upsert=True,
+        )
+        for (user_id, day), delta in day_deltas.items()
+    ])
+    response_cache.bump(Leaderboard, DailyTotal)
+
+    if _engine_synced_at is not None:
+        for entry in Leaderboard.objects.mongo_find(
+            {'user_id': {'$in': list(user_deltas)}},
+            {'user_id': True, RANK_FIELD: True},
+        ):
+            _engine.update(entry['user_id'], entry[RANK_FIELD])
+
+
+def team_changed(user_id, team_id):
+    """
+    Move a user's entry, and their buckets from today on, to their current team
+
+    Earlier buckets keep the team the user was in at the time, so windowed
+    team boards credit past activity to the team it was logged for.
+    """
+    Leaderboard.objects.mongo_update_one({'user_id': user_id}, {'$set': {'team_id': team_id}})
+    DailyTotal.objects.mongo_update_many(
+        {'user_id': user_id, 'day': {'$gte': mongo_day(timezone.localdate())}},
+        {'$set': {'team_id': team_id}},
+    )
+    response_cache.bump(Leaderboard, DailyTotal)
+
+
+def activity_updated(previous, activity):
+    """Move an edited activity's contribution from its old to its new values"""
+    if (previous.user_id, previous.date) == (activity.user_id, activity.date):
+        apply_delta(activity.user_id, merge_deltas(
+            activity_delta(previous, sign=-1),
+            activity_delta(activity),
+        ), activity.date)
+    else:
+        apply_delta(previous.user_id, activity_delta(previous, sign=-1), previous.date)
+        apply_delta(activity.user_id, activity_delta(activity), activity.date)
+
+
+def activity_deleted(activity):
+    """Withdraw a deleted activity from its owner's totals"""
+    apply_delta(activity.user_id, activity_delta(activity, sign=-1), activity.date)
+
+
+def window_start(window, today=None):
+    """Return the first day covered by a leaderboard window"""
+    today = today or timezone.localdate()
+    if window == '7d':
+        return today - timedelta(days=6)
+    if window == '30d':
+        return today - timedelta(days=29)
+    if window == 'month':
+        return today.replace(day=1)
+    raise ValueError(f'Unknown leaderboard window: {window}')
+
+
+def windowed_pipeline(window, team_id=None, limit=None):
+    """Aggregation over the daily buckets summing each user's totals in a window, best first"""
+    match = {'day': {'$gte': mongo_day(window_start(window))}}
+    if team_id:
+        match['team_id'] = team_id
+    pipeline = [
+        {'$match': match},
+        # Users who changed team are shown in the team of their latest bucket
+        {'$sort': {'day': 1}},
+        {'$group': {
+            '_id': '$user_id',
+            'team_id': {'$last': '$team_id'},
+            'total_activities': {'$sum': '$total_activities'},
+            'total_duration': {'$sum': '$total_duration'},
+            'total_calories': {'$sum': '$total_calories'},
+            'total_distance': {'$sum': '$total_distance'},
+        }},
+        {'$match': {'total_activities': {'$gt': 0}}},
+        {'$sort': {RANK_FIELD: -1, '_id': 1}},
+    ]
+    if limit is not None:
+        pipeline.append({'$limit': limit})
+    return pipeline
+
+
+def ranked_board(rows, window):
+    """Give windowed totals competition ranks in the shape of leaderboard rows"""
+    board = []
+    rank, previous_score = 0, None
+    for position, row in enumerate(rows, start=1):
+        if row[RANK_FIELD] != previous_score:
+            rank, previous_score = position, row[RANK_FIELD]
+        board.append({
+            'user_id': row['_id'],
+            'team_id': row['team_id'],
+            'total_activities': row['total_activities'],
+            'total_duration': row['total_duration'],
+            'total_calories': row['total_calories'],
+            'total_distance': round(row['total_distance'], 2),
+            'rank': rank,
+            'window': window,
+        })
+    return board
+
+
+def windowed_board(window, team_id=None, limit=None):
+    """Rank users by their totals over a window, summing at most 31 daily buckets each"""
+    rows = DailyTotal.objects.mongo_aggregate(windowed_pipeline(window, team_id, limit))
+    return ranked_board(rows, window)
+
+
+def team_stats_pipeline(team_oid):
+    """Aggregation on the teams collection yielding a team's name, leaderboard totals and member count"""
+    team_id = str(team_oid)
+    return [
+        {'$match': {'_id': team_oid}},
+        {'$project': {'_id': False, 'team_name': '$name'}},
+        {'$unionWith': {'coll': Leaderboard._meta.db_table, 'pipeline': [
+            {'$match': {'team_id': team_id}},
+            {'$group': {
+                '_id': None,
+                'total_activities': {'$sum': '$total_activities'},
+                'total_calories': {'$sum': '$total_calories'},
+                'total_distance': {'$sum': '$total_distance'},
+            }},
+            {'$project': {'_id': False}},
+        ]}},
+        {'$unionWith': {'coll': User._meta.db_table, 'pipeline': [
+            {'$match': {'team_id': team_id}},
+            {'$count': 'member_count'},
+        ]}},
+    ]
+
+
+def merge_team_stats(team_oid, parts):
+    """Combine the documents of team_stats_pipeline, or return None if the team does not exist"""
+    stats = {
+        'team_id': str(team_oid),
+        'total_activities': 0,
+        'total_calories': 0,
+        'total_distance': 0.0,
+        'member_count': 0,
+    }
+    for part in parts:
+        stats.update(part)
+    if 'team_name' not in stats:
+        return None
+    stats['total_distance'] = round(stats['total_distance'], 2)
+    return stats
+
+
+def team_stats(team_oid):
+    """
+    Return a team's name, summed leaderboard totals and member count from one
+    aggregation, or None if the team does not exist
+    """
+    return merge_team_stats(team_oid, Team.objects.mongo_aggregate(team_stats_pipeline(team_oid)))
+
+
+def team_dashboard(team_oid):
+    """
+    Return a team document with its members, its leaderboard entries (best
+    first, with live ranks) and summed totals from one aggregation, or None if the team does
+    not exist
+    """
+    team_id = str(team_oid)
+    pipeline = [
+        {'$match': {'_id': team_oid}},
+        {'$lookup': {
+            'from': User._meta.db_table,
+            'pipeline': [
+                {'$match': {'team_id': team_id}},
+                {'$project': {'password': False}},
+                {'$sort': {'name': 1, '_id': 1}},
+            ],
+            'as': 'members',
+        }},
+        {'$lookup': {
+            'from': Leaderboard._meta.db_table,
+            'pipeline': [
+                {'$match': {'team_id': team_id}},
+                {'$sort': {RANK_FIELD: -1, '_id': 1}},
+            ],
+            'as': 'leaderboard',
+        }},
+        {'$addFields': {'stats': {
+            'total_activities': {'$sum': '$leaderboard.total_activities'},
+            'total_calories': {'$sum': '$leaderboard.total_calories'},
+            'total_distance': {'$sum': '$leaderboard.total_distance'},
+            'member_count': {'$size': '$members'},
+        }}},
+    ]
+    documents = list(Team.objects.mongo_aggregate(pipeline))
+    if not documents:
+        return None
+    dashboard = documents[0]
+    previous_score = None
+    for position, entry in enumerate(dashboard['leaderboard'], start=1):
+        if entry.get(RANK_FIELD) != previous_score:
+            team_rank, previous_score = position, entry.get(RANK_FIELD)
+        entry['team_rank'] = team_rank
+    live_ranks(dashboard['leaderboard'])
+    dashboard['stats']['total_distance'] = round(dashboard['stats']['total_distance'], 2)
+    return dashboard
+
+
+def rebuild_daily_totals():
+    """Recompute every daily bucket from the activities collection in one aggregation"""
+    teams = {str(_id): team_id or '' for _id, team_id in User.objects.values_list('_id', 'team_id')}
+    pipeline = [
+        {'$group': {
+            '_id': {'user_id': '$user_id', 'day': '$date'},
+            'total_activities': {'$sum': 1},
+            'total_duration': {'$sum': '$duration'},
+            'total_calories': {'$sum': '$calories_burned'},
+            'total_distance': {'$sum': {'$ifNull': ['$distance', 0]}},
+        }},
+    ]
+    now = timezone.now()
+    buckets = [
+        {
+            'user_id': row['_id']['user_id'],
+            'team_id': teams.get(row['_id']['user_id'], ''),
+            'day': row['_id']['day'],
+            'total_activities': row['total_activities'],
+            'total_duration': row['total_duration'],
+            'total_calories': row['total_calories'],
+            'total_distance': row['total_distance'],
+            'updated_at': now,
+        }
+        for row in Activity.objects.mongo_aggregate(pipeline, allowDiskUse=True)
+    ]
+    DailyTotal.objects.mongo_delete_many({})
+    if buckets:
+        DailyTotal.objects.mongo_insert_many(buckets)
+    response_cache.bump(DailyTotal)
+    return len(buckets)
+
+
+def _aggregate_totals(activities, user_ids=None):
+    """Sum every user's activities in one aggregation, optionally restricted to some users"""
+    pipeline = []
+    if user_ids is not None:
+        pipeline.append({'$match': {'user_id': {'$in': user_ids}}})
+    pipeline.append({'$group': {
+        '_id': '$user_id',
+        'total_activities': {'$sum': 1},
+        'total_duration': {'$sum': '$duration'},
+        'total_calories': {'$sum': '$calories_burned'},
+        'total_distance': {'$sum': {'$ifNull': ['$distance', 0]}},
+    }})
+    return list(activities.aggregate(pipeline, allowDiskUse=True))
+
+
+def _init_shard_worker():
+    import django
+    django.setup()
+
+
+def _aggregate_shard(alias, user_ids):
+    """Worker entry point: aggregate one team's totals over a fresh connection"""
+    client = mongo.new_client(alias)
+    try:
+        activities = client[mongo.database_name(alias)][Activity._meta.db_table]
+        return _aggregate_totals(activities, user_ids)
+    finally:
+        client.close()
+
+
+def _fence():
+    return mongo.get_database()[FENCE_COLLECTION]
+
+
+def rebuild_in_progress():
+    """Whether a leaderboard rebuild is swapping in its board and holding activity writes back"""
+    return _fence().find_one({'_id': 'rebuild', 'until': {'$gt': timezone.now()}}, {'_id': True}) is not None
+
+
+def wait_for_rebuild():
+    """
+    Block until no leaderboard rebuild is swapping in its board
+
+    Activity writers call this before writing the activity, so its totals are
+    either replayed into the rebuilt board or applied to it after the swap,
+    never both and never neither.
+    """
+    while rebuild_in_progress():
+        time.sleep(FENCE_POLL_SECONDS)
+
+
+def _drain_writers():
+    """Let activity writes that passed wait_for_rebuild before the fence went up finish"""
+    time.sleep(FENCE_GRACE_SECONDS)
+
+
+@contextmanager
+def _writes_fenced():
+    """Hold activity writes back, in every process, for the duration of the block"""
+    until = timezone.now() + timedelta(seconds=settings.LEADERBOARD_REBUILD_FENCE_SECONDS)
+    _fence().replace_one({'_id': 'rebuild'}, {'until': until}, upsert=True)
+    try:
+        _drain_writers()
+        yield
+    finally:
+        _fence().delete_one({'_id': 'rebuild'})
+
+
+def _touched_since(collections, since):
+    """Users whose entries or buckets in any of `collections` were incremented since a moment"""
+    user_ids = set()
+    for collection in collections:
+        user_ids.update(collection.distinct('user_id', {'updated_at': {'$gte': since - SYNC_OVERLAP}}))
+    return user_ids
+
+
+def _replay(db, target, user_ids, now):
+    """Overwrite some users' entries in `target` with totals recomputed from their activities"""
+    if not user_ids:
+        return
+    user_ids = list(user_ids)
+    totals = {row['_id']: row for row in _aggregate_totals(db[Activity._meta.db_table], user_ids)}
+    teams = teams_for(user_ids)
+    target.bulk_write([
+        UpdateOne({'user_id': user_id}, {'$set': {
+            'team_id': teams.get(user_id, ''),
+            'total_activities': totals.get(user_id, {}).get('total_activities', 0),
+            'total_duration': totals.get(user_id, {}).get('total_duration', 0),
+            'total_calories': totals.get(user_id, {}).get('total_calories', 0),
+            'total_distance': round(totals.get(user_id, {}).get('total_distance', 0.0), 2),
+            'updated_at': now,
+        }}, upsert=True)
+        for user_id in user_ids
+    ], ordered=False)
+
+
+def rebuild_leaderboard(parallel=0, batch_size=1000, alias='default'):
+    """
+    Recompute totals and ranks for every user and atomically swap them in
+
+    The board is built in a shadow collection with bulk inserts and renamed
+    over the live one, so readers never see a partially ranked board.
+    Activity writes are then fenced off (see wait_for_rebuild), users whose
+    totals were incremented while the board was aggregated are re-aggregated
+    into the shadow, and the shadow is swapped in before writes resume, so no
+    increment is counted twice or lost with the replaced collection. With
+    parallel > 1 the aggregation is sharded by team across processes.
+    """
+    started = timezone.now()
+    members = {str(_id): team_id or '' for _id, team_id in User.objects.values_list('_id', 'team_id')}
+    db = mongo.get_database(alias)
+
+    if parallel > 1:
+        shards = defaultdict(list)
+        for user_id, team_id in members.items():
+            shards[team_id].append(user_id)
+        # pymongo clients must not cross a fork
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=parallel, initializer=_init_shard_worker) as pool:
+            results = pool.map(_aggregate_shard, [alias] * len(shards), shards.values())
+            rows = [row for shard_rows in results for row in shard_rows]
+        db = mongo.get_database(alias)
+    else:
+        rows = _aggregate_totals(db[Activity._meta.db_table])
+
+    totals = {row['_id']: row for row in rows}
+    now = timezone.now()
+    entries = []
+    for user_id, team_id in members.items():
+        row = totals.get(user_id, {})
+        entries.append({
+            'user_id': user_id,
+            'team_id': team_id,
+            'total_activities': row.get('total_activities', 0),
+            'total_duration': row.get('total_duration', 0),
+            'total_calories': row.get('total_calories', 0),
+            'total_distance': round(row.get('total_distance', 0.0), 2),
+            'rank': 0,
+            'updated_at': now,
+        })
+
+    # Competition ranking: tied scores share a rank
+    entries.sort(key=lambda entry: (-entry[RANK_FIELD], entry['user_id']))
+    previous_score = None
+    for position, entry in enumerate(entries, start=1):
+        if entry[RANK_FIELD] != previous_score:
+            rank, previous_score = position, entry[RANK_FIELD]
+        entry['rank'] = rank
+
+    live_name = Leaderboard._meta.db_table
+    live = db[live_name]
+    shadow = db[f'{live_name}_shadow']
+    shadow.drop()
+    for chunk in mongo.chunked(entries, batch_size):
+        shadow.insert_many(chunk, ordered=False)
+    if entries:
+        for name, info in live.index_information().items():
+            if name != '_id_':
+                shadow.create_index(info['key'], name=name, unique=info.get('unique', False))
+        daily = db[DailyTotal._meta.db_table]
+        with _writes_fenced():
+            _replay(db, shadow, _touched_since([live, daily], started), timezone.now())
+            # Stamp the swap time so other processes' rank engines pick up every entry on their next sync
+            shadow.update_many({}, {'$set': {'updated_at': timezone.now()}})
+            shadow.rename(live_name, dropTarget=True)
+    else:
+        live.delete_many({})
+
+    response_cache.bump(Leaderboard)
+    reset_rank_engine()
+    return len(entries)
@@ -0,0 +1,98 @@
+"""
+Bulk id resolution for OctoFit Tracker
+
+Leaderboard entries and activities reference users and teams by id
+string. These helpers resolve any number of ids with one ``$in`` query per
+collection, for the batch endpoints and for ``?expand=`` on list views.
+"""
+from bson import ObjectId
+from bson.errors import InvalidId
+from rest_framework.exceptions import ValidationError
+from .models import User, Team
+
+MAX_BATCH_IDS = 1000
+EXPANSIONS = ('user', 'team')
+EXPANDED_FIELDS = ('user_name', 'team_name')
+
+
+def object_ids(ids):
+    """Convert id strings to ObjectIds, skipping any that are not valid"""
+    oids = []
+    for value in ids:
+        try:
+            oids.append(ObjectId(value))
+        except (InvalidId, TypeError):
+            pass
+    return oids
+
+
+def requested_ids(request):
+    """Parse the comma-separated ?ids= of a batch request"""
+    ids = [value.strip() for value in request.query_params.get('ids', '').split(',') if value.strip()]
+    if not ids:
+        raise ValidationError({'error': 'ids parameter is required'})
+    if len(ids) > MAX_BATCH_IDS:
+        raise ValidationError({'error': f'At most {MAX_BATCH_IDS} ids can be requested at once'})
+    invalid = [value for value in ids if not ObjectId.is_valid(value)]
+    if invalid:
+        raise ValidationError({'error': f"Invalid ids: {', '.join(invalid)}"})
+    return list(dict.fromkeys(ids))
+
+
+def in_request_order(rows, ids):
+    """Order serialized rows like the requested ids, dropping ids that were not found"""
+    if any('_id' not in row for row in rows):
+        # ?fields= left out _id, so there is nothing to order by
+        return list(rows)
+    by_id = {row['_id']: row for row in rows}
+    return [by_id[value] for value in ids if value in by_id]
+
+
+def requested_expansions(request):
+    """Parse ?expand=user,team"""
+    names = [name.strip() for name in request.query_params.get('expand', '').split(',') if name.strip()]
+    unknown = set(names) - set(EXPANSIONS)
+    if unknown:
+        raise ValidationError({'error': f"Unknown expansions: {', '.join(sorted(unknown))}"})
+    return names
+
+
+def users_by_id(user_ids):
+    """Map user ids to (name, team_id) with a single query"""
+    return {
+        str(_id): (name, team_id or '')
+        for _id, name, team_id in User.objects.filter(
+            _id__in=object_ids(set(user_ids))
+        ).values_list('_id', 'name', 'team_id')
+    }
+
+
+def team_names(team_ids):
+    """Map team ids to names with a single query"""
+    return {
+        str(_id): name
+        for _id, name in Team.objects.filter(
+            _id__in=object_ids(set(team_ids))
+        ).values_list('_id', 'name')
+    }
+
+
+def expand(rows, expansions):
+    """
+    Add user_name and/or team_name to serialized rows in place, resolved from
+    each row's user_id and team_id (a row without team_id uses its user's team)
+    """
+    if not expansions or not rows:
+        return rows
+    users = users_by_id(row['user_id'] for row in rows if row.get('user_id'))
+    if 'team' in expansions:
+        teams = team_names(
+            row.get('team_id') or users.get(row.get('user_id'), (None, ''))[1] for row in rows
+        )
+    for row in rows:
+        name, team_id = users.get(row.get('user_id'), (None, ''))
+        if 'user' in expansions:
+            row['user_name'] = name
+        if 'team' in expansions:
+            row['team_name'] = teams.get(row.get('team_id') or team_id)
+    return rows
@@ -0,0 +1,87 @@
+import os
+import time
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from octofit_tracker.models import User, Team, Activity
+from octofit_tracker import analytics, leaderboard, response_cache, synthetic, user_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Replace teams, users and activities with deterministic synthetic data at load-test scale '
+        'and rebuild the derived collections (workouts are left untouched)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--teams', type=int, default=10, help='Number of teams')
+        parser.add_argument('--users', type=int, default=1000, help='Number of users')
+        parser.add_argument(
+            '--activities-per-user',
+            type=int,
+            default=100,
+            help='Number of activities generated for every user'
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Seed; the same seed gives the same data')
+        parser.add_argument(
+            '--end-date',
+            type=date.fromisoformat,
+            default=None,
+            help='Last activity date (YYYY-MM-DD, default today); fix it for byte-identical reruns'
+        )
+        parser.add_argument('--days', type=int, default=365, help='Days of history before the end date')
+        parser.add_argument(
+            '--parallel',
+            type=int,
+            default=os.cpu_count() or 1,
+            metavar='N',
+            help='Worker processes generating activities'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help='Documents per insert_many'
+        )
+
+    def handle(self, *args, **options):
+        if options['teams'] < 1 or options['users'] < 0 or options['activities_per_user'] < 0:
+            raise CommandError('--teams must be at least 1; --users and --activities-per-user cannot be negative')
+        if options['days'] < 1:
+            raise CommandError('--days must be at least 1')
+        end_date = options['end_date'] or date.today()
+        total = options['users'] * options['activities_per_user']
+        started = time.perf_counter()
+
+        def progress(inserted):
+            self.stdout.write(f'  {inserted:,}/{total:,} activities', ending='\r')
+
+        self.stdout.write(
+            f"Generating {options['teams']} teams, {options['users']:,} users and {total:,} activities "
+            f"(seed {options['seed']}, ending {end_date})..."
+        )
+        teams, users, activities = synthetic.generate(
+            options['teams'],
+            options['users'],
+            options['activities_per_user'],
+            options['seed'],
+            end_date,
+            days=options['days'],
+            parallel=options['parallel'],
+            batch_size=options['batch_size'],
+            progress=progress,
+        )
+        response_cache.bump(User, Team, Activity)
+        analytics.invalidate_snapshot()
+        self.stdout.write(self.style.SUCCESS(
+            f'Inserted {teams} teams, {users:,} users and {activities:,} activities '
+            f'in {time.perf_counter() - started:.1f}s'
+        ))
+
+        self.stdout.write('Building daily leaderboard buckets...')
+        self.stdout.write(self.style.SUCCESS(f'Created {leaderboard.rebuild_daily_totals():,} daily buckets'))
+        self.stdout.write('Building user activity summaries...')
+        self.stdout.write(self.style.SUCCESS(f'Created {user_stats.rebuild_user_stats():,} user summaries'))
+        self.stdout.write('Rebuilding leaderboard...')
+        count = leaderboard.rebuild_leaderboard(parallel=options['parallel'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt leaderboard with {count:,} entries'))
+        self.stdout.write(self.style.SUCCESS(f'Done in {time.perf_counter() - started:.1f}s'))
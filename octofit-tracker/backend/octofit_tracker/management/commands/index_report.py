@@ -0,0 +1,200 @@
+from datetime import date, timedelta
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from pymongo import monitoring
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from octofit_tracker.models import User, Team, Activity, Leaderboard, DailyTotal, Workout
+from octofit_tracker import leaderboard, mongo
+
+EXPLAINED_COMMANDS = ('find', 'aggregate', 'count', 'distinct')
+
+
+class CommandCapture(monitoring.CommandListener):
+    """Records the MongoDB commands djongo issues while capturing is on"""
+
+    def __init__(self):
+        self.capturing = False
+        self.commands = []
+
+    def started(self, event):
+        if self.capturing and event.command_name in EXPLAINED_COMMANDS:
+            self.commands.append(dict(event.command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def sample(model, field):
+    """Return a real value of a field to filter on, so plans reflect actual data"""
+    value = model.objects.values_list(field, flat=True).first()
+    return value if value is not None else 'sample'
+
+
+def hot_queries():
+    """Return (label, callable) pairs reproducing every ViewSet query"""
+    user_id = sample(Activity, 'user_id')
+    team_oid = sample(Team, '_id')
+    team_id = str(team_oid)
+    email = sample(User, 'email')
+    activity_type = sample(Activity, 'activity_type')
+    difficulty = sample(Workout, 'difficulty')
+    workout_type = sample(Workout, 'activity_type')
+    yesterday = leaderboard.mongo_day(date.today() - timedelta(days=1))
+    page = 101
+    return [
+        ('users by_team', lambda: list(User.objects.filter(team_id=team_id))),
+        ('users by_email', lambda: list(User.objects.filter(email=email))),
+        ('activities list', lambda: list(Activity.objects.order_by('-date', '_id')[:page])),
+        ('activities by_user', lambda: list(
+            Activity.objects.filter(user_id=user_id).order_by('-date', '_id')[:page]
+        )),
+        ('activities by_type', lambda: list(
+            Activity.objects.filter(activity_type=activity_type).order_by('-date', '_id')[:page]
+        )),
+        ('leaderboard list', lambda: list(Leaderboard.objects.order_by('-total_calories', '_id')[:page])),
+        ('leaderboard top', lambda: list(Leaderboard.objects.order_by('-total_calories', '_id')[:10])),
+        ('leaderboard by_team', lambda: list(
+            Leaderboard.objects.filter(team_id=team_id).order_by('-total_calories', '_id')
+        )),
+        ('leaderboard rank sync', lambda: list(
+            Leaderboard.objects.mongo_find({'updated_at': {'$gte': timezone.now()}})
+        )),
+        ('leaderboard increment', lambda: Leaderboard.objects.mongo_find_one({'user_id': user_id})),
+        ('leaderboard windowed', lambda: leaderboard.windowed_board('30d', team_id=team_id)),
+        ('daily bucket increment', lambda: DailyTotal.objects.mongo_find_one(
+            {'user_id': user_id, 'day': yesterday}
+        )),
+        ('teams stats', lambda: leaderboard.team_stats(team_oid)),
+        ('workouts by_difficulty', lambda: list(Workout.objects.filter(difficulty=difficulty))),
+        ('workouts by_activity_type', lambda: list(Workout.objects.filter(activity_type=workout_type))),
+    ]
+
+
+def plan_stages(node):
+    """Yield every plan stage name found anywhere in an explain() document"""
+    if isinstance(node, dict):
+        if isinstance(node.get('stage'), str):
+            yield node['stage']
+        for value in node.values():
+            yield from plan_stages(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from plan_stages(value)
+
+
+def command_name(command):
+    """Return the command verb of a captured command document"""
+    for name in EXPLAINED_COMMANDS:
+        if name in command:
+            return name
+    return next(iter(command))
+
+
+class Command(BaseCommand):
+    help = 'Explain every ViewSet query and flag any that still scan a whole collection'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--create-indexes',
+            action='store_true',
+            help='Create any index or unique key declared in model Meta that is missing from MongoDB first'
+        )
+        parser.add_argument(
+            '--fail-on-collscan',
+            action='store_true',
+            help='Exit with an error if any query does a COLLSCAN'
+        )
+
+    def handle(self, *args, **options):
+        capture = CommandCapture()
+        monitoring.register(capture)
+        # Listeners only attach to clients created after registration
+        connections['default'].close()
+        db = mongo.get_database()
+
+        if options['create_indexes']:
+            self.create_indexes(db)
+
+        flagged = set()
+        for label, run in hot_queries():
+            capture.commands = []
+            capture.capturing = True
+            try:
+                run()
+            finally:
+                capture.capturing = False
+
+            for command in capture.commands:
+                command = {k: v for k, v in command.items() if not k.startswith('$') and k != 'lsid'}
+                explained = db.command({'explain': command, 'verbosity': 'queryPlanner'})
+                stages = set(plan_stages(explained))
+                collection = command.get(command_name(command))
+                if 'COLLSCAN' in stages:
+                    flagged.add(label)
+                    self.stdout.write(self.style.WARNING(f'COLLSCAN  {label} ({collection})'))
+                else:
+                    self.stdout.write(self.style.SUCCESS(
+                        f"indexed   {label} ({collection}): {', '.join(sorted(stages))}"
+                    ))
+
+        if flagged:
+            message = f'{len(flagged)} quer{"y" if len(flagged) == 1 else "ies"} scan a whole collection'
+            if options['fail_on_collscan']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS('Every hot query is served by an index'))
+
+    def create_indexes(self, db):
+        """Create the indexes and unique constraints declared in model Meta that MongoDB does not have yet"""
+        for model in apps.get_app_config('octofit_tracker').get_models():
+            collection = db[model._meta.db_table]
+            existing = collection.index_information()
+            wanted = [
+                (index.name, self.index_keys(model, index.fields_orders), False)
+                for index in model._meta.indexes
+            ] + [(name, keys, True) for name, keys in mongo.unique_keys(model)]
+            for name, keys, unique in wanted:
+                if name in existing:
+                    continue
+                # An index on the same keys may exist under another name, e.g. created by hand
+                same_keys = {other: info for other, info in existing.items() if list(info['key']) == keys}
+                equivalent = [other for other, info in same_keys.items() if info.get('unique', False) or not unique]
+                if equivalent:
+                    self.stdout.write(f'Index {name} on {collection.name} already exists as {equivalent[0]}')
+                    continue
+                # A unique key replaces any plain index on the same fields
+                for other in same_keys:
+                    collection.drop_index(other)
+                    del existing[other]
+                    self.stdout.write(f'Dropped non-unique index {other} on {collection.name}')
+                try:
+                    collection.create_index(keys, name=name, unique=unique)
+                except DuplicateKeyError as error:
+                    raise CommandError(
+                        f'Could not create unique key {name} on {collection.name}: {error}. '
+                        'Recompute the collection from activities to drop duplicates: the '
+                        'rebuild_leaderboard command, leaderboard.rebuild_daily_totals() or '
+                        'user_stats.rebuild_user_stats()'
+                    )
+                except OperationFailure as error:
+                    raise CommandError(
+                        f'Could not create index {name} on {collection.name}: {error}. '
+                        'An index with this name or key pattern but other options exists; '
+                        'drop it and run again'
+                    )
+                existing[name] = {'key': keys, 'unique': unique}
+                self.stdout.write(f'Created {"unique " if unique else ""}index {name} on {collection.name}')
+
+    @staticmethod
+    def index_keys(model, fields_orders):
+        """MongoDB key pattern for (field name, '' or 'DESC') pairs"""
+        return [
+            (model._meta.get_field(name).column, -1 if order == 'DESC' else 1)
+            for name, order in fields_orders
+        ]
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
-from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
+from octofit_tracker.models import User, Team, Activity, Leaderboard, DailyTotal, UserStats, Workout
+from octofit_tracker import leaderboard, user_stats
 from datetime import date, timedelta
 import random
 
@@ -16,6 +17,8 @@ class Command(BaseCommand):
         Team.objects.all().delete()
         Activity.objects.all().delete()
         Leaderboard.objects.all().delete()
+        DailyTotal.objects.all().delete()
+        UserStats.objects.all().delete()
         Workout.objects.all().delete()
         self.stdout.write(self.style.SUCCESS('Existing data cleared'))
         
@@ -142,33 +145,21 @@ class Command(BaseCommand):
         
         self.stdout.write(self.style.SUCCESS(f'Created {len(activities)} activities'))
         
-        # Create Leaderboard entries
-        self.stdout.write('Creating leaderboard entries...')
-        leaderboard_entries = []
+        # Build daily buckets for the time-windowed leaderboards
+        self.stdout.write('Building daily leaderboard buckets...')
+        bucket_count = leaderboard.rebuild_daily_totals()
+        self.stdout.write(self.style.SUCCESS(f'Created {bucket_count} daily buckets'))
         
-        for user in all_users:
-            user_activities = Activity.objects.filter(user_id=str(user._id))
-            total_activities = user_activities.count()
-            total_duration = sum(a.duration for a in user_activities)
-            total_calories = sum(a.calories_burned for a in user_activities)
-            total_distance = sum(a.distance for a in user_activities if a.distance)
-            
-            leaderboard_entries.append(Leaderboard.objects.create(
-                user_id=str(user._id),
-                team_id=user.team_id,
-                total_activities=total_activities,
-                total_duration=total_duration,
-                total_calories=total_calories,
-                total_distance=round(total_distance, 2)
-            ))
+        # Build per-user activity summaries
+        self.stdout.write('Building user activity summaries...')
+        summary_count = user_stats.rebuild_user_stats()
+        self.stdout.write(self.style.SUCCESS(f'Created {summary_count} user summaries'))
         
-        # Calculate and assign ranks based on total calories
-        leaderboard_entries.sort(key=lambda x: x.total_calories, reverse=True)
-        for rank, entry in enumerate(leaderboard_entries, start=1):
-            entry.rank = rank
-            entry.save()
+        # Create Leaderboard entries
+        self.stdout.write('Creating leaderboard entries...')
+        entry_count = leaderboard.rebuild_leaderboard()
         
-        self.stdout.write(self.style.SUCCESS(f'Created {len(leaderboard_entries)} leaderboard entries'))
+        self.stdout.write(self.style.SUCCESS(f'Created {entry_count} leaderboard entries'))
         
         # Create Workout suggestions
         self.stdout.write('Creating workout suggestions...')
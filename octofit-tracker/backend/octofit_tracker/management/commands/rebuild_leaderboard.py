@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker import leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Rebuild leaderboard totals and ranks from activities and swap them in atomically'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--parallel',
+            type=int,
+            default=0,
+            metavar='N',
+            help='Shard the aggregation by team across N worker processes'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of entries per bulk insert into the shadow collection'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding leaderboard...')
+        count = leaderboard.rebuild_leaderboard(
+            parallel=options['parallel'],
+            batch_size=options['batch_size']
+        )
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt leaderboard with {count} entries'))
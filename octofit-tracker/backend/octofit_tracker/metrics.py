@@ -0,0 +1,252 @@
+"""
+Prometheus metrics for OctoFit Tracker
+
+Counters and histograms are accumulated in per-thread shards: recording a
+sample is a thread-local lookup and a dict update with no lock, and shards
+are only merged when /metrics is scraped. When a thread exits its shard is
+folded into a retired total, so short-lived threads do not accumulate. With METRICS_DIR set, each worker
+process also writes its totals to ``<METRICS_DIR>/<pid>-<start>.json``
+every METRICS_FLUSH_SECONDS, and a scrape of any worker sums the files of
+all of them. The start time in the name keeps a worker that reuses an
+exited worker's PID from overwriting its file. Files of exited workers are
+kept so counters never go backwards; empty METRICS_DIR when the server
+starts.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    'octofit_http_requests_total': ('counter', 'HTTP requests by route, method and status'),
+    'octofit_http_request_duration_seconds': ('histogram', 'Time to serve a request, by route and method'),
+    'octofit_db_commands_total': ('counter', 'MongoDB commands sent while serving requests, by route'),
+    'octofit_db_duration_seconds_total': ('counter', 'Time spent in MongoDB commands, by route'),
+    'octofit_response_cache_total': ('counter', 'Response cache lookups by route and result'),
+}
+
+
+class _Shard:
+    """One thread's counters and histograms, keyed by (metric name, label pairs)"""
+    __slots__ = ('counters', 'histograms')
+
+    def __init__(self):
+        self.counters = {}
+        # Each histogram is its per-bucket counts (the last for +Inf) followed by the sum
+        self.histograms = {}
+
+
+class _ThreadSentinel:
+    """Lives in a thread's locals only, so it is collected when the thread exits"""
+    __slots__ = ('__weakref__',)
+
+
+_local = threading.local()
+_shards = set()
+# Totals of the threads that have exited
+_retired = _Shard()
+_shards_lock = threading.Lock()
+_flusher = None
+# Names this process's file in METRICS_DIR: its PID and start time in nanoseconds
+_process_key = f'{os.getpid()}-{time.time_ns()}'
+
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = _Shard()
+        _local.sentinel = _ThreadSentinel()
+        weakref.finalize(_local.sentinel, _retire, shard)
+        with _shards_lock:
+            _shards.add(shard)
+        _start_flusher()
+    return shard
+
+
+def _merge(counters, histograms, shard):
+    # dict.copy() and list() run without releasing the GIL, so writers cannot interleave
+    for key, value in shard.counters.copy().items():
+        counters[key] = counters.get(key, 0) + value
+    for key, values in shard.histograms.copy().items():
+        merged = histograms.setdefault(key, [0] * len(values))
+        for index, value in enumerate(list(values)):
+            merged[index] += value
+
+
+def _retire(shard):
+    """Fold an exited thread's shard into the retired totals and stop tracking it"""
+    with _shards_lock:
+        # Shards of threads from before a fork belong to the parent's totals
+        if shard in _shards:
+            _shards.discard(shard)
+            _merge(_retired.counters, _retired.histograms, shard)
+
+
+def inc(name, labels, value=1):
+    """Add to a counter; labels is a tuple of (name, value) pairs"""
+    counters = _shard().counters
+    key = (name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name, labels, value):
+    """Record a sample in a histogram with DURATION_BUCKETS"""
+    histograms = _shard().histograms
+    key = (name, labels)
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = [0] * (len(DURATION_BUCKETS) + 2)
+    histogram[bisect_left(DURATION_BUCKETS, value)] += 1
+    histogram[-1] += value
+
+
+def observe_request(route, method, status_code, seconds, db_commands, db_seconds):
+    """Record one served request"""
+    inc('octofit_http_requests_total', (('route', route), ('method', method), ('status', str(status_code))))
+    observe('octofit_http_request_duration_seconds', (('route', route), ('method', method)), seconds)
+    if db_commands:
+        inc('octofit_db_commands_total', (('route', route),), db_commands)
+        inc('octofit_db_duration_seconds_total', (('route', route),), db_seconds)
+
+
+def route_of(request):
+    """Label a request by its URL name, e.g. activity-by-user"""
+    match = getattr(request, 'resolver_match', None)
+    return (match.view_name if match else None) or 'unmatched'
+
+
+def collect():
+    """Merge the shards of every thread into (counters, histograms)"""
+    counters, histograms = {}, {}
+    with _shards_lock:
+        shards = list(_shards)
+        _merge(counters, histograms, _retired)
+    for shard in shards:
+        _merge(counters, histograms, shard)
+    return counters, histograms
+
+
+def reset():
+    """Drop every recorded sample in this process"""
+    with _shards_lock:
+        for shard in (*_shards, _retired):
+            shard.counters.clear()
+            shard.histograms.clear()
+
+
+def _after_fork():
+    # A forked worker starts from zero with no flusher thread, under its own file
+    global _shards, _retired, _shards_lock, _flusher, _process_key
+    _shards, _retired, _shards_lock, _flusher = set(), _Shard(), threading.Lock(), None
+    _process_key = f'{os.getpid()}-{time.time_ns()}'
+    _local.__dict__.clear()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def _process_file(directory):
+    return os.path.join(directory, f'{_process_key}.json')
+
+
+def flush():
+    """Write this process's totals to METRICS_DIR"""
+    directory = settings.METRICS_DIR
+    if not directory:
+        return
+    counters, histograms = collect()
+    document = {
+        'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+        'histograms': [[name, labels, values] for (name, labels), values in histograms.items()],
+    }
+    os.makedirs(directory, exist_ok=True)
+    path = _process_file(directory)
+    with open(f'{path}.tmp', 'w') as output:
+        json.dump(document, output)
+    os.replace(f'{path}.tmp', path)
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(settings.METRICS_FLUSH_SECONDS)
+        try:
+            flush()
+        except OSError:
+            logger.exception('Could not write metrics to %s', settings.METRICS_DIR)
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is None and settings.METRICS_DIR:
+        _flusher = threading.Thread(target=_flush_periodically, name='octofit-metrics-flush', daemon=True)
+        _flusher.start()
+
+
+def aggregate():
+    """Return (counters, histograms) summed over every worker process"""
+    directory = settings.METRICS_DIR
+    if not directory:
+        return collect()
+    flush()
+    counters, histograms = {}, {}
+    for filename in os.listdir(directory):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as stored:
+                document = json.load(stored)
+        except (OSError, ValueError):
+            continue
+        for name, labels, value in document['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in document['histograms']:
+            merged = histograms.setdefault((name, tuple(map(tuple, labels))), [0] * len(values))
+            for index, value in enumerate(values):
+                merged[index] += value
+    return counters, histograms
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def exposition(counters, histograms):
+    """Render totals in the Prometheus text exposition format"""
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'histogram':
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for edge, count in zip(DURATION_BUCKETS + ('+Inf',), values[:-1]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", edge),))} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {_number(values[-1])}')
+                lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+        else:
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import os
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_string
+from . import instrumentation, metrics, profiling
+from .conditional import encoded_etag
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+BROTLI_QUALITY = 5
+
+logger = logging.getLogger('octofit_tracker.requests')
+
+
+def accepted_encodings(header):
+    """Map each coding in an Accept-Encoding header to its quality value"""
+    encodings = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            encodings[coding.strip().lower()] = quality
+    return encodings
+
+
+def preferred_encoding(header):
+    """Return 'br', 'gzip' or None for an Accept-Encoding header, preferring brotli on ties"""
+    encodings = accepted_encodings(header)
+    wildcard = encodings.get('*', 0.0)
+    candidates = [('gzip', encodings.get('gzip', wildcard))]
+    if brotli is not None:
+        candidates.insert(0, ('br', encodings.get('br', wildcard)))
+    coding, quality = max(candidates, key=lambda candidate: candidate[1])
+    return coding if quality > 0 else None
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compresses responses with brotli or gzip as negotiated by Accept-Encoding
+
+    Bodies under COMPRESSION_MIN_SIZE bytes, streaming responses (exports
+    compress themselves) and responses that already carry a
+    Content-Encoding are sent as they are. Works for sync and async views.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        coding = preferred_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None:
+            return response
+        if coding == 'br':
+            compressed = brotli.compress(response.content, quality=BROTLI_QUALITY)
+        else:
+            compressed = compress_string(response.content)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        response.headers['Content-Encoding'] = coding
+        # The compressed body is a different representation of the same resource
+        etag = response.get('ETag')
+        if etag:
+            response.headers['ETag'] = encoded_etag(etag, coding)
+        return response
+
+
+def server_timing(phases):
+    """Format (name, milliseconds, description) triples as a Server-Timing header value"""
+    entries = []
+    for name, duration, description in phases:
+        entry = f'{name};dur={duration:.2f}'
+        if description:
+            entry += f';desc="{description}"'
+        entries.append(entry)
+    return ', '.join(entries)
+
+
+class ServerTimingMiddleware(MiddlewareMixin):
+    """
+    Records MongoDB command count and time, serialization time and render
+    time for each request
+
+    The timings are sent in a Server-Timing header (unless
+    SERVER_TIMING_HEADER is off) and logged as structured fields on the
+    octofit_tracker.requests logger, together with every command slower
+    than SLOW_QUERY_MS, and recorded in the /metrics counters and
+    histograms. Place it first so its total covers the other middleware.
+    Streaming bodies are produced after the response leaves, so their time
+    is not included.
+    """
+
+    def process_request(self, request):
+        request.timings = instrumentation.start(settings.SLOW_QUERY_MS / 1000)
+
+    def process_template_response(self, request, response):
+        timings = getattr(request, 'timings', None)
+        if timings is None:
+            return response
+        if timings.begin('render'):
+            response.add_post_render_callback(lambda rendered: timings.end('render'))
+        return response
+
+    def process_response(self, request, response):
+        timings = getattr(request, 'timings', None)
+        if timings is None:
+            return response
+        instrumentation.stop()
+        phases = timings.metrics()
+        if settings.SERVER_TIMING_HEADER:
+            response.headers['Server-Timing'] = server_timing(phases)
+
+        route = metrics.route_of(request)
+        metrics.observe_request(
+            route, request.method, response.status_code, timings.total_seconds, timings.queries,
+            timings.db_seconds,
+        )
+        fields = {
+            'method': request.method,
+            'path': request.path,
+            'route': route,
+            'status': response.status_code,
+            'db_queries': timings.queries,
+            **{f'{name}_ms': round(duration, 3) for name, duration, _ in phases},
+        }
+        logger.info(
+            '%(method)s %(path)s %(status)s %(total_ms).1fms (%(db_queries)s queries, %(db_ms).1fms db)',
+            fields, extra={'request_timings': fields},
+        )
+        for query in timings.slow_queries:
+            logger.warning(
+                'Slow MongoDB %s on %s during %s %s: %.1fms filter %s',
+                query['command'], query['collection'], request.method, request.path, query['duration_ms'],
+                query['filter'],
+                extra={'request_timings': fields, 'slow_query': query},
+            )
+        return response
+
+
+class ProfilingMiddleware(MiddlewareMixin):
+    """
+    Serves a request under a profiler when PROFILING_ENABLED is on and an
+    internal client asks with an X-Profile header or ?profile= parameter
+
+    The profile file name is returned in the X-Profile response header, or
+    "busy" when PROFILE_MAX_CONCURRENT profiles are already running.
+    Placed near the top so the profile covers the other middleware and
+    rendering. Runs natively in sync and async stacks, so it never makes
+    Django adapt the middleware chain under ASGI.
+    """
+
+    def requested_mode(self, request):
+        """Return the profiler an allowed request asks for, or None"""
+        mode = profiling.requested_mode(request) if settings.PROFILING_ENABLED else None
+        if mode is None or request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+            return None
+        return mode
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.profile_async(request)
+        mode = self.requested_mode(request)
+        if mode is None:
+            return self.get_response(request)
+        slots = profiling.slots()
+        if not slots.acquire(blocking=False):
+            response = self.get_response(request)
+            response.headers['X-Profile'] = 'busy'
+            return response
+        try:
+            path = profiling.profile_path(request, mode)
+            with profiling.profiled(mode, path):
+                response = self.get_response(request)
+        finally:
+            slots.release()
+        response.headers['X-Profile'] = os.path.basename(path)
+        return response
+
+    async def profile_async(self, request):
+        mode = self.requested_mode(request)
+        if mode is None:
+            return await self.get_response(request)
+        slots = profiling.slots()
+        if not slots.acquire(blocking=False):
+            response = await self.get_response(request)
+            response.headers['X-Profile'] = 'busy'
+            return response
+        try:
+            path = profiling.profile_path(request, mode)
+            with profiling.profiled(mode, path):
+                response = await self.get_response(request)
+        finally:
+            slots.release()
+        response.headers['X-Profile'] = os.path.basename(path)
+        return response
@@ -15,6 +15,7 @@ class User(models.Model):
         db_table = 'users'
         indexes = [
             models.Index(fields=['email'], name='user_email_idx'),
+            models.Index(fields=['team_id'], name='user_team_idx'),
         ]
     
     def __str__(self):
@@ -28,6 +29,8 @@ class Team(models.Model):
     description = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = djongo_models.DjongoManager()
+    
     class Meta:
         db_table = 'teams'
     
@@ -46,9 +49,16 @@ class Activity(models.Model):
     date = models.DateField()
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = djongo_models.DjongoManager()
+    
     class Meta:
         db_table = 'activities'
         ordering = ['-date']
+        indexes = [
+            models.Index(fields=['-date', '_id'], name='activity_date_idx'),
+            models.Index(fields=['user_id', '-date', '_id'], name='activity_user_date_idx'),
+            models.Index(fields=['activity_type', '-date', '_id'], name='activity_type_date_idx'),
+        ]
     
     def __str__(self):
         return f"{self.activity_type} - {self.duration} mins"
@@ -63,17 +73,85 @@ class Leaderboard(models.Model):
     total_duration = models.IntegerField(default=0, help_text="Total duration in minutes")
     total_calories = models.IntegerField(default=0)
     total_distance = models.FloatField(default=0.0, help_text="Total distance in miles")
-    rank = models.IntegerField(default=0)
+    rank = models.IntegerField(default=0, help_text="Rank at the last rebuild; responses carry live ranks")
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = djongo_models.DjongoManager()
+    
     class Meta:
         db_table = 'leaderboard'
-        ordering = ['rank']
+        ordering = ['-total_calories', '_id']
+        constraints = [
+            models.UniqueConstraint(fields=['user_id'], name='leaderboard_user_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['-total_calories', '_id'], name='leaderboard_score_idx'),
+            models.Index(fields=['team_id', '-total_calories', '_id'], name='leaderboard_team_score_idx'),
+            models.Index(fields=['updated_at'], name='leaderboard_updated_idx'),
+        ]
     
     def __str__(self):
         return f"Rank {self.rank} - User {self.user_id}"
 
 
+class DailyTotal(models.Model):
+    """Per-user, per-day activity totals backing time-windowed leaderboards"""
+    _id = djongo_models.ObjectIdField(primary_key=True)
+    user_id = models.CharField(max_length=100)
+    team_id = models.CharField(max_length=100, help_text="Team the user was in when the day's activity was logged")
+    day = models.DateField()
+    total_activities = models.IntegerField(default=0)
+    total_duration = models.IntegerField(default=0, help_text="Total duration in minutes")
+    total_calories = models.IntegerField(default=0)
+    total_distance = models.FloatField(default=0.0, help_text="Total distance in miles")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    objects = djongo_models.DjongoManager()
+    
+    class Meta:
+        db_table = 'leaderboard_daily'
+        ordering = ['-day']
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'day'], name='daily_user_day_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='daily_day_idx'),
+            models.Index(fields=['team_id', 'day'], name='daily_team_day_idx'),
+            models.Index(fields=['updated_at'], name='daily_updated_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.day} - User {self.user_id}"
+
+
+class UserStats(models.Model):
+    """Per-user activity summary, updated on every Activity write"""
+    _id = djongo_models.ObjectIdField(primary_key=True)
+    user_id = models.CharField(max_length=100)
+    totals = djongo_models.JSONField(default=dict, help_text="All-time totals by activity type")
+    daily = djongo_models.JSONField(default=dict, help_text="Recent totals by day, then activity type")
+    weekly = djongo_models.JSONField(default=dict, help_text="Recent totals by ISO week, then activity type")
+    monthly = djongo_models.JSONField(default=dict, help_text="Recent totals by month, then activity type")
+    active_days = djongo_models.JSONField(default=dict, help_text="Recent activity count by day")
+    personal_bests = djongo_models.JSONField(default=dict, help_text="Best single activity by activity type")
+    longest_streak = models.IntegerField(default=0, help_text="Longest run of consecutive active days")
+    streak_starts = djongo_models.JSONField(default=dict, help_text="First day of each recent streak, by its last day")
+    streak_ends = djongo_models.JSONField(default=dict, help_text="Last day of each recent streak, by its first day")
+    past_longest_streak = models.IntegerField(default=0, help_text="Longest streak among those no longer tracked")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    objects = djongo_models.DjongoManager()
+    
+    class Meta:
+        db_table = 'user_stats'
+        constraints = [
+            models.UniqueConstraint(fields=['user_id'], name='user_stats_user_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"Stats - User {self.user_id}"
+
+
 class Workout(models.Model):
     """Workout suggestion model for OctoFit Tracker"""
     _id = djongo_models.ObjectIdField(primary_key=True)
@@ -87,6 +165,10 @@ class Workout(models.Model):
     
     class Meta:
         db_table = 'workouts'
+        indexes = [
+            models.Index(fields=['difficulty'], name='workout_difficulty_idx'),
+            models.Index(fields=['activity_type'], name='workout_type_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -0,0 +1,155 @@
+"""
+Direct pymongo access for OctoFit Tracker
+
+djongo translates ORM queries to MongoDB; these helpers expose the
+underlying database for work the ORM cannot express, such as bulk writes,
+collection renames and aggregations run from worker processes, and a
+motor client for async views.
+"""
+import asyncio
+import logging
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+from django.db.models import UniqueConstraint
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+DUPLICATE_KEY = 11000
+
+logger = logging.getLogger(__name__)
+
+# Databases whose unique keys this process has ensured
+_unique_keys_ensured = set()
+
+
+def get_database(alias='default'):
+    """Return the pymongo Database behind a djongo connection"""
+    connection = connections[alias]
+    connection.ensure_connection()
+    return connection.connection
+
+
+def new_client(alias='default'):
+    """Open a fresh MongoClient, e.g. in a worker process, from the database settings"""
+    return MongoClient(**settings.DATABASES[alias].get('CLIENT', {}))
+
+
+# Motor clients by event loop, and the generator that closes them with it
+_async_clients = {}
+
+
+async def _loop_clients(loop):
+    """Hold one loop's clients by alias until the loop shuts down, then close them"""
+    clients = {}
+    try:
+        yield clients
+    finally:
+        _async_clients.pop(loop, None)
+        for client in clients.values():
+            client.close()
+
+
+async def get_async_database(alias='default'):
+    """
+    Return a motor Database for the running event loop
+
+    Each loop gets one client per alias, shared by every request on it: under
+    ASGI that is one client and pool per worker process. The clients are
+    closed when the loop shuts down its async generators, as asyncio.run()
+    and async_to_sync do before closing the short-lived loop they run an
+    async view on under WSGI.
+    """
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        lifetime = _loop_clients(loop)
+        # Suspended at its yield, the generator is closed by loop.shutdown_asyncgens()
+        _async_clients[loop] = (await lifetime.__anext__(), lifetime)
+    clients = _async_clients[loop][0]
+    if alias not in clients:
+        clients[alias] = AsyncIOMotorClient(**{
+            **settings.DATABASES[alias].get('CLIENT', {}),
+            'maxPoolSize': settings.ASYNC_MONGO_POOL_SIZE,
+        })
+    return clients[alias][database_name(alias)]
+
+
+def database_name(alias='default'):
+    """Return the MongoDB database name configured for an alias"""
+    return settings.DATABASES[alias]['NAME']
+
+
+def unique_keys(model):
+    """Return (name, key pattern) of every unique constraint declared in a model's Meta"""
+    return [
+        (constraint.name, [(model._meta.get_field(name).column, 1) for name in constraint.fields])
+        for constraint in model._meta.constraints
+        if isinstance(constraint, UniqueConstraint)
+    ]
+
+
+def ensure_unique_keys(db):
+    """
+    Create the unique keys declared in model Meta on a database, once per process
+
+    There are no migrations, so this runs whenever a connection is opened
+    (see signals.py). A key that cannot be created, because the collection
+    already holds duplicates or a plain index on the same fields, is logged
+    for index_report --create-indexes to resolve.
+    """
+    if db.name in _unique_keys_ensured:
+        return
+    _unique_keys_ensured.add(db.name)
+    for model in apps.get_app_config('octofit_tracker').get_models():
+        collection = db[model._meta.db_table]
+        for name, keys in unique_keys(model):
+            try:
+                collection.create_index(keys, name=name, unique=True)
+            except OperationFailure as error:
+                logger.error(
+                    'Unique key %s on %s is missing (%s); run index_report --create-indexes',
+                    name, collection.name, error,
+                )
+
+
+def upsert(write, *args, **kwargs):
+    """
+    Run an upsert such as find_one_and_update(..., upsert=True) on a unique key
+
+    Two concurrent first writes can both try to insert; the unique index
+    rejects the loser, whose retry then matches and updates the document
+    the winner created. Without the index both inserts succeed, so the
+    keys are created on connect by ensure_unique_keys.
+    """
+    try:
+        return write(*args, **kwargs)
+    except DuplicateKeyError:
+        return write(*args, **kwargs)
+
+
+def bulk_upsert(write, operations):
+    """
+    Run unordered bulk upserts with `write`, e.g. a manager's mongo_bulk_write,
+    retrying those that lost an insert race on a unique key
+    """
+    try:
+        return write(operations, ordered=False)
+    except BulkWriteError as error:
+        errors = error.details['writeErrors']
+        if any(write_error['code'] != DUPLICATE_KEY for write_error in errors):
+            raise
+        return write([operations[write_error['index']] for write_error in errors], ordered=False)
+
+
+def chunked(items, size):
+    """Yield successive lists of at most `size` items"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,116 @@
+"""
+MongoDB connection pool statistics for OctoFit Tracker
+
+A pymongo ConnectionPoolListener counts checkouts, checkout failures,
+time spent waiting for a connection and connections open and in use,
+per server address. It is registered when the app loads, before any
+client is created, so it observes both the djongo and the motor pools.
+"""
+import threading
+import time
+from collections import Counter, defaultdict
+from pymongo import monitoring
+
+
+class _AddressStats:
+    __slots__ = (
+        'checkouts', 'checkout_failures', 'checked_in', 'wait_seconds', 'max_wait_seconds',
+        'created', 'closed', 'pools_cleared',
+    )
+
+    def __init__(self):
+        self.checkouts = self.checked_in = self.created = self.closed = self.pools_cleared = 0
+        self.wait_seconds = self.max_wait_seconds = 0.0
+        self.checkout_failures = Counter()
+
+    def as_dict(self):
+        return {
+            'checkouts': self.checkouts,
+            'checkout_failures': dict(self.checkout_failures),
+            'in_use': self.checkouts - self.checked_in,
+            'open': self.created - self.closed,
+            'created': self.created,
+            'closed': self.closed,
+            'pools_cleared': self.pools_cleared,
+            'wait_ms_total': round(self.wait_seconds * 1000, 3),
+            'wait_ms_mean': round(self.wait_seconds * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+            'wait_ms_max': round(self.max_wait_seconds * 1000, 3),
+        }
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Accumulates connection pool events per server address"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = defaultdict(_AddressStats)
+
+    @staticmethod
+    def _address(event):
+        host, port = event.address
+        return f'{host}:{port}'
+
+    def _waited(self):
+        # Checkouts are synchronous, so the start event came from this thread
+        started = getattr(self._local, 'started', None)
+        self._local.started = None
+        return 0.0 if started is None else time.perf_counter() - started
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        waited = self._waited()
+        with self._lock:
+            stats = self._stats[self._address(event)]
+            stats.checkouts += 1
+            stats.wait_seconds += waited
+            stats.max_wait_seconds = max(stats.max_wait_seconds, waited)
+
+    def connection_check_out_failed(self, event):
+        self._waited()
+        with self._lock:
+            self._stats[self._address(event)].checkout_failures[event.reason] += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self._stats[self._address(event)].checked_in += 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self._stats[self._address(event)].created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self._stats[self._address(event)].closed += 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self._stats[self._address(event)].pools_cleared += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def snapshot(self):
+        """Return the statistics of every address seen so far"""
+        with self._lock:
+            return {address: stats.as_dict() for address, stats in sorted(self._stats.items())}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+pool_stats = PoolStats()
+
+
+def register():
+    """Attach the pool listener to every MongoClient created from now on"""
+    monitoring.register(pool_stats)
@@ -0,0 +1,41 @@
+import codecs
+import json
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONRows:
+    """The rows of an NDJSON body, iterable as rows or as (line number, row) pairs"""
+
+    def __init__(self, lines):
+        self._lines = lines
+
+    def __iter__(self):
+        return (row for _, row in self.numbered())
+
+    def numbered(self):
+        """Yield each row with its 1-based line number in the body, skipping blank lines"""
+        for line_number, line in enumerate(self._lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError as exc:
+                yield line_number, ParseError(f'JSON parse error on line {line_number} - {exc}')
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses newline-delimited JSON lazily, one row per line
+
+    Rows are yielded as the request body is read so large uploads can be
+    processed in batches. A malformed line is yielded as a ParseError in
+    place of its row rather than failing the whole stream.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        return NDJSONRows(codecs.getreader(encoding)(stream))
@@ -0,0 +1,10 @@
+from django.conf import settings
+from rest_framework.permissions import BasePermission
+
+
+class IsInternalRequest(BasePermission):
+    """Allows requests from INTERNAL_IPS only"""
+    message = 'Internal endpoint'
+
+    def has_permission(self, request, view):
+        return request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS
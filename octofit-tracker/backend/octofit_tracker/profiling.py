@@ -0,0 +1,115 @@
+"""
+On-demand request profiling for OctoFit Tracker
+
+A request from INTERNAL_IPS that sends an ``X-Profile`` header or a
+``?profile=`` parameter, while PROFILING_ENABLED is on, is served under a
+profiler and the result is written to PROFILE_DIR:
+
+* ``cprofile`` (or ``1``/``true``): deterministic cProfile, saved as a
+  ``.prof`` pstats file for ``python -m pstats``, snakeviz or gprof2dot
+* ``sample``: a sampling profiler that records the serving thread's stack
+  every PROFILE_SAMPLE_INTERVAL_MS, saved as ``.collapsed`` folded stacks
+  for flamegraph.pl or speedscope
+
+At most PROFILE_MAX_CONCURRENT requests are profiled at once; requests
+over the cap are served normally. Only the thread serving the request is
+profiled, so work handed to other threads (motor, async views under WSGI)
+is not seen. Under ASGI that thread is the event loop's, so the profile
+also covers whatever other requests the loop runs in the meantime.
+"""
+import cProfile
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from django.conf import settings
+
+MODES = {'1': 'cprofile', 'true': 'cprofile', 'cprofile': 'cprofile', 'sample': 'sample'}
+EXTENSIONS = {'cprofile': 'prof', 'sample': 'collapsed'}
+
+_slots = None
+_slots_lock = threading.Lock()
+
+
+def requested_mode(request):
+    """Return the profiler a request asks for, or None"""
+    value = request.META.get('HTTP_X_PROFILE') or request.GET.get('profile')
+    if not value:
+        return None
+    return MODES.get(value.strip().lower())
+
+
+def slots():
+    """Semaphore capping how many requests are profiled at once"""
+    global _slots
+    with _slots_lock:
+        if _slots is None:
+            _slots = threading.BoundedSemaphore(max(settings.PROFILE_MAX_CONCURRENT, 1))
+        return _slots
+
+
+def profile_path(request, mode):
+    """Return a unique file path in PROFILE_DIR named after the request"""
+    slug = re.sub(r'[^A-Za-z0-9]+', '-', request.path).strip('-') or 'root'
+    name = f'{time.strftime("%Y%m%dT%H%M%S")}-{time.time_ns() % 10**9:09d}-{request.method}-{slug[:80]}'
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    return os.path.join(settings.PROFILE_DIR, f'{name}.{EXTENSIONS[mode]}')
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's call stack at a fixed interval into folded-stack counts"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='octofit-stack-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def dump(self, path):
+        with open(path, 'w') as output:
+            for stack, count in self.stacks.most_common():
+                output.write(f'{stack} {count}\n')
+
+
+@contextmanager
+def profiled(mode, path):
+    """Run the block under the chosen profiler and write the profile to path"""
+    if mode == 'sample':
+        sampler = StackSampler(threading.get_ident(), settings.PROFILE_SAMPLE_INTERVAL_MS / 1000)
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            sampler.dump(path)
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
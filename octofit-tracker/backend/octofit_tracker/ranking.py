@@ -0,0 +1,220 @@
+"""
+In-process rank engine for the OctoFit Tracker leaderboard
+
+Scores are kept in an indexable skiplist so a user's rank and the entries
+around it are found in O(log n) without reading or rewriting the stored
+``rank`` of every leaderboard row.
+"""
+import random
+import threading
+from collections import Counter
+
+COMPETITION = 'competition'
+DENSE = 'dense'
+RANKING_METHODS = (COMPETITION, DENSE)
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+
+class IndexableSkiplist:
+    """Sorted set of unique keys with O(log n) insert, remove, rank and index lookups"""
+
+    MAX_LEVELS = 24
+
+    def __init__(self, seed=None):
+        self._random = random.Random(seed)
+        self._tail = _Node(None, 0)
+        self._head = _Node(None, self.MAX_LEVELS)
+        self._head.next = [self._tail] * self.MAX_LEVELS
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _random_levels(self):
+        levels = 1
+        while levels < self.MAX_LEVELS and self._random.random() < 0.5:
+            levels += 1
+        return levels
+
+    def insert(self, key):
+        """Insert a key that is not already present"""
+        chain = [None] * self.MAX_LEVELS
+        steps_at_level = [0] * self.MAX_LEVELS
+        node = self._head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not self._tail and node.next[level].key < key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        new_node = _Node(key, self._random_levels())
+        steps = 0
+        for level in range(len(new_node.next)):
+            prev = chain[level]
+            new_node.next[level] = prev.next[level]
+            prev.next[level] = new_node
+            new_node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(len(new_node.next), self.MAX_LEVELS):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        """Remove a key, raising KeyError if it is missing"""
+        chain = [None] * self.MAX_LEVELS
+        node = self._head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not self._tail and node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target is self._tail or target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), self.MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def bisect_left(self, key):
+        """Return the number of keys strictly less than key"""
+        position = 0
+        node = self._head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not self._tail and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+    def _node_at(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        node = self._head
+        remaining = index + 1
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def __getitem__(self, index):
+        return self._node_at(index).key
+
+    def slice(self, start, stop):
+        """Return the keys at positions [start, stop) in O(log n + k)"""
+        start = max(start, 0)
+        stop = min(stop, self.size)
+        if start >= stop:
+            return []
+        node = self._node_at(start)
+        keys = []
+        for _ in range(stop - start):
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class RankEngine:
+    """Order-statistic view of leaderboard scores (higher score ranks first)"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """Drop every score"""
+        with self.lock:
+            self._scores = {}
+            self._order = IndexableSkiplist()
+            self._distinct = IndexableSkiplist()
+            self._multiplicity = Counter()
+
+    def load(self, scores):
+        """Replace the engine contents with an iterable of (user_id, score) pairs"""
+        with self.lock:
+            self.clear()
+            for user_id, score in scores:
+                self.update(user_id, score)
+
+    def __len__(self):
+        return len(self._scores)
+
+    def __contains__(self, user_id):
+        return user_id in self._scores
+
+    def update(self, user_id, score):
+        """Set a user's score, inserting the user if needed"""
+        with self.lock:
+            if user_id in self._scores:
+                if self._scores[user_id] == score:
+                    return
+                self.remove(user_id)
+            self._scores[user_id] = score
+            self._order.insert((-score, user_id))
+            self._multiplicity[score] += 1
+            if self._multiplicity[score] == 1:
+                self._distinct.insert(-score)
+
+    def remove(self, user_id):
+        """Remove a user if present"""
+        with self.lock:
+            score = self._scores.pop(user_id, None)
+            if score is None:
+                return
+            self._order.remove((-score, user_id))
+            self._multiplicity[score] -= 1
+            if not self._multiplicity[score]:
+                del self._multiplicity[score]
+                self._distinct.remove(-score)
+
+    def score(self, user_id):
+        """Return a user's score, or None if the user is not ranked"""
+        return self._scores.get(user_id)
+
+    def rank_for_score(self, score, method=COMPETITION):
+        """Return the rank a score holds: ties share a rank, gaps follow for competition ranking"""
+        with self.lock:
+            if method == DENSE:
+                return self._distinct.bisect_left(-score) + 1
+            return self._order.bisect_left((-score, '')) + 1
+
+    def rank(self, user_id, method=COMPETITION):
+        """Return a user's rank, or None if the user is not ranked"""
+        with self.lock:
+            score = self._scores.get(user_id)
+            if score is None:
+                return None
+            return self.rank_for_score(score, method)
+
+    def around(self, user_id, window, method=COMPETITION):
+        """Return (rank, user_id, score) for up to `window` entries either side of a user"""
+        with self.lock:
+            score = self._scores.get(user_id)
+            if score is None:
+                return []
+            position = self._order.bisect_left((-score, user_id))
+            keys = self._order.slice(position - window, position + window + 1)
+            return [
+                (self.rank_for_score(-negated, method), other_id, -negated)
+                for negated, other_id in keys
+            ]
+
+    def top(self, limit, method=COMPETITION):
+        """Return (rank, user_id, score) for the first `limit` entries"""
+        with self.lock:
+            return [
+                (self.rank_for_score(-negated, method), other_id, -negated)
+                for negated, other_id in self._order.slice(0, limit)
+            ]
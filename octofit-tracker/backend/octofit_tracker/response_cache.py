@@ -0,0 +1,197 @@
+"""
+Write-invalidated response cache for OctoFit Tracker
+
+Each collection has a version document in the ``collection_versions``
+MongoDB collection, shared by every worker process and management command.
+A cached response is keyed by its route, its query parameters and the
+versions of the collections it reads, so bumping a version on any write
+makes every dependent entry unreachable at once, in every process.
+Versions are bumped by model save/delete signals and explicitly by the
+code paths that write through pymongo.
+
+Each process keeps the versions it read for RESPONSE_CACHE_VERSION_TTL
+seconds, so a cache hit costs no MongoDB round trip. Bumps made in the
+process drop its copies at once; writes from other processes are seen
+within the TTL.
+"""
+import threading
+import time
+from datetime import timezone as dt_timezone
+from functools import wraps
+from hashlib import md5
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from pymongo import UpdateOne
+from rest_framework import status
+from rest_framework.response import Response
+from . import metrics, mongo
+
+KEY_PREFIX = 'octofit'
+VERSIONS_COLLECTION = 'collection_versions'
+
+
+# name -> (monotonic expiry, version document) read by this process
+_local_versions = {}
+_local_lock = threading.Lock()
+# Incremented by every local bump so reads that raced it are not kept
+_local_generation = 0
+
+
+def _versions():
+    return mongo.get_database()[VERSIONS_COLLECTION]
+
+
+def _local(names):
+    """Version documents of `names` this process read less than the TTL ago"""
+    now = time.monotonic()
+    found = {}
+    for name in names:
+        entry = _local_versions.get(name)
+        if entry is not None and entry[0] > now:
+            found[name] = entry[1]
+    return found
+
+
+def _remember(documents, generation):
+    ttl = settings.RESPONSE_CACHE_VERSION_TTL
+    if ttl <= 0:
+        return
+    expires = time.monotonic() + ttl
+    with _local_lock:
+        if generation == _local_generation:
+            _local_versions.update((document['_id'], (expires, document)) for document in documents)
+
+
+def _forget(names):
+    global _local_generation
+    with _local_lock:
+        _local_generation += 1
+        for name in names:
+            _local_versions.pop(name, None)
+
+
+def clear_local_versions():
+    """Drop every version this process holds, so the next read goes to MongoDB"""
+    with _local_lock:
+        _local_versions.clear()
+
+
+def _name(source):
+    """Versioned name of a model's collection, or of other state given as a string"""
+    return source if isinstance(source, str) else source._meta.db_table
+
+
+def state(sources):
+    """Return the current version of each source and their latest write time as a Unix timestamp"""
+    names = [_name(source) for source in sources]
+    found = _local(names)
+    stale = [name for name in names if name not in found]
+    if stale:
+        found.update(_read(stale))
+    modified = max(found[name]['modified'] for name in names)
+    return [found[name]['version'] for name in names], modified.replace(tzinfo=dt_timezone.utc).timestamp()
+
+
+def _read(names):
+    """Read version documents from MongoDB, creating missing ones, and keep them locally"""
+    generation = _local_generation
+    found = {document['_id']: document for document in _versions().find({'_id': {'$in': names}})}
+    missing = [name for name in names if name not in found]
+    if missing:
+        # Unknown history: a fresh version never matches an earlier one, and
+        # assume the source changed now rather than claim it never did
+        mongo.bulk_upsert(_versions().bulk_write, [
+            UpdateOne(
+                {'_id': name},
+                {'$setOnInsert': {'version': time.time_ns(), 'modified': timezone.now()}},
+                upsert=True,
+            )
+            for name in missing
+        ])
+        found.update(
+            (document['_id'], document) for document in _versions().find({'_id': {'$in': missing}})
+        )
+    _remember(found.values(), generation)
+    return found
+
+
+def versions(sources):
+    """Return the current version of each source"""
+    return state(sources)[0]
+
+
+def last_modified(sources):
+    """Return the latest write time of these sources as a Unix timestamp"""
+    return state(sources)[1]
+
+
+def bump(*sources):
+    """Invalidate every cached response, in any process, that reads one of these sources"""
+    names = list(dict.fromkeys(_name(source) for source in sources))
+    mongo.bulk_upsert(_versions().bulk_write, [
+        UpdateOne({'_id': name}, {'$inc': {'version': 1}, '$currentDate': {'modified': True}}, upsert=True)
+        for name in names
+    ])
+    # Also keeps reads that started before the bump from storing the old version
+    _forget(names)
+
+
+def _digest(request, versions, extra):
+    query = sorted(request.query_params.lists())
+    # Windowed boards roll over at midnight without any write
+    parts = [
+        request.path, repr(query), repr(versions), timezone.localdate().isoformat(),
+        *map(repr, extra),
+    ]
+    return md5('|'.join(parts).encode()).hexdigest()
+
+
+def fingerprint(request, sources, *extra):
+    """Digest of a GET request's route, query parameters and the versions of the sources it reads"""
+    return _digest(request, versions(sources), extra)
+
+
+def validators(request, sources, *extra):
+    """Return (fingerprint, last modified Unix timestamp) of a GET request from one version read"""
+    current, modified = state(sources)
+    return _digest(request, current, extra), modified
+
+
+def response_key(request, models):
+    """Cache key for a GET request, given the collections its response reads"""
+    return f'{KEY_PREFIX}:response:{fingerprint(request, models)}'
+
+
+def _plain(data):
+    """Drop the serializer reference DRF's ReturnList/ReturnDict carry so data pickles"""
+    if isinstance(data, list):
+        return list(data)
+    if isinstance(data, dict):
+        return dict(data)
+    return data
+
+
+def cached_response(*models):
+    """
+    Cache a ViewSet method's successful GET responses until one of the
+    collections of `models` is written to
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_method(self, request, *args, **kwargs)
+            key = response_key(request, models)
+            data = cache.get(key)
+            route = (('route', metrics.route_of(request)),)
+            if data is not None:
+                metrics.inc('octofit_response_cache_total', route + (('result', 'hit'),))
+                return Response(data)
+            metrics.inc('octofit_response_cache_total', route + (('result', 'miss'),))
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(key, _plain(response.data), settings.RESPONSE_CACHE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
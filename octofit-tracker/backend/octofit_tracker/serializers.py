@@ -1,11 +1,162 @@
-from rest_framework import serializers
+from datetime import datetime
+from django.db import models
+from django.utils.functional import cached_property
+from rest_framework import ISO_8601, serializers
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
 from .models import User, Team, Activity, Leaderboard, Workout
+from . import instrumentation
 
 
-class UserSerializer(serializers.ModelSerializer):
+def _split(value):
+    return [name.strip() for name in value.split(',') if name.strip()] if value else []
+
+
+def requested_fields(request, available):
+    """
+    Return the names in `available` selected by ?fields= and ?exclude= on a
+    read request, or None when every field should be returned
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    fields = _split(request.query_params.get('fields'))
+    exclude = _split(request.query_params.get('exclude'))
+    if not fields and not exclude:
+        return None
+    unknown = set(fields + exclude) - set(available)
+    if unknown:
+        raise serializers.ValidationError({'error': f"Unknown fields: {', '.join(sorted(unknown))}"})
+    return [
+        name for name in available
+        if (not fields or name in fields) and name not in exclude
+    ]
+
+
+def readable_fields(serializer_class):
+    """Names of the fields a serializer class outputs"""
+    return [name for name, field in serializer_class().fields.items() if not field.write_only]
+
+
+class SparseFieldsMixin:
+    """Lets ?fields= and ?exclude= narrow the fields a serializer outputs"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        available = [name for name, field in self.fields.items() if not field.write_only]
+        selected = requested_fields(self.context.get('request'), available)
+        if selected is not None:
+            for name in set(available) - set(selected):
+                self.fields.pop(name)
+    
+    def to_representation(self, instance):
+        with instrumentation.phase('serialize'):
+            return super().to_representation(instance)
+
+
+def _date_converter(field):
+    if getattr(field, 'format', api_settings.DATE_FORMAT) != ISO_8601:
+        return None
+    
+    def convert(value):
+        # Raw documents hold dates as midnight datetimes
+        if isinstance(value, datetime):
+            value = value.date()
+        return value.isoformat()
+    return convert
+
+
+def _datetime_converter(field):
+    if getattr(field, 'format', api_settings.DATETIME_FORMAT) != ISO_8601:
+        return None
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    
+    def convert(value):
+        if field_timezone is not None and value.tzinfo is not None:
+            value = value.astimezone(field_timezone)
+        else:
+            value = field.enforce_timezone(value)
+        value = value.isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return convert
+
+
+# Converters reproducing each DRF field's to_representation for plain column values
+CONVERTERS = {
+    serializers.ModelField: lambda field: str,
+    serializers.CharField: lambda field: str,
+    serializers.IntegerField: lambda field: int,
+    serializers.FloatField: lambda field: float,
+    serializers.DateTimeField: _datetime_converter,
+    serializers.DateField: _date_converter,
+}
+
+
+def field_converter(field):
+    """Return a plain function equivalent to field.to_representation, or None"""
+    for field_class in type(field).__mro__:
+        if field_class in CONVERTERS:
+            return CONVERTERS[field_class](field)
+    return None
+
+
+class FastListSerializer(serializers.ListSerializer):
+    """
+    Read path for lists of model rows
+
+    Output is identical to serializing each row with the child serializer,
+    but rows are read with values() (or given as raw documents) and every
+    field is converted by a function compiled once per list instead of
+    per-row field dispatch.
+    """
+    
+    @cached_property
+    def converters(self):
+        """(name, column, converter) for every output field, or None if any field needs the slow path"""
+        model_fields = {field.name for field in self.child.Meta.model._meta.concrete_fields}
+        converters = []
+        for name, field in self.child.fields.items():
+            if field.write_only:
+                continue
+            convert = field_converter(field)
+            if convert is None or field.source not in model_fields:
+                return None
+            converters.append((name, field.source, convert))
+        return converters
+    
+    def rows(self, queryset, extra=()):
+        """Narrow a queryset to plain dicts of the columns this list reads"""
+        if self.converters is None or not isinstance(queryset, models.QuerySet):
+            return queryset
+        columns = dict.fromkeys([column for _, column, _ in self.converters] + list(extra))
+        return queryset.values(*columns)
+    
+    def to_representation(self, data):
+        with instrumentation.phase('serialize'):
+            return self._to_representation(data)
+    
+    def _to_representation(self, data):
+        converters = self.converters
+        if converters is None:
+            return super().to_representation(data)
+        if isinstance(data, models.Manager):
+            data = data.all()
+        result = []
+        for item in self.rows(data):
+            if not isinstance(item, dict):
+                item = {column: getattr(item, column) for _, column, _ in converters}
+            row = {}
+            for name, column, convert in converters:
+                value = item.get(column)
+                row[name] = None if value is None else convert(value)
+            result.append(row)
+        return result
+
+
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for User model"""
     class Meta:
         model = User
+        list_serializer_class = FastListSerializer
         fields = ['_id', 'name', 'email', 'password', 'team_id', 'created_at']
         extra_kwargs = {
             'password': {'write_only': True}
@@ -16,36 +167,40 @@ class UserSerializer(serializers.ModelSerializer):
         return User.objects.create(**validated_data)
 
 
-class TeamSerializer(serializers.ModelSerializer):
+class TeamSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Team model"""
     class Meta:
         model = Team
+        list_serializer_class = FastListSerializer
         fields = ['_id', 'name', 'description', 'created_at']
         read_only_fields = ['_id', 'created_at']
 
 
-class ActivitySerializer(serializers.ModelSerializer):
+class ActivitySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Activity model"""
     class Meta:
         model = Activity
+        list_serializer_class = FastListSerializer
         fields = ['_id', 'user_id', 'activity_type', 'duration', 'calories_burned', 
                   'distance', 'date', 'created_at']
         read_only_fields = ['_id', 'created_at']
 
 
-class LeaderboardSerializer(serializers.ModelSerializer):
+class LeaderboardSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Leaderboard model"""
     class Meta:
         model = Leaderboard
+        list_serializer_class = FastListSerializer
         fields = ['_id', 'user_id', 'team_id', 'total_activities', 'total_duration', 
                   'total_calories', 'total_distance', 'rank', 'updated_at']
         read_only_fields = ['_id', 'updated_at']
 
 
-class WorkoutSerializer(serializers.ModelSerializer):
+class WorkoutSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Workout model"""
     class Meta:
         model = Workout
+        list_serializer_class = FastListSerializer
         fields = ['_id', 'name', 'description', 'activity_type', 'difficulty', 
                   'duration', 'calories_estimate', 'created_at']
         read_only_fields = ['_id', 'created_at']
@@ -58,7 +58,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'octofit_tracker.middleware.ServerTimingMiddleware',
+    'octofit_tracker.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'octofit_tracker.middleware.CompressionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -92,18 +95,128 @@ WSGI_APPLICATION = 'octofit_tracker.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# pymongo client options; unset optional variables keep pymongo's defaults
+MONGO_CLIENT = {
+    'host': os.environ.get('MONGO_HOST', 'localhost'),
+    'port': int(os.environ.get('MONGO_PORT', 27017)),
+    'maxPoolSize': int(os.environ.get('MONGO_MAX_POOL_SIZE', 100)),
+    'minPoolSize': int(os.environ.get('MONGO_MIN_POOL_SIZE', 0)),
+}
+for variable, option in (
+    ('MONGO_WAIT_QUEUE_TIMEOUT_MS', 'waitQueueTimeoutMS'),
+    ('MONGO_CONNECT_TIMEOUT_MS', 'connectTimeoutMS'),
+    ('MONGO_SERVER_SELECTION_TIMEOUT_MS', 'serverSelectionTimeoutMS'),
+    ('MONGO_MAX_IDLE_TIME_MS', 'maxIdleTimeMS'),
+):
+    if os.environ.get(variable):
+        MONGO_CLIENT[option] = int(os.environ[variable])
+# Wire compression, e.g. "zstd,snappy,zlib" (zstd and snappy need their extra packages)
+if os.environ.get('MONGO_COMPRESSORS'):
+    MONGO_CLIENT['compressors'] = os.environ['MONGO_COMPRESSORS']
+# Read concern level, e.g. "local" or "majority"
+if os.environ.get('MONGO_READ_CONCERN'):
+    MONGO_CLIENT['readConcernLevel'] = os.environ['MONGO_READ_CONCERN']
+
 DATABASES = {
     'default': {
         'ENGINE': 'djongo',
-        'NAME': 'octofit_db',
+        'NAME': os.environ.get('MONGO_DB_NAME', 'octofit_db'),
         'ENFORCE_SCHEMA': False,
-        'CLIENT': {
-            'host': 'localhost',
-            'port': 27017,
-        }
+        'CLIENT': MONGO_CLIENT,
+    }
+}
+
+# Addresses allowed to read internal endpoints such as connection pool stats
+INTERNAL_IPS = os.environ.get('INTERNAL_IPS', '127.0.0.1,::1').split(',')
+
+# Response cache: local memory by default. Collection versions live in
+# MongoDB, so every worker sees every write; a shared backend (file, Redis,
+# Memcached) only lets workers reuse each other's cached responses
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'octofit-tracker'),
     }
 }
 
+# Seconds a cached response may live; writes invalidate it sooner
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 600))
+
+# Seconds a process reuses the collection versions it read before asking
+# MongoDB again; writes from other processes show up within this delay
+RESPONSE_CACHE_VERSION_TTL = float(os.environ.get('RESPONSE_CACHE_VERSION_TTL', 1))
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'octofit_tracker.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Responses smaller than this many bytes are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+
+# MongoDB commands slower than this many milliseconds are logged with the
+# translated command; every request's timings are logged at INFO
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+
+# Send per-request db/serialize/render timings in a Server-Timing header
+SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', 'true').lower() in ('1', 'true', 'yes')
+
+# Directory where each worker process writes its /metrics totals so any worker
+# can report them all; leave empty for a single process. Empty it on startup.
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+
+# Let INTERNAL_IPS profile single requests with an X-Profile: cprofile|sample
+# header or ?profile= parameter; profiles are written to PROFILE_DIR
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', str(BASE_DIR / 'profiles'))
+# Requests profiled at the same time; others are served unprofiled
+PROFILE_MAX_CONCURRENT = int(os.environ.get('PROFILE_MAX_CONCURRENT', 1))
+# Stack sampling interval of the sampling profiler
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 1))
+
+# Request timings go to the console; set REQUEST_LOG_LEVEL=INFO to see every request
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'octofit_tracker.requests': {
+            'handlers': ['console'],
+            'level': os.environ.get('REQUEST_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
+# Connections each ASGI worker's motor client may open for the async endpoints
+ASYNC_MONGO_POOL_SIZE = int(os.environ.get('ASYNC_MONGO_POOL_SIZE', 100))
+
+# Default page size of the keyset-paginated activity and leaderboard listings
+API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 100))
+
+
+# Seconds between catch-ups of the in-process leaderboard rank engine with
+# entries other worker processes have updated
+LEADERBOARD_RANK_REFRESH_SECONDS = int(os.environ.get('LEADERBOARD_RANK_REFRESH_SECONDS', 60))
+
+# Seconds activity writes may be held back while a leaderboard rebuild swaps
+# in its board; the fence lapses after this even if the rebuild died
+LEADERBOARD_REBUILD_FENCE_SECONDS = int(os.environ.get('LEADERBOARD_REBUILD_FENCE_SECONDS', 60))
+
+# Rows validated and inserted together by the bulk activity endpoint
+ACTIVITY_BULK_BATCH_SIZE = int(os.environ.get('ACTIVITY_BULK_BATCH_SIZE', 1000))
+
+# Rows fetched per cursor batch and written per chunk by activity exports
+ACTIVITY_EXPORT_BATCH_SIZE = int(os.environ.get('ACTIVITY_EXPORT_BATCH_SIZE', 2000))
+
+# Seconds the columnar activity snapshot behind /api/analytics/ is reused
+ANALYTICS_SNAPSHOT_TTL = int(os.environ.get('ANALYTICS_SNAPSHOT_TTL', 300))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
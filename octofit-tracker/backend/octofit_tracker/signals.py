@@ -0,0 +1,54 @@
+from django.db.backends.signals import connection_created
+from django.db.models import DEFERRED
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from .models import User, Team, Activity, Leaderboard, Workout
+from . import leaderboard, mongo, response_cache
+
+
+@receiver(connection_created)
+def ensure_unique_keys(sender, connection, **kwargs):
+    """Create the unique keys the upserts rely on before the first query"""
+    if connection.vendor == 'djongo':
+        mongo.ensure_unique_keys(connection.connection)
+
+
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=Team)
+@receiver([post_save, post_delete], sender=Activity)
+@receiver([post_save, post_delete], sender=Leaderboard)
+@receiver([post_save, post_delete], sender=Workout)
+def invalidate_responses(sender, **kwargs):
+    """Invalidate cached responses that read the written collection"""
+    response_cache.bump(sender)
+
+
+@receiver(post_save, sender=Leaderboard)
+def rank_saved_entry(sender, instance, **kwargs):
+    """Re-rank a directly written leaderboard entry"""
+    leaderboard.entry_saved(instance)
+
+
+@receiver(post_delete, sender=Leaderboard)
+def unrank_deleted_entry(sender, instance, **kwargs):
+    """Drop a deleted leaderboard entry from the rankings"""
+    leaderboard.entry_deleted(instance)
+
+
+@receiver(post_init, sender=User)
+def remember_team(sender, instance, **kwargs):
+    """Note the team a user was loaded with, so saves that keep it can be told apart"""
+    instance._saved_team_id = instance.__dict__.get('team_id', DEFERRED)
+
+
+@receiver(post_save, sender=User)
+def move_team_totals(sender, instance, created, update_fields=None, **kwargs):
+    """Credit a user's further activity to the team they are now in"""
+    if update_fields is not None and 'team_id' not in update_fields:
+        return
+    team_id = instance.__dict__.get('team_id', DEFERRED)
+    if team_id is DEFERRED:
+        return
+    previous, instance._saved_team_id = instance._saved_team_id, team_id
+    if not created and (previous is DEFERRED or (previous or '') != (team_id or '')):
+        leaderboard.team_changed(str(instance._id), team_id or '')
@@ -0,0 +1,180 @@
+"""
+Deterministic synthetic data for OctoFit Tracker load tests
+
+Every team, user and activity is derived from the seed and its own index
+(ids included), so a given seed and end date always produce the same
+documents however the work is split across processes. Activities are
+generated per block of users in worker processes and written straight to
+MongoDB with unordered insert_many batches.
+"""
+import random
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from bson import ObjectId
+from django.db import connections
+from .models import User, Team, Activity
+from . import mongo
+
+# Fixed id timestamp (2024-01-01) so ids sort by kind and index, not by run time
+ID_EPOCH = 1704067200
+TEAM, USER, ACTIVITY = 1, 2, 3
+
+FIRST_NAMES = (
+    'Ada', 'Alan', 'Grace', 'Linus', 'Margaret', 'Ken', 'Barbara', 'Dennis', 'Frances', 'Edsger',
+    'Radia', 'Tim', 'Katherine', 'John', 'Hedy', 'Guido', 'Shafi', 'Donald', 'Sophie', 'Niklaus',
+)
+LAST_NAMES = (
+    'Lovelace', 'Turing', 'Hopper', 'Torvalds', 'Hamilton', 'Thompson', 'Liskov', 'Ritchie',
+    'Allen', 'Dijkstra', 'Perlman', 'Berners-Lee', 'Johnson', 'McCarthy', 'Lamarr', 'van Rossum',
+    'Goldwasser', 'Knuth', 'Wilson', 'Wirth',
+)
+TEAM_WORDS = (
+    'Comets', 'Falcons', 'Tigers', 'Orcas', 'Pioneers', 'Rockets', 'Wolves', 'Voyagers',
+    'Titans', 'Ravens', 'Mustangs', 'Phoenix',
+)
+
+# activity type: (mean minutes, calories per minute, miles per minute or None)
+ACTIVITY_PROFILES = {
+    'Running': (40, 10.0, 0.11),
+    'Cycling': (60, 8.0, 0.25),
+    'Swimming': (35, 9.0, 0.03),
+    'Weightlifting': (50, 6.0, None),
+    'Yoga': (45, 4.0, None),
+    'Boxing': (40, 11.0, None),
+    'Walking': (45, 4.5, 0.05),
+    'Rowing': (30, 9.5, None),
+}
+
+
+def object_id(kind, seed, index):
+    """Deterministic ObjectId: fixed timestamp, kind byte, 24-bit seed, 32-bit index"""
+    return ObjectId(struct.pack('>IB3sI', ID_EPOCH, kind, (seed & 0xFFFFFF).to_bytes(3, 'big'), index))
+
+
+def teams(count, seed):
+    """Return team documents"""
+    rng = random.Random(f'{seed}:teams')
+    return [
+        {
+            '_id': object_id(TEAM, seed, index),
+            'name': f'Team {rng.choice(TEAM_WORDS)} {index + 1}',
+            'description': f'Synthetic team {index + 1}',
+            'created_at': datetime(2024, 1, 1),
+        }
+        for index in range(count)
+    ]
+
+
+def user(index, seed, team_ids):
+    """Return one user document"""
+    rng = random.Random(f'{seed}:user:{index}')
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    return {
+        '_id': object_id(USER, seed, index),
+        'name': f'{first} {last}',
+        'email': f'{first}.{last}.{index}@octofit.example'.lower().replace(' ', ''),
+        'password': 'synthetic',
+        'team_id': str(team_ids[index % len(team_ids)]) if team_ids else None,
+        'created_at': datetime(2024, 1, 1) + timedelta(minutes=index),
+    }
+
+
+def user_activities(user_index, user_id, count, seed, end_date, days):
+    """
+    Return one user's activity documents: each user favours a few activity
+    types and has a fitness level scaling how long and hard they train
+    """
+    rng = random.Random(f'{seed}:activities:{user_index}')
+    types = rng.sample(list(ACTIVITY_PROFILES), 3)
+    weights = (6, 3, 1)
+    fitness = rng.uniform(0.6, 1.5)
+    documents = []
+    for position in range(count):
+        activity_type = rng.choices(types, weights)[0]
+        mean_minutes, calories_per_minute, miles_per_minute = ACTIVITY_PROFILES[activity_type]
+        duration = max(5, min(240, int(rng.gauss(mean_minutes * fitness, mean_minutes * 0.3))))
+        day = end_date - timedelta(days=rng.randrange(days))
+        distance = None
+        if miles_per_minute is not None:
+            distance = round(duration * miles_per_minute * rng.uniform(0.8, 1.2) * fitness ** 0.5, 2)
+        documents.append({
+            '_id': object_id(ACTIVITY, seed, user_index * count + position),
+            'user_id': user_id,
+            'activity_type': activity_type,
+            'duration': duration,
+            'calories_burned': int(duration * calories_per_minute * rng.uniform(0.85, 1.15)),
+            'distance': distance,
+            'date': datetime(day.year, day.month, day.day),
+            'created_at': datetime(day.year, day.month, day.day, rng.randrange(6, 22), rng.randrange(60)),
+        })
+    return documents
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def insert_activities(alias, seed, user_range, per_user, end_date, days, batch_size):
+    """Worker entry point: generate and insert the activities of a block of users"""
+    client = mongo.new_client(alias)
+    try:
+        collection = client[mongo.database_name(alias)][Activity._meta.db_table]
+        documents = (
+            document
+            for user_index in range(*user_range)
+            for document in user_activities(
+                user_index, str(object_id(USER, seed, user_index)), per_user, seed, end_date, days
+            )
+        )
+        inserted = 0
+        for chunk in mongo.chunked(documents, batch_size):
+            collection.insert_many(chunk, ordered=False)
+            inserted += len(chunk)
+        return inserted
+    finally:
+        client.close()
+
+
+def generate(team_count, user_count, per_user, seed, end_date, days=365, parallel=1,
+             batch_size=10000, alias='default', progress=None):
+    """
+    Replace teams, users and activities with synthetic ones and return
+    (teams, users, activities) counts
+    """
+    db = mongo.get_database(alias)
+    for model in (Team, User, Activity):
+        db[model._meta.db_table].delete_many({})
+
+    team_documents = teams(team_count, seed)
+    if team_documents:
+        db[Team._meta.db_table].insert_many(team_documents, ordered=False)
+    team_ids = [document['_id'] for document in team_documents]
+    for chunk in mongo.chunked((user(index, seed, team_ids) for index in range(user_count)), batch_size):
+        db[User._meta.db_table].insert_many(chunk, ordered=False)
+
+    # About four blocks per worker, so faster workers pick up the slack
+    block = max(1, min(1000, -(-user_count // (max(parallel, 1) * 4))))
+    ranges = [(start, min(start + block, user_count)) for start in range(0, user_count, block)]
+    work = partial(
+        insert_activities, alias, seed,
+        per_user=per_user, end_date=end_date, days=days, batch_size=batch_size,
+    )
+    inserted = 0
+    if parallel > 1:
+        # pymongo clients must not cross a fork
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=parallel, initializer=_init_worker) as pool:
+            counts = pool.map(work, ranges)
+            for count in counts:
+                inserted += count
+                if progress:
+                    progress(inserted)
+    else:
+        for user_range in ranges:
+            inserted += work(user_range)
+            if progress:
+                progress(inserted)
+    return len(team_documents), user_count, inserted
@@ -1,8 +1,47 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import CommandError
+from django.db import DatabaseError
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
 from rest_framework.test import APITestCase
 from rest_framework import status
-from .models import User, Team, Activity, Leaderboard, Workout
-from datetime import date
+from .models import User, Team, Activity, Leaderboard, DailyTotal, UserStats, Workout
+from .ranking import RankEngine
+from .serializers import ActivitySerializer, LeaderboardSerializer, UserSerializer
+from . import (
+    analytics, async_views, exports, instrumentation, leaderboard, metrics, mongo, monitoring,
+    profiling, response_cache, synthetic, user_stats
+)
+from .conditional import ConditionalGetMixin, encoded_etag, representation_etag
+from .management.commands import index_report
+from .pagination import ActivityPagination
+from .middleware import (
+    CompressionMiddleware, ProfilingMiddleware, ServerTimingMiddleware, preferred_encoding
+)
+from .renderers import ORJSONRenderer
+from .views import MetricsView, MongoPoolView
+from pymongo import UpdateOne, monitoring as pymongo_monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+import numpy as np
+from bson import ObjectId
+from datetime import date, datetime, timedelta, timezone
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+import asyncio
+import gzip
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest.mock import Mock, patch
 
 
 class UserModelTestCase(TestCase):
@@ -268,3 +307,1622 @@ class WorkoutAPITestCase(APITestCase):
         }
         response = self.client.post('/api/workouts/', data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class LeaderboardMaintenanceAPITestCase(APITestCase):
+    """API test cases for incremental leaderboard maintenance"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.team = Team.objects.create(
+            name='Maintenance Team',
+            description='Team for leaderboard maintenance testing'
+        )
+        self.user = User.objects.create(
+            name='Maintenance User',
+            email='maintenance@example.com',
+            password='testpass123',
+            team_id=str(self.team._id)
+        )
+        self.data = {
+            'user_id': str(self.user._id),
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories_burned': 300,
+            'distance': 3.0,
+            'date': date.today().isoformat()
+        }
+    
+    def get_entry(self):
+        """Fetch the leaderboard entry of the test user"""
+        return Leaderboard.objects.get(user_id=str(self.user._id))
+    
+    def test_create_activity_updates_leaderboard(self):
+        """Test creating an activity creates and increments the entry"""
+        self.client.post('/api/activities/', self.data, format='json')
+        self.client.post('/api/activities/', self.data, format='json')
+        entry = self.get_entry()
+        self.assertEqual(entry.team_id, str(self.team._id))
+        self.assertEqual(entry.total_activities, 2)
+        self.assertEqual(entry.total_duration, 60)
+        self.assertEqual(entry.total_calories, 600)
+        self.assertAlmostEqual(entry.total_distance, 6.0)
+    
+    def test_update_activity_applies_difference(self):
+        """Test updating an activity applies only the difference"""
+        response = self.client.post('/api/activities/', self.data, format='json')
+        url = f"/api/activities/{response.data['_id']}/"
+        self.client.patch(url, {'calories_burned': 450}, format='json')
+        entry = self.get_entry()
+        self.assertEqual(entry.total_activities, 1)
+        self.assertEqual(entry.total_calories, 450)
+    
+    def test_delete_activity_reverts_totals(self):
+        """Test deleting an activity withdraws it from the entry"""
+        response = self.client.post('/api/activities/', self.data, format='json')
+        self.client.delete(f"/api/activities/{response.data['_id']}/")
+        entry = self.get_entry()
+        self.assertEqual(entry.total_activities, 0)
+        self.assertEqual(entry.total_calories, 0)
+    
+    def test_one_entry_per_user(self):
+        """Test a second entry for the same user is rejected by the unique key"""
+        self.client.post('/api/activities/', self.data, format='json')
+        with self.assertRaises(DatabaseError):
+            Leaderboard.objects.create(user_id=str(self.user._id), team_id='other')
+    
+    def test_new_entry_ranks_below_leader(self):
+        """Test a user's first activity ranks them by score, not above the leader"""
+        leaderboard.reset_rank_engine()
+        Leaderboard.objects.create(user_id='leader', team_id='other', total_calories=1000, rank=1)
+        self.client.post('/api/activities/', self.data, format='json')
+        for url in ('/api/leaderboard/top/', '/api/leaderboard/'):
+            response = self.client.get(url)
+            rows = response.data['results'] if 'results' in response.data else response.data
+            self.assertEqual(
+                [(row['user_id'], row['rank']) for row in rows],
+                [('leader', 1), (str(self.user._id), 2)]
+            )
+
+
+class MongoUpsertTestCase(SimpleTestCase):
+    """Test cases for upserts that race on a unique key"""
+    
+    def test_upsert_retries_lost_insert(self):
+        """Test an upsert that lost the insert race is retried once"""
+        calls = []
+        
+        def write(key, update, upsert):
+            calls.append(key)
+            if len(calls) == 1:
+                raise DuplicateKeyError('E11000 duplicate key')
+            return {'user_id': key['user_id'], 'total_calories': 300}
+        
+        document = mongo.upsert(write, {'user_id': 'u1'}, {'$inc': {'total_calories': 300}}, upsert=True)
+        self.assertEqual(document['total_calories'], 300)
+        self.assertEqual(len(calls), 2)
+    
+    def test_bulk_upsert_retries_duplicates_only(self):
+        """Test only the operations that hit a duplicate key are written again"""
+        operations = [
+            UpdateOne({'user_id': f'u{index}'}, {'$inc': {'n': 1}}, upsert=True) for index in range(3)
+        ]
+        
+        class Manager:
+            batches = []
+            
+            def mongo_bulk_write(self, batch, ordered):
+                self.batches.append(batch)
+                if len(self.batches) == 1:
+                    raise BulkWriteError({'writeErrors': [{'index': 1, 'code': 11000}]})
+        
+        manager = Manager()
+        mongo.bulk_upsert(manager.mongo_bulk_write, operations)
+        self.assertEqual(manager.batches[1], [operations[1]])
+        
+        manager.batches = []
+        
+        def fail(batch, ordered):
+            manager.batches.append(batch)
+            raise BulkWriteError({'writeErrors': [{'index': 0, 'code': 121}]})
+        manager.mongo_bulk_write = fail
+        with self.assertRaises(BulkWriteError):
+            mongo.bulk_upsert(manager.mongo_bulk_write, operations)
+        self.assertEqual(len(manager.batches), 1)
+    
+    def test_unique_keys_ensured_once_per_database(self):
+        """Test the unique keys declared in model Meta are created once per process and database"""
+        created = []
+        
+        class Collection:
+            def __init__(self, name):
+                self.name = name
+            
+            def create_index(self, keys, name, unique):
+                created.append((self.name, name, keys, unique))
+        
+        class Database:
+            name = 'unique_keys_test'
+            
+            def __getitem__(self, name):
+                return Collection(name)
+        
+        self.addCleanup(mongo._unique_keys_ensured.discard, Database.name)
+        mongo.ensure_unique_keys(Database())
+        mongo.ensure_unique_keys(Database())
+        self.assertEqual(sorted(created), [
+            ('leaderboard', 'leaderboard_user_uniq', [('user_id', 1)], True),
+            ('leaderboard_daily', 'daily_user_day_uniq', [('user_id', 1), ('day', 1)], True),
+            ('user_stats', 'user_stats_user_uniq', [('user_id', 1)], True),
+        ])
+
+
+class RankEngineTestCase(SimpleTestCase):
+    """Test cases for the leaderboard rank engine"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.engine = RankEngine()
+        self.engine.load([('a', 100), ('b', 200), ('c', 200), ('d', 50)])
+    
+    def test_competition_ranking(self):
+        """Test tied scores share a rank and leave a gap after them"""
+        self.assertEqual(self.engine.rank('b'), 1)
+        self.assertEqual(self.engine.rank('c'), 1)
+        self.assertEqual(self.engine.rank('a'), 3)
+        self.assertEqual(self.engine.rank('d'), 4)
+    
+    def test_dense_ranking(self):
+        """Test dense ranking leaves no gaps after ties"""
+        self.assertEqual(self.engine.rank('a', 'dense'), 2)
+        self.assertEqual(self.engine.rank('d', 'dense'), 3)
+    
+    def test_update_and_remove(self):
+        """Test score changes re-rank users"""
+        self.engine.update('d', 300)
+        self.engine.remove('b')
+        self.assertEqual(self.engine.rank('d'), 1)
+        self.assertIsNone(self.engine.rank('b'))
+        self.assertEqual([uid for _, uid, _ in self.engine.top(10)], ['d', 'c', 'a'])
+    
+    def test_around(self):
+        """Test neighbours are returned either side of a user"""
+        self.assertEqual(
+            self.engine.around('a', 1),
+            [(1, 'c', 200), (3, 'a', 100), (4, 'd', 50)]
+        )
+
+
+class LeaderboardAroundAPITestCase(APITestCase):
+    """API test cases for the leaderboard around endpoint"""
+    
+    def setUp(self):
+        """Set up test data"""
+        leaderboard.reset_rank_engine()
+        for index, calories in enumerate([500, 400, 400, 300, 200]):
+            Leaderboard.objects.create(
+                user_id=f'user{index}',
+                team_id='team',
+                total_calories=calories
+            )
+    
+    def test_around_returns_neighbours(self):
+        """Test entries around a user come back with live ranks"""
+        response = self.client.get('/api/leaderboard/around/?user_id=user3&window=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(item['user_id'], item['rank']) for item in response.data],
+            [('user2', 2), ('user3', 4), ('user4', 5)]
+        )
+    
+    def test_around_unknown_user(self):
+        """Test an unranked user returns 404"""
+        response = self.client.get('/api/leaderboard/around/?user_id=nobody')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class WindowStartTestCase(SimpleTestCase):
+    """Test cases for leaderboard window boundaries"""
+    
+    def test_window_start(self):
+        """Test each window starts on the expected day"""
+        today = date(2024, 3, 15)
+        self.assertEqual(leaderboard.window_start('7d', today), date(2024, 3, 9))
+        self.assertEqual(leaderboard.window_start('30d', today), date(2024, 2, 15))
+        self.assertEqual(leaderboard.window_start('month', today), date(2024, 3, 1))
+    
+    def test_unknown_window(self):
+        """Test an unknown window is rejected"""
+        with self.assertRaises(ValueError):
+            leaderboard.window_start('1y')
+
+
+class WindowedLeaderboardAPITestCase(APITestCase):
+    """API test cases for time-windowed leaderboards"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.team = Team.objects.create(
+            name='Window Team',
+            description='Team for windowed leaderboard testing'
+        )
+        self.recent = User.objects.create(
+            name='Recent User',
+            email='recent@example.com',
+            password='testpass123',
+            team_id=str(self.team._id)
+        )
+        self.veteran = User.objects.create(
+            name='Veteran User',
+            email='veteran@example.com',
+            password='testpass123',
+            team_id=str(self.team._id)
+        )
+        self.log_activity(self.recent, 200, date.today())
+        self.log_activity(self.veteran, 900, date.today() - timedelta(days=40))
+        self.log_activity(self.veteran, 100, date.today() - timedelta(days=3))
+    
+    def log_activity(self, user, calories, day):
+        """Log an activity through the API"""
+        self.client.post('/api/activities/', {
+            'user_id': str(user._id),
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories_burned': calories,
+            'date': day.isoformat()
+        }, format='json')
+    
+    def test_weekly_board_excludes_older_activities(self):
+        """Test the 7d board only counts the last seven days"""
+        response = self.client.get('/api/leaderboard/?window=7d')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(item['user_id'], item['total_calories'], item['rank']) for item in response.data],
+            [(str(self.recent._id), 200, 1), (str(self.veteran._id), 100, 2)]
+        )
+    
+    def test_windowed_by_team(self):
+        """Test windowed boards can be filtered by team"""
+        response = self.client.get(
+            f'/api/leaderboard/by_team/?team_id={self.team._id}&window=30d'
+        )
+        self.assertEqual(len(response.data), 2)
+    
+    def test_invalid_window(self):
+        """Test an unknown window returns 400"""
+        response = self.client.get('/api/leaderboard/top/?window=1y')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_invalid_limit(self):
+        """Test a zero, negative or oversized limit returns 400"""
+        for limit in ('0', '-1', '100000', 'ten'):
+            response = self.client.get(f'/api/leaderboard/top/?window=7d&limit={limit}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_team_change_moves_later_activity(self):
+        """Test activity after a team change counts for the new team"""
+        team = Team.objects.create(name='New Team', description='Team joined later')
+        self.recent.team_id = str(team._id)
+        self.recent.save()
+        self.log_activity(self.recent, 50, date.today())
+        response = self.client.get(f'/api/leaderboard/by_team/?team_id={team._id}&window=7d')
+        self.assertEqual(
+            [(item['user_id'], item['total_calories']) for item in response.data],
+            [(str(self.recent._id), 250)]
+        )
+    
+    def test_unfiltered_board_shows_latest_team(self):
+        """Test a user who changed team is listed in the team of their latest activity"""
+        team = Team.objects.create(name='New Team', description='Team joined later')
+        self.veteran.team_id = str(team._id)
+        self.veteran.save()
+        self.log_activity(self.veteran, 50, date.today())
+        response = self.client.get('/api/leaderboard/?window=7d')
+        teams = {item['user_id']: item['team_id'] for item in response.data}
+        self.assertEqual(teams[str(self.veteran._id)], str(team._id))
+    
+    def test_saves_keeping_the_team_leave_totals_alone(self):
+        """Test only saves that change a user's team move their totals"""
+        with patch.object(leaderboard, 'team_changed') as team_changed:
+            self.recent.name = 'Renamed User'
+            self.recent.save()
+            User.objects.get(_id=self.veteran._id).save()
+            self.assertFalse(team_changed.called)
+            self.recent.team_id = ''
+            self.recent.save()
+        team_changed.assert_called_once_with(str(self.recent._id), '')
+
+
+class TeamStatsAPITestCase(APITestCase):
+    """API test cases for the team stats endpoint"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.team = Team.objects.create(
+            name='Stats Team',
+            description='Team for stats testing'
+        )
+        team_id = str(self.team._id)
+        for index, calories in enumerate([300, 200]):
+            user = User.objects.create(
+                name=f'Stats User {index}',
+                email=f'stats{index}@example.com',
+                password='testpass123',
+                team_id=team_id
+            )
+            Leaderboard.objects.create(
+                user_id=str(user._id),
+                team_id=team_id,
+                total_activities=2,
+                total_calories=calories,
+                total_distance=1.255
+            )
+        User.objects.create(
+            name='Idle Stats User',
+            email='idlestats@example.com',
+            password='testpass123',
+            team_id=team_id
+        )
+    
+    def test_team_stats(self):
+        """Test totals and member count are aggregated"""
+        response = self.client.get(f'/api/teams/{self.team._id}/stats/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['team_name'], 'Stats Team')
+        self.assertEqual(response.data['total_activities'], 4)
+        self.assertEqual(response.data['total_calories'], 500)
+        self.assertEqual(response.data['total_distance'], 2.51)
+        self.assertEqual(response.data['member_count'], 3)
+    
+    def test_unknown_team_stats(self):
+        """Test stats for a missing team returns 404"""
+        response = self.client.get('/api/teams/000000000000000000000000/stats/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RebuildLeaderboardTestCase(TestCase):
+    """Test cases for the bulk leaderboard rebuild"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.users = [
+            User.objects.create(
+                name=f'Rebuild User {index}',
+                email=f'rebuild{index}@example.com',
+                password='testpass123',
+                team_id='team'
+            )
+            for index in range(3)
+        ]
+        for user, calories in zip(self.users, [300, 300, 0]):
+            if calories:
+                Activity.objects.create(
+                    user_id=str(user._id),
+                    activity_type='Yoga',
+                    duration=30,
+                    calories_burned=calories,
+                    date=date.today()
+                )
+    
+    def test_rebuild_totals_and_ranks(self):
+        """Test every user gets an entry with competition ranks"""
+        self.assertEqual(leaderboard.rebuild_leaderboard(), 3)
+        ranks = {
+            entry.user_id: (entry.total_calories, entry.rank)
+            for entry in Leaderboard.objects.all()
+        }
+        self.assertEqual(ranks[str(self.users[0]._id)], (300, 1))
+        self.assertEqual(ranks[str(self.users[1]._id)], (300, 1))
+        self.assertEqual(ranks[str(self.users[2]._id)], (0, 3))
+    
+    def test_rebuild_keeps_concurrent_writes(self):
+        """Test an activity logged while the board is aggregated survives the swap"""
+        aggregate = leaderboard._aggregate_totals
+        user_id = str(self.users[2]._id)
+        
+        def aggregate_then_log(*args, **kwargs):
+            rows = aggregate(*args, **kwargs)
+            if not args[1:] and 'user_ids' not in kwargs:
+                leaderboard.activity_created(Activity.objects.create(
+                    user_id=user_id, activity_type='Yoga', duration=30, calories_burned=120, date=date.today()
+                ))
+            return rows
+        
+        with patch.object(leaderboard, '_aggregate_totals', aggregate_then_log):
+            leaderboard.rebuild_leaderboard()
+        self.assertEqual(Leaderboard.objects.get(user_id=user_id).total_calories, 120)
+    
+    def test_rebuild_counts_increments_during_swap_once(self):
+        """Test an increment landing between the aggregation and the swap is counted exactly once"""
+        aggregate = leaderboard._aggregate_totals
+        user_id = str(self.users[2]._id)
+        logged, fenced = [], []
+        
+        def log_then_aggregate(*args, **kwargs):
+            if not args[1:] and 'user_ids' not in kwargs:
+                # The activity is stored before the scan, its increment only after it
+                logged.append(Activity.objects.create(
+                    user_id=user_id, activity_type='Yoga', duration=30, calories_burned=120, date=date.today()
+                ))
+            return aggregate(*args, **kwargs)
+        
+        def straggling_increment():
+            fenced.append(leaderboard.rebuild_in_progress())
+            leaderboard.activity_created(logged[0])
+        
+        with patch.object(leaderboard, '_aggregate_totals', log_then_aggregate), \
+                patch.object(leaderboard, '_drain_writers', straggling_increment):
+            leaderboard.rebuild_leaderboard()
+        self.assertEqual(fenced, [True])
+        self.assertFalse(leaderboard.rebuild_in_progress())
+        self.assertEqual(Leaderboard.objects.get(user_id=user_id).total_calories, 120)
+        self.assertEqual(DailyTotal.objects.get(user_id=user_id).total_calories, 120)
+
+
+class ActivityBulkAPITestCase(APITestCase):
+    """API test cases for bulk activity ingest"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create(
+            name='Bulk User',
+            email='bulk@example.com',
+            password='testpass123'
+        )
+        self.row = {
+            'user_id': str(self.user._id),
+            'activity_type': 'Cycling',
+            'duration': 40,
+            'calories_burned': 400,
+            'date': date.today().isoformat()
+        }
+    
+    def test_bulk_json_array(self):
+        """Test a JSON array is inserted and counted on the leaderboard"""
+        response = self.client.post('/api/activities/bulk/', [self.row] * 3, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(Activity.objects.filter(user_id=str(self.user._id)).count(), 3)
+        entry = Leaderboard.objects.get(user_id=str(self.user._id))
+        self.assertEqual(entry.total_calories, 1200)
+    
+    def test_bulk_ndjson_reports_row_errors(self):
+        """Test invalid NDJSON rows are reported without failing the batch"""
+        body = '\n'.join([
+            json.dumps(self.row),
+            '',
+            json.dumps({**self.row, 'duration': 'long'}),
+            '{not json',
+        ])
+        response = self.client.post(
+            '/api/activities/bulk/', body, content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([error['line'] for error in response.data['errors']], [3, 4])
+        self.assertIn('duration', response.data['errors'][0]['errors'])
+    
+    def test_bulk_reports_rows_the_database_rejects(self):
+        """Test rows MongoDB rejects are reported and only inserted rows reach the totals"""
+        insert_many = Activity.objects.mongo_insert_many
+        
+        def reject_second(documents, ordered):
+            insert_many(documents[:1] + documents[2:], ordered=ordered)
+            raise BulkWriteError({
+                'writeErrors': [{'index': 1, 'code': 121, 'errmsg': 'Document failed validation'}],
+            })
+        
+        rows = [self.row, {**self.row, 'calories_burned': 999}, self.row]
+        with patch.object(Activity.objects, 'mongo_insert_many', reject_second):
+            response = self.client.post('/api/activities/bulk/', rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1])
+        entry = Leaderboard.objects.get(user_id=str(self.user._id))
+        self.assertEqual(entry.total_calories, 800)
+
+
+class KeysetPaginationAPITestCase(APITestCase):
+    """API test cases for keyset-paginated listings"""
+    
+    def setUp(self):
+        """Set up test data"""
+        for offset in range(5):
+            Activity.objects.create(
+                user_id='paged-user',
+                activity_type='Running',
+                duration=30,
+                calories_burned=300,
+                date=date.today() - timedelta(days=offset // 2)
+            )
+    
+    def test_pages_cover_every_activity_once(self):
+        """Test following next links visits each activity exactly once, newest first"""
+        url = '/api/activities/by_user/?user_id=paged-user&page_size=2'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen.extend(response.data['results'])
+            url = response.data['next']
+        self.assertEqual(len({item['_id'] for item in seen}), 5)
+        dates = [item['date'] for item in seen]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+    
+    def test_invalid_cursor(self):
+        """Test a tampered cursor returns 404"""
+        response = self.client.get('/api/activities/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ExportChunksTestCase(SimpleTestCase):
+    """Test cases for streamed export encodings"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.rows = [
+            {field: f'{field}-{index}' for field in exports.EXPORT_FIELDS}
+            for index in range(5)
+        ]
+    
+    def test_csv_chunks(self):
+        """Test CSV is emitted header first, then one chunk per batch"""
+        chunks = list(exports.csv_chunks(iter(self.rows), 2))
+        self.assertEqual(len(chunks), 4)
+        self.assertTrue(chunks[0].startswith('_id,user_id,'))
+        self.assertEqual(''.join(chunks).count('\n'), 6)
+    
+    def test_gzip_ndjson_chunks(self):
+        """Test gzipped NDJSON decompresses to one row per line"""
+        body = b''.join(exports.gzip_chunks(exports.ndjson_chunks(iter(self.rows), 2)))
+        lines = gzip.decompress(body).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.rows)
+
+
+class ActivityExportAPITestCase(APITestCase):
+    """API test cases for streaming activity exports"""
+    
+    def setUp(self):
+        """Set up test data"""
+        for offset in range(3):
+            Activity.objects.create(
+                user_id='export-user',
+                activity_type='Swimming',
+                duration=30,
+                calories_burned=250,
+                distance=1.5,
+                date=date.today() - timedelta(days=offset * 10)
+            )
+    
+    def test_export_ndjson_since(self):
+        """Test NDJSON export filters by user and date"""
+        since = (date.today() - timedelta(days=15)).isoformat()
+        response = self.client.get(
+            f'/api/activities/export/?format=ndjson&user_id=export-user&since={since}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['date'], date.today().isoformat())
+    
+    def test_export_csv(self):
+        """Test CSV export includes a header and every activity"""
+        response = self.client.get('/api/activities/export/?format=csv&user_id=export-user')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 4)
+    
+    def test_export_invalid_since(self):
+        """Test a malformed since date returns 400"""
+        response = self.client.get('/api/activities/export/?format=csv&since=yesterday')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class StreaksTestCase(SimpleTestCase):
+    """Test cases for activity streak computation"""
+    
+    def test_streaks(self):
+        """Test every run of active days and the longest one are found"""
+        active_days = {
+            '2024-03-01': 1, '2024-03-02': 2, '2024-03-03': 1,
+            '2024-03-05': 0, '2024-03-07': 1, '2024-03-08': 1,
+        }
+        self.assertEqual(user_stats.streak_runs(active_days), (
+            {'2024-03-03': '2024-03-01', '2024-03-08': '2024-03-07'},
+            {'2024-03-01': '2024-03-03', '2024-03-07': '2024-03-08'},
+            3,
+        ))
+    
+    def test_no_active_days(self):
+        """Test a user without activity has no streak"""
+        self.assertEqual(user_stats.streak_runs({}), ({}, {}, 0))
+    
+    def test_joined_run(self):
+        """Test a newly active day joins the runs ending before and starting after it"""
+        streak_starts = {'2024-03-03': '2024-03-01'}
+        streak_ends = {'2024-03-05': '2024-03-08'}
+        self.assertEqual(
+            user_stats.joined_run(streak_starts, streak_ends, date(2024, 3, 4)),
+            ('2024-03-01', '2024-03-08')
+        )
+        self.assertEqual(user_stats.joined_run({}, {}, date(2024, 3, 4)), ('2024-03-04', '2024-03-04'))
+    
+    def test_join_update_several_days(self):
+        """Test days made active together are joined to each other and to the runs either side"""
+        summary = {'streak_starts': {'2024-03-02': '2024-03-01'}, 'streak_ends': {'2024-03-06': '2024-03-06'}}
+        update = user_stats._join_update(summary, [date(2024, 3, 3), date(2024, 3, 4), date(2024, 3, 5)])
+        self.assertEqual(update['$set'], {
+            'streak_starts.2024-03-06': '2024-03-01', 'streak_ends.2024-03-01': '2024-03-06',
+        })
+        self.assertEqual(set(update['$unset']), {'streak_starts.2024-03-02', 'streak_ends.2024-03-06'})
+        self.assertEqual(update['$max'], {'longest_streak': 6})
+    
+    def test_split_run(self):
+        """Test a day going inactive leaves the parts of its run either side of it"""
+        self.assertEqual(
+            user_stats.split_run(date(2024, 3, 1), date(2024, 3, 5), date(2024, 3, 3)),
+            [('2024-03-01', '2024-03-02'), ('2024-03-04', '2024-03-05')]
+        )
+        self.assertEqual(user_stats.split_run(date(2024, 3, 1), date(2024, 3, 1), date(2024, 3, 1)), [])
+    
+    def test_window_cutoffs(self):
+        """Test the reported windows end today and span the configured number of periods"""
+        self.assertEqual(user_stats.window_cutoffs(date(2024, 6, 30)), ('2024-06-01', '2024-W15', '2023-07'))
+
+
+class UserStatsAPITestCase(APITestCase):
+    """API test cases for the user stats endpoint"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create(
+            name='Stats API User',
+            email='statsapi@example.com',
+            password='testpass123'
+        )
+        for offset, duration in enumerate([30, 45, 20]):
+            self.client.post('/api/activities/', {
+                'user_id': str(self.user._id),
+                'activity_type': 'Running',
+                'duration': duration,
+                'calories_burned': duration * 10,
+                'distance': duration / 10,
+                'date': (date.today() - timedelta(days=offset)).isoformat()
+            }, format='json')
+    
+    def test_user_stats(self):
+        """Test totals, streaks and personal bests are served from the summary"""
+        response = self.client.get(f'/api/users/{self.user._id}/stats/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['totals']['Running']['activities'], 3)
+        self.assertEqual(response.data['totals']['Running']['duration'], 95)
+        self.assertEqual(response.data['current_streak'], 3)
+        self.assertEqual(response.data['longest_streak'], 3)
+        self.assertEqual(response.data['personal_bests']['Running']['duration'], 45)
+        self.assertEqual(len(response.data['daily']), 3)
+    
+    def test_deleting_best_activity_recomputes_bests(self):
+        """Test withdrawing a personal best falls back to the next best activity"""
+        best = Activity.objects.get(user_id=str(self.user._id), duration=45)
+        self.client.delete(f'/api/activities/{best._id}/')
+        response = self.client.get(f'/api/users/{self.user._id}/stats/')
+        self.assertEqual(response.data['personal_bests']['Running']['duration'], 30)
+        self.assertEqual(response.data['longest_streak'], 1)
+    
+    def test_bulk_ingest_extends_streak(self):
+        """Test days added by bulk ingest join the streak they border"""
+        rows = [
+            {
+                'user_id': str(self.user._id), 'activity_type': 'Yoga', 'duration': 30,
+                'calories_burned': 100, 'date': (date.today() - timedelta(days=offset)).isoformat(),
+            }
+            for offset in (3, 4, 4)
+        ]
+        self.client.post('/api/activities/bulk/', rows, format='json')
+        response = self.client.get(f'/api/users/{self.user._id}/stats/')
+        self.assertEqual(response.data['current_streak'], 5)
+        self.assertEqual(response.data['longest_streak'], 5)
+    
+    def test_days_before_the_streak_window_are_not_kept(self):
+        """Test activity older than the tracked streak window only adds to the totals"""
+        self.client.post('/api/activities/', {
+            'user_id': str(self.user._id),
+            'activity_type': 'Running',
+            'duration': 10,
+            'calories_burned': 100,
+            'date': (date.today() - timedelta(days=user_stats.STREAK_DAYS + 10)).isoformat()
+        }, format='json')
+        summary = UserStats.objects.mongo_find_one({'user_id': str(self.user._id)})
+        self.assertEqual(len(summary['active_days']), 3)
+        self.assertEqual(len(summary['streak_ends']), 1)
+        self.assertEqual(summary['totals']['Running']['activities'], 4)
+
+
+class GroupedPercentilesTestCase(SimpleTestCase):
+    """Test cases for vectorized grouped percentiles"""
+    
+    def test_matches_numpy_percentile(self):
+        """Test each group's percentiles match np.percentile"""
+        rng = np.random.default_rng(7)
+        codes = rng.integers(0, 4, size=1000)
+        values = rng.normal(60, 15, size=1000)
+        table = analytics.grouped_percentiles(codes, values, 5, (10, 50, 90))
+        for code in range(4):
+            np.testing.assert_allclose(
+                table[code], np.percentile(values[codes == code], [10, 50, 90])
+            )
+        self.assertTrue(np.isnan(table[4]).all())
+
+
+class AnalyticsAPITestCase(APITestCase):
+    """API test cases for analytics endpoints"""
+    
+    def setUp(self):
+        """Set up test data"""
+        analytics.invalidate_snapshot()
+        self.team = Team.objects.create(
+            name='Analytics Team',
+            description='Team for analytics testing'
+        )
+        self.user = User.objects.create(
+            name='Analytics User',
+            email='analytics@example.com',
+            password='testpass123',
+            team_id=str(self.team._id)
+        )
+        for duration in (10, 20, 30, 40, 50):
+            Activity.objects.create(
+                user_id=str(self.user._id),
+                activity_type='Boxing',
+                duration=duration,
+                calories_burned=duration * 8,
+                date=date.today()
+            )
+    
+    def test_duration_percentiles(self):
+        """Test duration percentiles per activity type"""
+        response = self.client.get('/api/analytics/durations/?percentiles=50,90')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['Boxing'], {'count': 5, 'p50': 30.0, 'p90': 46.0})
+    
+    def test_activity_writes_reload_the_snapshot(self):
+        """Test an activity posted, edited or deleted through the API shows in the next percentiles"""
+        self.assertEqual(self.client.get('/api/analytics/durations/?percentiles=50').data['Boxing']['p50'], 30.0)
+        data = {
+            'user_id': str(self.user._id), 'activity_type': 'Boxing', 'duration': 60,
+            'calories_burned': 480, 'date': date.today().isoformat(),
+        }
+        url = f"/api/activities/{self.client.post('/api/activities/', data, format='json').data['_id']}/"
+        response = self.client.get('/api/analytics/durations/?percentiles=50')
+        self.assertEqual(response.data['Boxing'], {'count': 6, 'p50': 35.0})
+        self.client.patch(url, {'duration': 10}, format='json')
+        response = self.client.get('/api/analytics/durations/?percentiles=50')
+        self.assertEqual(response.data['Boxing'], {'count': 6, 'p50': 25.0})
+        self.client.delete(url)
+        response = self.client.get('/api/analytics/durations/?percentiles=50')
+        self.assertEqual(response.data['Boxing'], {'count': 5, 'p50': 30.0})
+    
+    def test_calories_per_minute_histogram(self):
+        """Test every activity lands in the histogram"""
+        response = self.client.get('/api/analytics/calories-per-minute/?bins=5')
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual(response.data['mean'], 8.0)
+    
+    def test_team_comparison(self):
+        """Test team totals are grouped per team"""
+        response = self.client.get('/api/analytics/teams/')
+        self.assertEqual(response.data[0]['team_id'], str(self.team._id))
+        self.assertEqual(response.data[0]['total_calories'], 1200)
+    
+    def test_invalid_percentiles(self):
+        """Test out-of-range percentiles return 400"""
+        response = self.client.get('/api/analytics/durations/?percentiles=150')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    @override_settings(RESPONSE_CACHE_VERSION_TTL=0)
+    def test_invalidation_from_other_processes(self):
+        """Test a snapshot invalidated through the shared versions is reloaded"""
+        self.assertEqual(self.client.get('/api/analytics/calories-per-minute/').data['count'], 5)
+        Activity.objects.create(
+            user_id=str(self.user._id), activity_type='Boxing', duration=60,
+            calories_burned=480, date=date.today()
+        )
+        mongo.get_database()[response_cache.VERSIONS_COLLECTION].update_one(
+            {'_id': analytics.SNAPSHOT_VERSION}, {'$inc': {'version': 1}}
+        )
+        self.assertEqual(self.client.get('/api/analytics/calories-per-minute/').data['count'], 6)
+
+
+class SparseFieldsAPITestCase(APITestCase):
+    """API test cases for ?fields= and ?exclude= projections"""
+    
+    def setUp(self):
+        """Set up test data"""
+        Activity.objects.create(
+            user_id='sparse-user',
+            activity_type='Running',
+            duration=30,
+            calories_burned=300,
+            date=date.today()
+        )
+        leaderboard.reset_rank_engine()
+        Leaderboard.objects.create(user_id='sparse-user', team_id='team-a', total_calories=300)
+    
+    def test_fields(self):
+        """Test only the requested fields are returned"""
+        response = self.client.get('/api/leaderboard/?fields=user_id,rank')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [{'user_id': 'sparse-user', 'rank': 1}])
+    
+    def test_exclude(self):
+        """Test excluded fields are dropped and paging still works"""
+        response = self.client.get('/api/activities/by_user/?user_id=sparse-user&exclude=distance,created_at')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        item = response.data['results'][0]
+        self.assertNotIn('distance', item)
+        self.assertNotIn('created_at', item)
+        self.assertEqual(item['duration'], 30)
+    
+    def test_unknown_field(self):
+        """Test an unknown field name returns 400"""
+        response = self.client.get('/api/workouts/?fields=name,bogus')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class FastListSerializerTestCase(SimpleTestCase):
+    """Test cases for the fast list serializer read path"""
+    
+    def assertSameOutput(self, serializer_class, rows):
+        expected = serializers.ListSerializer(rows, child=serializer_class()).data
+        self.assertEqual(
+            JSONRenderer().render(serializer_class(rows, many=True).data),
+            JSONRenderer().render(expected)
+        )
+    
+    def test_matches_model_serializer(self):
+        """Test fast output is byte-identical for instances and values() rows"""
+        created = datetime(2024, 3, 1, 8, 30, 15, 250, tzinfo=timezone.utc)
+        activities = [
+            Activity(
+                _id=ObjectId(), user_id='fast-user', activity_type='Running', duration=30,
+                calories_burned=300, distance=distance, date=date(2024, 3, 1), created_at=created
+            )
+            for distance in (None, 3.5)
+        ]
+        self.assertSameOutput(ActivitySerializer, activities)
+        rows = [
+            {field: getattr(activity, field) for field in ActivitySerializer.Meta.fields}
+            for activity in activities
+        ]
+        self.assertEqual(
+            ActivitySerializer(rows, many=True).data,
+            ActivitySerializer(activities, many=True).data
+        )
+        self.assertSameOutput(LeaderboardSerializer, [
+            Leaderboard(_id=ObjectId(), user_id='fast-user', team_id='t', total_distance=2, updated_at=created)
+        ])
+    
+    def test_write_only_fields_are_skipped(self):
+        """Test write-only fields stay out of the compiled converters"""
+        names = [name for name, _, _ in UserSerializer(many=True).converters]
+        self.assertNotIn('password', names)
+
+
+class ResponseCacheTestCase(TestCase):
+    """Test cases for the write-invalidated response cache"""
+    
+    def setUp(self):
+        """Set up a counting view method"""
+        self.calls = 0
+        
+        @response_cache.cached_response(Workout)
+        def view(owner, request):
+            self.calls += 1
+            return Response({'calls': self.calls})
+        
+        self.view = view
+    
+    def get(self, url):
+        return self.view(None, Request(APIRequestFactory().get(url)))
+    
+    def test_hit_until_write(self):
+        """Test repeated reads are served from cache until the collection is bumped"""
+        self.assertEqual(self.get('/api/workouts/?difficulty=Easy').data, {'calls': 1})
+        self.assertEqual(self.get('/api/workouts/?difficulty=Easy').data, {'calls': 1})
+        self.assertEqual(self.get('/api/workouts/?difficulty=Hard').data, {'calls': 2})
+        response_cache.bump(Workout)
+        self.assertEqual(self.get('/api/workouts/?difficulty=Easy').data, {'calls': 3})
+    
+    def test_other_collections_do_not_invalidate(self):
+        """Test writes to unrelated collections keep the entry"""
+        self.get('/api/workouts/')
+        response_cache.bump(Activity, Team)
+        self.get('/api/workouts/')
+        self.assertEqual(self.calls, 1)
+    
+    @override_settings(RESPONSE_CACHE_VERSION_TTL=0)
+    def test_writes_from_other_processes_invalidate(self):
+        """Test a version bumped straight in MongoDB, as another worker would, misses the cache"""
+        self.get('/api/workouts/')
+        mongo.get_database()[response_cache.VERSIONS_COLLECTION].update_one(
+            {'_id': Workout._meta.db_table}, {'$inc': {'version': 1}}
+        )
+        self.get('/api/workouts/')
+        self.assertEqual(self.calls, 2)
+
+
+class LocalVersionsTestCase(SimpleTestCase):
+    """Test cases for the versions each process keeps between MongoDB reads"""
+    
+    def setUp(self):
+        """Set up a counting cached view over a fake versions collection"""
+        response_cache.clear_local_versions()
+        self.addCleanup(response_cache.clear_local_versions)
+        self.addCleanup(cache.clear)
+        self.collection = Mock()
+        self.collection.find.return_value = [
+            {'_id': Workout._meta.db_table, 'version': 1, 'modified': datetime(2024, 3, 1)},
+        ]
+        patcher = patch.object(response_cache, '_versions', return_value=self.collection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.calls = 0
+        
+        @response_cache.cached_response(Workout)
+        def view(owner, request):
+            self.calls += 1
+            return Response({'calls': self.calls})
+        
+        self.view = view
+    
+    def get(self):
+        return self.view(None, Request(APIRequestFactory().get('/api/workouts/?local=versions')))
+    
+    def test_hit_sends_no_commands(self):
+        """Test a cache hit within the TTL reads nothing from MongoDB"""
+        self.get()
+        commands = len(self.collection.mock_calls)
+        self.assertEqual(self.get().data, {'calls': 1})
+        self.assertEqual(len(self.collection.mock_calls), commands)
+    
+    def test_local_bump_is_seen_at_once(self):
+        """Test a bump in this process rereads the version instead of waiting for the TTL"""
+        self.get()
+        response_cache.bump(Workout)
+        self.collection.find.return_value = [
+            {'_id': Workout._meta.db_table, 'version': 2, 'modified': datetime(2024, 3, 2)},
+        ]
+        self.assertEqual(self.get().data, {'calls': 2})
+    
+    @override_settings(RESPONSE_CACHE_VERSION_TTL=0)
+    def test_zero_ttl_reads_every_time(self):
+        """Test a zero TTL reads the versions on every request"""
+        self.get()
+        self.get()
+        self.assertEqual(self.collection.find.call_count, 2)
+
+
+class ConditionalGetTestCase(TestCase):
+    """Test cases for ETag and Last-Modified conditional GETs"""
+    
+    def setUp(self):
+        """Set up a counting view"""
+        test = self
+        test.calls = 0
+        
+        class WorkoutCountView(ConditionalGetMixin, APIView):
+            etag_models = (Workout,)
+            
+            def get(self, request):
+                test.calls += 1
+                return Response({'calls': test.calls})
+        
+        self.view = WorkoutCountView.as_view()
+    
+    def get(self, **headers):
+        return self.view(APIRequestFactory().get('/api/workouts/', **headers))
+    
+    def test_if_none_match(self):
+        """Test a matching ETag returns 304 without running the handler until a write"""
+        response = self.get()
+        etag = response['ETag']
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.calls, 1)
+        response_cache.bump(Workout)
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+    
+    def test_compressed_etag(self):
+        """Test the ETag of a compressed copy matches and is echoed back on the 304"""
+        etag = encoded_etag(self.get()['ETag'], 'gzip')
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+    
+    def test_if_modified_since(self):
+        """Test If-Modified-Since at the Last-Modified date returns 304"""
+        with patch('octofit_tracker.conditional.time.time', return_value=time.time() + 2):
+            last_modified = self.get()['Last-Modified']
+            response = self.get(HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+    
+    def test_no_last_modified_within_the_second(self):
+        """Test Last-Modified is left out while a write could still land in the same second"""
+        response_cache.bump(Workout)
+        self.assertFalse(self.get().has_header('Last-Modified'))
+    
+    @override_settings(RESPONSE_CACHE_VERSION_TTL=0)
+    def test_writes_from_other_processes_change_validators(self):
+        """Test a version bumped straight in MongoDB, as a management command would, ends the 304s"""
+        etag = self.get()['ETag']
+        mongo.get_database()[response_cache.VERSIONS_COLLECTION].update_one(
+            {'_id': Workout._meta.db_table}, {'$inc': {'version': 1}}
+        )
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+
+class ORJSONRendererTestCase(SimpleTestCase):
+    """Test cases for the orjson renderer"""
+    
+    def test_matches_json_renderer(self):
+        """Test output is byte-identical to DRF's JSONRenderer"""
+        data = {
+            'name': 'Caf\u00e9 \u2028 run',
+            'date': date(2024, 3, 1),
+            'created_at': datetime(2024, 3, 1, 8, 30, 15, 123456, tzinfo=timezone.utc),
+            'rows': [{'distance': 2.5, 'rank': 1, 'notes': None}],
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+    
+    def test_object_id(self):
+        """Test ObjectIds render as their hex string"""
+        oid = ObjectId()
+        self.assertEqual(ORJSONRenderer().render({'_id': oid}), f'{{"_id":"{oid}"}}'.encode())
+    
+    def test_non_finite_floats_rejected(self):
+        """Test NaN and infinities raise like DRF's JSONRenderer instead of rendering as null"""
+        for value in (float('nan'), float('inf'), float('-inf')):
+            with self.assertRaises(ValueError):
+                ORJSONRenderer().render({'rows': [{'distance': value, 'notes': None}]})
+        self.assertEqual(ORJSONRenderer().render({'notes': None}), b'{"notes":null}')
+
+
+@override_settings(COMPRESSION_MIN_SIZE=100)
+class CompressionMiddlewareTestCase(SimpleTestCase):
+    """Test cases for negotiated response compression"""
+    
+    def respond(self, body, **headers):
+        def view(request):
+            response = HttpResponse(body, content_type='application/json')
+            response['ETag'] = '"abc"'
+            return response
+        return CompressionMiddleware(view)(RequestFactory().get('/api/activities/', **headers))
+    
+    def test_preferred_encoding(self):
+        """Test q-values are honoured and gzip is used when brotli is refused"""
+        self.assertEqual(preferred_encoding('gzip;q=0.5, identity'), 'gzip')
+        self.assertIsNone(preferred_encoding('gzip;q=0'))
+        self.assertIsNone(preferred_encoding(''))
+        self.assertEqual(preferred_encoding('*, br;q=0'), 'gzip')
+    
+    def test_compresses_large_bodies(self):
+        """Test large bodies are gzipped with a strong ETag naming the coding"""
+        body = json.dumps([{'activity_type': 'Running'}] * 50)
+        response = self.respond(body, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['ETag'], '"abc-gzip"')
+        self.assertEqual(representation_etag(response['ETag']), '"abc"')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content).decode(), body)
+    
+    def test_small_bodies_untouched(self):
+        """Test bodies under the threshold are sent as they are"""
+        response = self.respond('[]', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class ServerTimingTestCase(SimpleTestCase):
+    """Test cases for per-request timings"""
+    
+    def command(self, request_id, seconds, name='find'):
+        """Report one MongoDB command to the listener as pymongo would"""
+        started = pymongo_monitoring.CommandStartedEvent(
+            {name: 'activities', 'filter': {'user_id': 'u1'}, 'lsid': {}}, 'octofit_db', request_id,
+            ('localhost', 27017), request_id,
+        )
+        instrumentation.command_timer.started(started)
+        instrumentation.command_timer.succeeded(pymongo_monitoring.CommandSucceededEvent(
+            timedelta(seconds=seconds), {'ok': 1}, name, request_id, ('localhost', 27017), request_id,
+        ))
+    
+    def respond(self, view):
+        return ServerTimingMiddleware(view)(RequestFactory().get('/api/activities/'))
+    
+    def test_server_timing_header(self):
+        """Test commands sent while serving are counted in the header"""
+        def view(request):
+            self.command(1, 0.002)
+            self.command(2, 0.003)
+            return HttpResponse('[]')
+        header = self.respond(view)['Server-Timing']
+        self.assertIn('db;dur=5.00;desc="2 queries"', header)
+        for name in ('serialize', 'render', 'total'):
+            self.assertIn(f'{name};dur=', header)
+    
+    async def test_motor_commands_counted(self):
+        """Test motor clients carry the listener and commands on motor's threads are charged to the request"""
+        from motor.frameworks import asyncio as motor_asyncio
+        
+        async def view(request):
+            database = await mongo.get_async_database()
+            self.assertIn(instrumentation.command_timer, database.client.delegate.event_listeners()[0])
+            loop = asyncio.get_running_loop()
+            await motor_asyncio.run_on_executor(loop, self.command, 6, 0.004)
+            return HttpResponse('[]')
+        response = await ServerTimingMiddleware(view)(RequestFactory().get('/api/async/leaderboard/top/'))
+        self.assertIn('db;dur=4.00;desc="1 query"', response['Server-Timing'])
+    
+    def test_commands_outside_requests_ignored(self):
+        """Test the listener ignores commands sent outside a request"""
+        self.command(3, 0.5)
+        self.assertIsNone(instrumentation.current())
+    
+    @override_settings(SLOW_QUERY_MS=10)
+    def test_slow_queries_logged(self):
+        """Test commands over the threshold are logged with their collection and filter shape"""
+        def view(request):
+            self.command(4, 0.001)
+            self.command(5, 0.05)
+            return HttpResponse('[]')
+        with self.assertLogs('octofit_tracker.requests', 'WARNING') as logs:
+            self.respond(view)
+        self.assertEqual(len(logs.records), 1)
+        query = logs.records[0].slow_query
+        self.assertEqual(query['collection'], 'activities')
+        self.assertEqual(query['filter'], '{"user_id": "?"}')
+        self.assertNotIn('u1', logs.output[0])
+        self.assertEqual(query['duration_ms'], 50.0)
+    
+    def test_filter_summary_redacts_values(self):
+        """Test filters keep field names and operators but no values, and writes log no documents"""
+        self.assertEqual(
+            instrumentation.filter_summary('update', {
+                'update': 'leaderboard',
+                'updates': [{'q': {'user_id': 'u1', 'day': {'$in': ['a', 'b']}}, 'u': {'$inc': {'n': 1}}}],
+            }),
+            '{"user_id": "?", "day": {"$in": ["?"]}}'
+        )
+        self.assertIsNone(instrumentation.filter_summary('insert', {
+            'insert': 'activities', 'documents': [{'user_id': 'u1'}],
+        }))
+        summary = instrumentation.filter_summary('find', {'find': 'x', 'filter': {f'f{i}': i for i in range(100)}})
+        self.assertEqual(len(summary), instrumentation.MAX_FILTER_LENGTH)
+    
+    def test_serialize_phase_excludes_db_time(self):
+        """Test nested serialize phases count once and exclude database time"""
+        timings = instrumentation.RequestTimings()
+        with timings.phase('serialize'):
+            with timings.phase('serialize'):
+                timings.db_seconds += 10
+        self.assertLess(timings.serialize_seconds, 1)
+
+
+class ProfilingMiddlewareTestCase(SimpleTestCase):
+    """Test cases for on-demand request profiling"""
+    
+    def setUp(self):
+        """Use a fresh profile directory and concurrency cap"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        profiling._slots = None
+        self.addCleanup(setattr, profiling, '_slots', None)
+    
+    def respond(self, **headers):
+        def slow_view(request):
+            time.sleep(0.02)
+            return HttpResponse('[]')
+        with self.settings(PROFILING_ENABLED=True, PROFILE_DIR=self.directory):
+            request = RequestFactory().get('/api/leaderboard/by_team/', **headers)
+            return ProfilingMiddleware(slow_view)(request)
+    
+    def test_cprofile(self):
+        """Test X-Profile writes a pstats file named in the response"""
+        response = self.respond(HTTP_X_PROFILE='cprofile')
+        self.assertTrue(response['X-Profile'].endswith('-GET-api-leaderboard-by-team.prof'))
+        stats = pstats.Stats(os.path.join(self.directory, response['X-Profile']))
+        self.assertTrue(any(name == 'slow_view' for _, _, name in stats.stats))
+    
+    def test_sampling_profile(self):
+        """Test sample mode writes folded stacks ending in the view"""
+        response = self.respond(HTTP_X_PROFILE='sample')
+        with open(os.path.join(self.directory, response['X-Profile'])) as profile:
+            lines = profile.read().splitlines()
+        self.assertTrue(any('slow_view (tests.py' in line for line in lines))
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in lines))
+    
+    def test_unprofiled_requests(self):
+        """Test requests without the header, or from outside INTERNAL_IPS, are not profiled"""
+        self.assertFalse(self.respond().has_header('X-Profile'))
+        self.assertFalse(self.respond(HTTP_X_PROFILE='1', REMOTE_ADDR='203.0.113.9').has_header('X-Profile'))
+        with self.settings(PROFILING_ENABLED=False):
+            response = ProfilingMiddleware(lambda request: HttpResponse())(
+                RequestFactory().get('/api/users/', HTTP_X_PROFILE='1')
+            )
+        self.assertFalse(response.has_header('X-Profile'))
+        self.assertEqual(os.listdir(self.directory), [])
+    
+    def test_concurrency_cap(self):
+        """Test requests over PROFILE_MAX_CONCURRENT are served unprofiled"""
+        slots = profiling.slots()
+        slots.acquire()
+        try:
+            self.assertEqual(self.respond(HTTP_X_PROFILE='1')['X-Profile'], 'busy')
+        finally:
+            slots.release()
+    
+    async def test_async_profile(self):
+        """Test an async stack is profiled without being adapted to sync"""
+        async def async_view(request):
+            return HttpResponse('[]')
+        middleware = ProfilingMiddleware(async_view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        with self.settings(PROFILING_ENABLED=True, PROFILE_DIR=self.directory):
+            response = await middleware(RequestFactory().get('/api/users/', HTTP_X_PROFILE='cprofile'))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, response['X-Profile'])))
+    
+    def test_asgi_middleware_chain_not_adapted(self):
+        """Test no middleware in the configured stack makes Django adapt the chain under ASGI"""
+        with self.settings(DEBUG=True), self.assertNoLogs('django.request', 'DEBUG'):
+            handler = ASGIHandler()
+        self.assertTrue(asyncio.iscoroutinefunction(handler._middleware_chain))
+
+
+class MetricsTestCase(SimpleTestCase):
+    """Test cases for the Prometheus metrics"""
+    
+    def setUp(self):
+        """Start from empty counters"""
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+    
+    def test_exposition(self):
+        """Test counters and cumulative histogram buckets are exposed per route"""
+        metrics.observe_request('activity-by-user', 'GET', 200, 0.02, 3, 0.004)
+        metrics.observe_request('activity-by-user', 'GET', 500, 20, 0, 0)
+        text = metrics.exposition(*metrics.collect())
+        labels = 'route="activity-by-user",method="GET"'
+        self.assertIn(f'octofit_http_requests_total{{{labels},status="500"}} 1', text)
+        self.assertIn(f'octofit_http_request_duration_seconds_bucket{{{labels},le="0.01"}} 0', text)
+        self.assertIn(f'octofit_http_request_duration_seconds_bucket{{{labels},le="0.025"}} 1', text)
+        self.assertIn(f'octofit_http_request_duration_seconds_bucket{{{labels},le="10.0"}} 1', text)
+        self.assertIn(f'octofit_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2', text)
+        self.assertIn(f'octofit_http_request_duration_seconds_count{{{labels}}} 2', text)
+        self.assertIn('octofit_db_commands_total{route="activity-by-user"} 3', text)
+    
+    def test_threads_merged(self):
+        """Test samples recorded by several threads are summed"""
+        def record():
+            for _ in range(100):
+                metrics.inc('octofit_response_cache_total', (('route', 'leaderboard-top'), ('result', 'hit')))
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counters, _ = metrics.collect()
+        key = ('octofit_response_cache_total', (('route', 'leaderboard-top'), ('result', 'hit')))
+        self.assertEqual(counters[key], 400)
+    
+    def test_exited_threads_retired(self):
+        """Test an exited thread's shard is folded into the retired totals and dropped"""
+        before = len(metrics._shards)
+        thread = threading.Thread(target=metrics.observe, args=('octofit_http_request_duration_seconds', (), 0.2))
+        thread.start()
+        thread.join()
+        self.assertEqual(len(metrics._shards), before)
+        _, histograms = metrics.collect()
+        self.assertEqual(histograms[('octofit_http_request_duration_seconds', ())][-1], 0.2)
+    
+    def test_processes_aggregated(self):
+        """Test a scrape sums the files written by every worker process"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        labels = (('route', 'user-list'), ('method', 'GET'), ('status', '200'))
+        with open(os.path.join(directory.name, '1.json'), 'w') as other:
+            json.dump({'counters': [['octofit_http_requests_total', labels, 5]], 'histograms': []}, other)
+        metrics.observe_request('user-list', 'GET', 200, 0.01, 0, 0)
+        with self.settings(METRICS_DIR=directory.name):
+            counters, histograms = metrics.aggregate()
+        self.assertEqual(counters['octofit_http_requests_total', labels], 6)
+        self.assertIn(f'{metrics._process_key}.json', os.listdir(directory.name))
+        durations = histograms['octofit_http_request_duration_seconds', labels[:2]]
+        self.assertEqual(sum(durations[:-1]), 1)
+    
+    def test_reused_pid_keeps_old_totals(self):
+        """Test a worker reusing an exited worker's PID writes its own file instead of replacing it"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        labels = (('route', 'user-list'), ('method', 'GET'), ('status', '200'))
+        with open(os.path.join(directory.name, f'{os.getpid()}-1.json'), 'w') as exited:
+            json.dump({'counters': [['octofit_http_requests_total', labels, 5]], 'histograms': []}, exited)
+        metrics.observe_request('user-list', 'GET', 200, 0.01, 0, 0)
+        with self.settings(METRICS_DIR=directory.name):
+            counters, _ = metrics.aggregate()
+        self.assertEqual(counters['octofit_http_requests_total', labels], 6)
+    
+    def test_metrics_view(self):
+        """Test /metrics serves the text format to internal clients only"""
+        metrics.observe_request('leaderboard-top', 'GET', 200, 0.01, 1, 0.001)
+        view = MetricsView.as_view()
+        response = view(APIRequestFactory().get('/metrics'))
+        response.render()
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn(b'octofit_db_commands_total{route="leaderboard-top"} 1', response.content)
+        response = view(APIRequestFactory().get('/metrics', REMOTE_ADDR='203.0.113.9'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class BatchLookupAPITestCase(APITestCase):
+    """API test cases for batch lookups and ?expand="""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.team = Team.objects.create(name='Team Batch', description='Batch team')
+        self.users = [
+            User.objects.create(
+                name=f'Batch User {index}', email=f'batch{index}@example.com',
+                password='pw', team_id=str(self.team._id)
+            )
+            for index in range(3)
+        ]
+        user_id = str(self.users[0]._id)
+        Leaderboard.objects.create(user_id=user_id, team_id=str(self.team._id), total_calories=100, rank=1)
+        Activity.objects.create(
+            user_id=user_id, activity_type='Running', duration=30, calories_burned=300, date=date.today()
+        )
+    
+    def test_users_batch(self):
+        """Test users are returned in the order their ids were requested"""
+        ids = [str(self.users[2]._id), str(self.users[0]._id)]
+        response = self.client.get(f"/api/users/batch/?ids={','.join(ids)}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([user['_id'] for user in response.data], ids)
+    
+    def test_batch_rejects_invalid_ids(self):
+        """Test malformed ids return 400"""
+        response = self.client.get('/api/teams/batch/?ids=not-an-id')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_expand(self):
+        """Test user and team names are joined into leaderboard and activity rows"""
+        response = self.client.get('/api/leaderboard/?expand=user,team')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['user_name'], 'Batch User 0')
+        self.assertEqual(response.data['results'][0]['team_name'], 'Team Batch')
+        response = self.client.get('/api/activities/?expand=team')
+        self.assertEqual(response.data['results'][0]['team_name'], 'Team Batch')
+        self.assertNotIn('user_name', response.data['results'][0])
+
+
+class TeamDashboardAPITestCase(APITestCase):
+    """API test cases for the team dashboard"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.team = Team.objects.create(name='Team Dash', description='Dashboard team')
+        team_id = str(self.team._id)
+        for index, calories in enumerate((300, 500, 300)):
+            user = User.objects.create(
+                name=f'Dash User {index}', email=f'dash{index}@example.com', password='pw', team_id=team_id
+            )
+            Leaderboard.objects.create(
+                user_id=str(user._id), team_id=team_id, total_activities=1,
+                total_calories=calories, total_distance=1.25, rank=index + 1
+            )
+    
+    def test_dashboard(self):
+        """Test team, members, totals and team ranks come back together"""
+        response = self.client.get(f'/api/teams/{self.team._id}/dashboard/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['team']['name'], 'Team Dash')
+        self.assertEqual(len(response.data['members']), 3)
+        self.assertNotIn('password', response.data['members'][0])
+        self.assertEqual(response.data['stats']['member_count'], 3)
+        self.assertEqual(response.data['stats']['total_calories'], 1100)
+        self.assertEqual(response.data['stats']['total_distance'], 3.75)
+        self.assertEqual([entry['team_rank'] for entry in response.data['leaderboard']], [1, 2, 2])
+    
+    def test_dashboard_missing_team(self):
+        """Test an unknown team returns 404"""
+        response = self.client.get(f'/api/teams/{ObjectId()}/dashboard/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class AsyncCursorTestCase(SimpleTestCase):
+    """Test cases for keyset cursors shared by the sync and async endpoints"""
+    
+    def test_decodes_sync_cursor(self):
+        """Test a cursor issued by ActivityPagination resumes the async listing"""
+        paginator = ActivityPagination()
+        paginator.model = Activity
+        activity = Activity(_id=ObjectId(), date=date(2024, 3, 1))
+        day, oid = async_views._decode_cursor(paginator.encode_cursor(activity))
+        self.assertEqual(day, leaderboard.mongo_day(activity.date))
+        self.assertEqual(oid, activity._id)
+        document = {'_id': activity._id, 'date': day}
+        self.assertEqual(async_views._encode_cursor(document), paginator.encode_cursor(activity))
+
+
+class AsyncEndpointsTestCase(TestCase):
+    """Test cases for the async read endpoints"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.team = Team.objects.create(name='Team Async', description='Async team')
+        for index in range(3):
+            Leaderboard.objects.create(
+                user_id=f'async-user-{index}', team_id=str(self.team._id),
+                total_calories=100 * index, rank=3 - index
+            )
+            Activity.objects.create(
+                user_id='async-user-0', activity_type='Running', duration=30,
+                calories_burned=300, date=date.today() - timedelta(days=index)
+            )
+    
+    async def test_matches_sync_endpoints(self):
+        """Test async responses are byte-identical to the DRF endpoints"""
+        for sync_url, async_url in (
+            ('/api/leaderboard/top/?limit=2', '/api/async/leaderboard/top/?limit=2'),
+            ('/api/activities/by_user/?user_id=async-user-0&page_size=2',
+             '/api/async/activities/by_user/?user_id=async-user-0&page_size=2'),
+            (f'/api/teams/{self.team._id}/stats/', f'/api/async/teams/{self.team._id}/stats/'),
+        ):
+            expected = await self.async_client.get(sync_url, HTTP_ACCEPT='application/json')
+            response = await self.async_client.get(async_url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                json.loads(response.content.replace(b'/api/async/', b'/api/')),
+                json.loads(expected.content)
+            )
+    
+    async def test_rejects_unbounded_limits(self):
+        """Test limits MongoDB would read as "no limit" are rejected like the DRF endpoint does"""
+        for limit in ('0', '-5', '100000', 'ten'):
+            expected = await self.async_client.get(f'/api/leaderboard/top/?limit={limit}', HTTP_ACCEPT='application/json')
+            response = await self.async_client.get(f'/api/async/leaderboard/top/?limit={limit}')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.content), json.loads(expected.content))
+    
+    def test_wsgi_requests_close_their_clients(self):
+        """Test the motor client of each loop async_to_sync runs a view on is closed with that loop"""
+        from motor.motor_asyncio import AsyncIOMotorClient
+        close, closed = AsyncIOMotorClient.close, []
+        
+        def record_close(client):
+            closed.append(client)
+            close(client)
+        
+        with patch.object(AsyncIOMotorClient, 'close', record_close):
+            for _ in range(2):
+                self.assertEqual(self.client.get('/api/async/leaderboard/top/').status_code, 200)
+        self.assertEqual(len(closed), 2)
+        self.assertEqual(mongo._async_clients, {})
+
+
+class PoolStatsTestCase(SimpleTestCase):
+    """Test cases for connection pool statistics"""
+    
+    def test_counts_pool_events(self):
+        """Test checkouts, waits, failures and in-use connections are tracked per address"""
+        stats = monitoring.PoolStats()
+        address = ('localhost', 27017)
+        stats.connection_created(pymongo_monitoring.ConnectionCreatedEvent(address, 1))
+        for _ in range(2):
+            stats.connection_check_out_started(pymongo_monitoring.ConnectionCheckOutStartedEvent(address))
+            stats.connection_checked_out(pymongo_monitoring.ConnectionCheckedOutEvent(address, 1))
+        stats.connection_checked_in(pymongo_monitoring.ConnectionCheckedInEvent(address, 1))
+        stats.connection_check_out_started(pymongo_monitoring.ConnectionCheckOutStartedEvent(address))
+        stats.connection_check_out_failed(
+            pymongo_monitoring.ConnectionCheckOutFailedEvent(address, pymongo_monitoring.ConnectionCheckOutFailedReason.TIMEOUT)
+        )
+        pool = stats.snapshot()['localhost:27017']
+        self.assertEqual(pool['checkouts'], 2)
+        self.assertEqual(pool['in_use'], 1)
+        self.assertEqual(pool['open'], 1)
+        self.assertEqual(pool['checkout_failures'], {'timeout': 1})
+        self.assertGreaterEqual(pool['wait_ms_max'], 0)
+    
+    def test_internal_only(self):
+        """Test the pool endpoint only answers internal addresses"""
+        factory = APIRequestFactory()
+        view = MongoPoolView.as_view()
+        response = view(factory.get('/api/internal/mongo-pool/', REMOTE_ADDR='127.0.0.1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('maxPoolSize', response.data['options'])
+        response = view(factory.get('/api/internal/mongo-pool/', REMOTE_ADDR='203.0.113.7'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class SyntheticDataTestCase(SimpleTestCase):
+    """Test cases for the synthetic data generator"""
+    
+    def test_deterministic(self):
+        """Test the same seed gives the same documents and another seed different ones"""
+        end = date(2024, 6, 30)
+        first = synthetic.user_activities(3, 'user-3', 20, 42, end, 90)
+        self.assertEqual(first, synthetic.user_activities(3, 'user-3', 20, 42, end, 90))
+        self.assertNotEqual(first, synthetic.user_activities(3, 'user-3', 20, 43, end, 90))
+        self.assertEqual(synthetic.user(7, 42, []), synthetic.user(7, 42, []))
+    
+    def test_documents_are_valid(self):
+        """Test activities fall in the date range and ids are unique across users"""
+        end = date(2024, 6, 30)
+        documents = [
+            document
+            for index in range(5)
+            for document in synthetic.user_activities(index, f'user-{index}', 50, 1, end, 30)
+        ]
+        self.assertEqual(len({document['_id'] for document in documents}), 250)
+        for document in documents:
+            self.assertIn(document['activity_type'], synthetic.ACTIVITY_PROFILES)
+            self.assertGreater(document['duration'], 0)
+            self.assertLessEqual(document['date'].date(), end)
+            self.assertGreater(document['date'].date(), end - timedelta(days=30))
+
+
+class CreateIndexesTestCase(SimpleTestCase):
+    """Test cases for index_report --create-indexes"""
+    
+    def setUp(self):
+        """Set up a database whose collections already have indexes under other names"""
+        
+        class Collection:
+            def __init__(self, name):
+                self.name, self.created, self.dropped, self.error = name, [], [], None
+            
+            def index_information(self):
+                return {
+                    '_id_': {'key': [('_id', 1)]},
+                    'user_id_1': {'key': [('user_id', 1)], 'unique': True},
+                    'team_id_1': {'key': [('team_id', 1.0)]},
+                }
+            
+            def create_index(self, keys, name, unique):
+                if self.error is not None:
+                    raise self.error
+                self.created.append(name)
+            
+            def drop_index(self, name):
+                self.dropped.append(name)
+        
+        self.collections = {}
+        
+        class Database:
+            def __getitem__(db, name):
+                return self.collections.setdefault(name, Collection(name))
+        
+        self.db = Database()
+        self.command = index_report.Command(stdout=StringIO())
+    
+    def test_equivalent_indexes_kept(self):
+        """Test indexes present under other names are neither created again nor dropped"""
+        self.command.create_indexes(self.db)
+        self.assertNotIn('leaderboard_user_uniq', self.collections['leaderboard'].created)
+        self.assertNotIn('user_stats_user_uniq', self.collections['user_stats'].created)
+        self.assertNotIn('user_team_idx', self.collections['users'].created)
+        self.assertIn('user_email_idx', self.collections['users'].created)
+        self.assertEqual([name for name, collection in self.collections.items() if collection.dropped], [])
+    
+    def test_conflicts_reported_apart_from_duplicates(self):
+        """Test an index clash is not reported as duplicate data"""
+        self.db['users'].error = OperationFailure('Index already exists with a different name', 85)
+        with self.assertRaisesMessage(CommandError, 'drop it and run again'):
+            self.command.create_indexes(self.db)
+        self.db['users'].error = DuplicateKeyError('E11000 duplicate key', 11000)
+        with self.assertRaisesMessage(CommandError, 'drop duplicates'):
+            self.command.create_indexes(self.db)
@@ -18,7 +18,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
-from .views import UserViewSet, TeamViewSet, ActivityViewSet, LeaderboardViewSet, WorkoutViewSet
+from . import async_views
+from .views import (
+    UserViewSet, TeamViewSet, ActivityViewSet, LeaderboardViewSet, WorkoutViewSet, AnalyticsViewSet,
+    MetricsView, MongoPoolView
+)
 
 # Create router and register viewsets
 router = routers.DefaultRouter()
@@ -27,9 +31,20 @@ router.register(r'teams', TeamViewSet, basename='team')
 router.register(r'activities', ActivityViewSet, basename='activity')
 router.register(r'leaderboard', LeaderboardViewSet, basename='leaderboard')
 router.register(r'workouts', WorkoutViewSet, basename='workout')
+router.register(r'analytics', AnalyticsViewSet, basename='analytics')
+
+# Async versions of the hottest read endpoints, for ASGI deployments
+async_urlpatterns = [
+    path('leaderboard/top/', async_views.leaderboard_top, name='async-leaderboard-top'),
+    path('activities/by_user/', async_views.activities_by_user, name='async-activities-by-user'),
+    path('teams/<str:pk>/stats/', async_views.team_stats, name='async-team-stats'),
+]
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/async/', include(async_urlpatterns)),
+    path('api/internal/mongo-pool/', MongoPoolView.as_view(), name='mongo-pool'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
     path('api/', include(router.urls)),
     path('', include(router.urls)),  # Root points to API
 ]
@@ -0,0 +1,488 @@
+"""
+Per-user activity summaries for OctoFit Tracker
+
+Each user has one UserStats document holding all-time totals and personal
+bests by activity type, totals for the days, ISO weeks and months the
+stats endpoint reports, and the active-day counts and runs of consecutive
+active days over the last STREAK_DAYS. Activity writes update it with
+atomic ``$inc``/``$max`` operators and only read the runs next to or
+around their day; periods, days and runs that fall out of their windows
+are pruned server-side, so neither writes nor reads grow with a user's
+history. Older runs only count towards the longest streak.
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+from django.utils import timezone
+from pymongo import ReturnDocument, UpdateOne
+from .models import Activity, UserStats
+from . import mongo, response_cache
+
+RECENT_DAYS = 30
+RECENT_WEEKS = 12
+RECENT_MONTHS = 12
+# Days of activity history streaks are tracked over
+STREAK_DAYS = 366
+DAY_MS = 24 * 60 * 60 * 1000
+BEST_FIELDS = ('duration', 'calories', 'distance')
+
+
+def _key(activity_type):
+    """Make an activity type safe to use as a MongoDB field name"""
+    return activity_type.replace('.', '_').lstrip('$') or '_'
+
+
+def period_keys(day):
+    """Return the daily, weekly and monthly keys a date rolls up into"""
+    iso_year, iso_week, _ = day.isocalendar()
+    return day.isoformat(), f'{iso_year}-W{iso_week:02d}', f'{day.year}-{day.month:02d}'
+
+
+def _metrics(activity, sign=1):
+    return {
+        'activities': sign,
+        'duration': sign * activity.duration,
+        'calories': sign * activity.calories_burned,
+        'distance': sign * (activity.distance or 0.0),
+    }
+
+
+def _bests(activity):
+    bests = {'duration': activity.duration, 'calories': activity.calories_burned}
+    if activity.distance:
+        bests['distance'] = activity.distance
+    return bests
+
+
+def window_cutoffs(today):
+    """Return the oldest daily, weekly and monthly keys the summary reports"""
+    months = today.year * 12 + today.month - RECENT_MONTHS
+    return (
+        (today - timedelta(days=RECENT_DAYS - 1)).isoformat(),
+        period_keys(today - timedelta(weeks=RECENT_WEEKS - 1))[1],
+        f'{months // 12}-{months % 12 + 1:02d}',
+    )
+
+
+def streak_cutoff(today):
+    """Return the first day streaks are tracked from"""
+    return (today - timedelta(days=STREAK_DAYS - 1)).isoformat()
+
+
+def _run_cutoff(today):
+    # A run ending the day before the first tracked day can still be extended
+    return (today - timedelta(days=STREAK_DAYS)).isoformat()
+
+
+def run_length(start, end):
+    """Return the number of days in the run from one ISO date to another"""
+    return (date.fromisoformat(end) - date.fromisoformat(start)).days + 1
+
+
+def _update(activity, sign, today):
+    """Build the atomic update recording (sign=1) or withdrawing (sign=-1) an activity"""
+    type_key = _key(activity.activity_type)
+    increments = {}
+    if activity.date.isoformat() >= streak_cutoff(today):
+        increments[f'active_days.{activity.date.isoformat()}'] = sign
+    prefixes = [f'totals.{type_key}']
+    # Periods outside the reported windows are not kept
+    for name, period, cutoff in zip(
+        ('daily', 'weekly', 'monthly'), period_keys(activity.date), window_cutoffs(today)
+    ):
+        if period >= cutoff:
+            prefixes.append(f'{name}.{period}.{type_key}')
+    for prefix in prefixes:
+        for metric, value in _metrics(activity, sign).items():
+            increments[f'{prefix}.{metric}'] = value
+    update = {'$inc': increments, '$set': {'updated_at': timezone.now()}}
+    if sign > 0:
+        update['$max'] = {
+            f'personal_bests.{type_key}.{field}': value
+            for field, value in _bests(activity).items()
+        }
+    return update
+
+
+def _entries(name):
+    return {'$objectToArray': {'$ifNull': [f'${name}', {}]}}
+
+
+def _kept(name, condition):
+    """Aggregation expression keeping the entries of a map that meet a condition on $$this.k / $$this.v"""
+    return {'$arrayToObject': {'$filter': {'input': _entries(name), 'cond': condition}}}
+
+
+def _run_length_expression(start, end):
+    """Aggregation expression for run_length() of two ISO date expressions"""
+    return {'$toInt': {'$add': [{'$divide': [
+        {'$subtract': [{'$dateFromString': {'dateString': end}}, {'$dateFromString': {'dateString': start}}]},
+        DAY_MS,
+    ]}, 1]}}
+
+
+def _longest_run_expression(condition):
+    """Aggregation expression for the longest run in streak_ends meeting a condition, or null"""
+    return {'$max': {'$map': {
+        'input': {'$filter': {'input': _entries('streak_ends'), 'cond': condition}},
+        'in': _run_length_expression('$$this.k', '$$this.v'),
+    }}}
+
+
+def _prune(today):
+    """Update pipeline dropping the periods, days and runs that fell out of their windows"""
+    stage = {
+        name: _kept(name, {'$gte': ['$$this.k', cutoff]})
+        for name, cutoff in zip(('daily', 'weekly', 'monthly'), window_cutoffs(today))
+    }
+    run_cutoff = _run_cutoff(today)
+    stage.update({
+        'active_days': _kept('active_days', {'$gte': ['$$this.k', streak_cutoff(today)]}),
+        # Runs are keyed by their last day in streak_starts and first day in streak_ends
+        'streak_starts': _kept('streak_starts', {'$gte': ['$$this.k', run_cutoff]}),
+        'streak_ends': _kept('streak_ends', {'$gte': ['$$this.v', run_cutoff]}),
+        'past_longest_streak': {'$max': [
+            {'$ifNull': ['$past_longest_streak', 0]},
+            _longest_run_expression({'$lt': ['$$this.v', run_cutoff]}),
+        ]},
+    })
+    return [{'$set': stage}]
+
+
+def _longest_update():
+    """Update pipeline recomputing the longest streak from the tracked runs and the past ones"""
+    return [{'$set': {'longest_streak': {'$max': [
+        {'$ifNull': ['$past_longest_streak', 0]},
+        _longest_run_expression(True),
+    ]}}}]
+
+
+def streak_runs(active_days):
+    """
+    Return (starts, ends, longest) for the runs of consecutive active days:
+    each run's first day keyed by its last, its last day keyed by its
+    first, and the length of the longest run
+    """
+    starts, ends, longest = {}, {}, 0
+    run_start, previous = None, None
+    for day in sorted(date.fromisoformat(key) for key, count in active_days.items() if count > 0):
+        if previous is not None and day - previous != timedelta(days=1):
+            starts[previous.isoformat()], ends[run_start.isoformat()] = run_start.isoformat(), previous.isoformat()
+            previous = None
+        if previous is None:
+            run_start = day
+        longest = max(longest, (day - run_start).days + 1)
+        previous = day
+    if previous is not None:
+        starts[previous.isoformat()], ends[run_start.isoformat()] = run_start.isoformat(), previous.isoformat()
+    return starts, ends, longest
+
+
+def joined_run(streak_starts, streak_ends, day):
+    """Return the (first, last) days of the run a newly active day forms with the runs either side"""
+    before = (day - timedelta(days=1)).isoformat()
+    after = (day + timedelta(days=1)).isoformat()
+    return streak_starts.get(before, day.isoformat()), streak_ends.get(after, day.isoformat())
+
+
+def _neighbour_projection(day):
+    """Project only the streak runs ending the day before and starting the day after"""
+    return {
+        f'streak_starts.{(day - timedelta(days=1)).isoformat()}': True,
+        f'streak_ends.{(day + timedelta(days=1)).isoformat()}': True,
+    }
+
+
+def _containing_run_projection(day):
+    """Project only the tracked run a day falls in, as a list of at most one {k: first, v: last}"""
+    key = day.isoformat()
+    return {'containing_run': {'$filter': {
+        'input': _entries('streak_ends'),
+        'cond': {'$and': [{'$lte': ['$$this.k', key]}, {'$gte': ['$$this.v', key]}]},
+    }}}
+
+
+def _run_changes(streak_starts, streak_ends, starts, ends):
+    """Build $set/$unset for the runs that changed from (streak_starts, streak_ends) to (starts, ends)"""
+    update = {}
+    changed = {
+        **{f'streak_starts.{end}': start for end, start in starts.items() if streak_starts.get(end) != start},
+        **{f'streak_ends.{start}': end for start, end in ends.items() if streak_ends.get(start) != end},
+    }
+    if changed:
+        update['$set'] = changed
+    stale = [f'streak_starts.{end}' for end in streak_starts if end not in starts]
+    stale += [f'streak_ends.{start}' for start in streak_ends if start not in ends]
+    if stale:
+        update['$unset'] = dict.fromkeys(stale, '')
+    return update
+
+
+def _join_update(summary, days):
+    """Build the update joining newly active days, in ascending order, to the runs either side of them"""
+    streak_starts = summary.get('streak_starts', {})
+    streak_ends = summary.get('streak_ends', {})
+    starts, ends, longest = dict(streak_starts), dict(streak_ends), 0
+    for day in days:
+        start, end = joined_run(starts, ends, day)
+        # The runs either side are now part of the joined one
+        starts.pop((day - timedelta(days=1)).isoformat(), None)
+        ends.pop((day + timedelta(days=1)).isoformat(), None)
+        starts[end], ends[start] = start, end
+        longest = max(longest, run_length(start, end))
+    update = _run_changes(streak_starts, streak_ends, starts, ends)
+    update['$max'] = {'longest_streak': longest}
+    return update
+
+
+def split_run(start, end, day):
+    """Return the (first, last) days of the runs left when a day of the run from start to end goes inactive"""
+    runs = []
+    if start < day:
+        runs.append((start.isoformat(), (day - timedelta(days=1)).isoformat()))
+    if day < end:
+        runs.append(((day + timedelta(days=1)).isoformat(), end.isoformat()))
+    return runs
+
+
+def _split_update(summary, day):
+    """Build the update taking a day that became inactive out of its run"""
+    update = {'$unset': {f'active_days.{day.isoformat()}': ''}}
+    for run in summary.get('containing_run', []):
+        start, end = run['k'], run['v']
+        starts, ends = {}, {}
+        for first, last in split_run(date.fromisoformat(start), date.fromisoformat(end), day):
+            starts[last], ends[first] = first, last
+        changes = _run_changes({end: start}, {start: end}, starts, ends)
+        update['$unset'].update(changes.get('$unset', {}))
+        if '$set' in changes:
+            update['$set'] = changes['$set']
+    return update
+
+
+def _recompute_bests(user_id, activity_type):
+    """Recompute one activity type's personal bests after its best activity was withdrawn"""
+    type_key = _key(activity_type)
+    rows = list(Activity.objects.mongo_aggregate([
+        {'$match': {'user_id': user_id, 'activity_type': activity_type}},
+        {'$group': {
+            '_id': None,
+            'duration': {'$max': '$duration'},
+            'calories': {'$max': '$calories_burned'},
+            'distance': {'$max': '$distance'},
+        }},
+    ]))
+    if rows:
+        bests = {field: rows[0][field] for field in BEST_FIELDS if rows[0][field]}
+        update = {'$set': {f'personal_bests.{type_key}': bests}}
+    else:
+        update = {'$unset': {f'personal_bests.{type_key}': ''}}
+    UserStats.objects.mongo_update_one({'user_id': user_id}, update)
+
+
+def record(activity, sign=1):
+    """Apply one activity to its owner's summary"""
+    type_key = _key(activity.activity_type)
+    day_key = activity.date.isoformat()
+    today = timezone.localdate()
+    tracked = day_key >= streak_cutoff(today)
+    projection = {f'active_days.{day_key}': True, f'personal_bests.{type_key}': True}
+    if tracked:
+        if sign > 0:
+            projection.update(_neighbour_projection(activity.date))
+        else:
+            projection.update(_containing_run_projection(activity.date), longest_streak=True)
+    summary = mongo.upsert(
+        UserStats.objects.mongo_find_one_and_update,
+        {'user_id': activity.user_id},
+        _update(activity, sign, today),
+        projection=projection,
+        return_document=ReturnDocument.AFTER,
+        upsert=True,
+    )
+    response_cache.bump(UserStats)
+    key = {'user_id': activity.user_id}
+    day_count = summary.get('active_days', {}).get(day_key, 0)
+    # Streaks only change when a tracked day becomes active or inactive
+    if tracked and sign > 0 and day_count == 1:
+        UserStats.objects.mongo_update_one(key, _join_update(summary, [activity.date]))
+        UserStats.objects.mongo_update_one(key, _prune(today))
+    elif tracked and sign < 0 and day_count <= 0:
+        UserStats.objects.mongo_update_one(key, _split_update(summary, activity.date))
+        runs = summary.get('containing_run', [])
+        if any(run_length(run['k'], run['v']) >= summary.get('longest_streak', 0) for run in runs):
+            UserStats.objects.mongo_update_one(key, _longest_update())
+    if sign < 0:
+        bests = summary.get('personal_bests', {}).get(type_key, {})
+        if any(bests.get(field) == value for field, value in _bests(activity).items()):
+            _recompute_bests(activity.user_id, activity.activity_type)
+
+
+def activity_created(activity):
+    """Add a new activity to its owner's summary"""
+    record(activity)
+
+
+def activity_updated(previous, activity):
+    """Move an edited activity's contribution from its old to its new values"""
+    # Adding first keeps an edit that stays on its day from emptying and re-filling it
+    record(activity)
+    record(previous, sign=-1)
+
+
+def activity_deleted(activity):
+    """Withdraw a deleted activity from its owner's summary"""
+    record(activity, sign=-1)
+
+
+def activities_created(activities):
+    """Add many new activities with one bulk write, then join the days they made active to their runs"""
+    if not activities:
+        return
+    today = timezone.localdate()
+    mongo.bulk_upsert(UserStats.objects.mongo_bulk_write, [
+        UpdateOne({'user_id': activity.user_id}, _update(activity, 1, today), upsert=True)
+        for activity in activities
+    ])
+    cutoff = streak_cutoff(today)
+    added = defaultdict(lambda: defaultdict(int))
+    for activity in activities:
+        if activity.date.isoformat() >= cutoff:
+            added[activity.user_id][activity.date] += 1
+    projection = {'user_id': True}
+    for day in {day for counts in added.values() for day in counts}:
+        projection[f'active_days.{day.isoformat()}'] = True
+        projection.update(_neighbour_projection(day))
+    joins = []
+    summaries = UserStats.objects.mongo_find({'user_id': {'$in': list(added)}}, projection) if added else []
+    for summary in summaries:
+        active_days = summary.get('active_days', {})
+        # A day is newly active when this batch is all it holds
+        days = sorted(
+            day for day, count in added[summary['user_id']].items()
+            if active_days.get(day.isoformat(), 0) == count
+        )
+        if days:
+            joins.append(UpdateOne({'user_id': summary['user_id']}, _join_update(summary, days)))
+    if joins:
+        UserStats.objects.mongo_bulk_write(joins, ordered=False)
+    user_ids = list({activity.user_id for activity in activities})
+    UserStats.objects.mongo_update_many({'user_id': {'$in': user_ids}}, _prune(today))
+    response_cache.bump(UserStats)
+
+
+def _recent(periods, cutoff):
+    """Keep the periods from `cutoff` on, latest first, dropping activity types that netted to zero"""
+    recent = {}
+    for period in sorted((key for key in periods if key >= cutoff), reverse=True):
+        by_type = {
+            activity_type: metrics
+            for activity_type, metrics in periods[period].items()
+            if metrics.get('activities', 0) > 0
+        }
+        if by_type:
+            recent[period] = by_type
+    return recent
+
+
+def summary_for(user_id, today=None):
+    """Return a user's stats from the parts of their summary document it reports"""
+    today = today or timezone.localdate()
+    today_key = today.isoformat()
+    yesterday_key = (today - timedelta(days=1)).isoformat()
+    summary = UserStats.objects.mongo_find_one({'user_id': user_id}, {
+        '_id': False,
+        'totals': True,
+        'daily': True,
+        'weekly': True,
+        'monthly': True,
+        'personal_bests': True,
+        'longest_streak': True,
+        f'streak_starts.{today_key}': True,
+        f'streak_starts.{yesterday_key}': True,
+    }) or {}
+    streak_starts = summary.get('streak_starts', {})
+    current_streak = 0
+    for end in (today_key, yesterday_key):
+        if end in streak_starts:
+            current_streak = (date.fromisoformat(end) - date.fromisoformat(streak_starts[end])).days + 1
+            break
+    day_cutoff, week_cutoff, month_cutoff = window_cutoffs(today)
+    return {
+        'user_id': user_id,
+        'totals': {
+            activity_type: metrics
+            for activity_type, metrics in summary.get('totals', {}).items()
+            if metrics.get('activities', 0) > 0
+        },
+        'daily': _recent(summary.get('daily', {}), day_cutoff),
+        'weekly': _recent(summary.get('weekly', {}), week_cutoff),
+        'monthly': _recent(summary.get('monthly', {}), month_cutoff),
+        'current_streak': current_streak,
+        'longest_streak': summary.get('longest_streak', 0),
+        'personal_bests': summary.get('personal_bests', {}),
+    }
+
+
+def rebuild_user_stats():
+    """Recompute every user's summary from the activities collection"""
+    pipeline = [
+        {'$group': {
+            '_id': {'user_id': '$user_id', 'day': '$date', 'activity_type': '$activity_type'},
+            'activities': {'$sum': 1},
+            'duration': {'$sum': '$duration'},
+            'calories': {'$sum': '$calories_burned'},
+            'distance': {'$sum': {'$ifNull': ['$distance', 0]}},
+            'best_duration': {'$max': '$duration'},
+            'best_calories': {'$max': '$calories_burned'},
+            'best_distance': {'$max': '$distance'},
+        }},
+    ]
+    summaries = defaultdict(lambda: {
+        'totals': {}, 'daily': {}, 'weekly': {}, 'monthly': {},
+        'active_days': {}, 'personal_bests': {},
+    })
+    today = timezone.localdate()
+    cutoffs = window_cutoffs(today)
+    for row in Activity.objects.mongo_aggregate(pipeline, allowDiskUse=True):
+        group = row['_id']
+        summary = summaries[group['user_id']]
+        type_key = _key(group['activity_type'])
+        keys = period_keys(group['day'].date())
+        metrics = {metric: row[metric] for metric in ('activities', 'duration', 'calories', 'distance')}
+        buckets = [summary['totals']]
+        for name, period, cutoff in zip(('daily', 'weekly', 'monthly'), keys, cutoffs):
+            if period >= cutoff:
+                buckets.append(summary[name].setdefault(period, {}))
+        for bucket in buckets:
+            totals = bucket.setdefault(type_key, dict.fromkeys(metrics, 0))
+            for metric, value in metrics.items():
+                totals[metric] += value
+        summary['active_days'][keys[0]] = summary['active_days'].get(keys[0], 0) + row['activities']
+        bests = summary['personal_bests'].setdefault(type_key, {})
+        for field in BEST_FIELDS:
+            value = row[f'best_{field}']
+            if value and value > bests.get(field, 0):
+                bests[field] = value
+
+    now = timezone.now()
+    day_cutoff, run_cutoff = streak_cutoff(today), _run_cutoff(today)
+    documents = []
+    for user_id, summary in summaries.items():
+        streak_starts, streak_ends, longest = streak_runs(summary['active_days'])
+        documents.append({
+            'user_id': user_id,
+            **summary,
+            'active_days': {day: count for day, count in summary['active_days'].items() if day >= day_cutoff},
+            'streak_starts': {end: start for end, start in streak_starts.items() if end >= run_cutoff},
+            'streak_ends': {start: end for start, end in streak_ends.items() if end >= run_cutoff},
+            'longest_streak': longest,
+            'past_longest_streak': max(
+                (run_length(start, end) for end, start in streak_starts.items() if end < run_cutoff), default=0
+            ),
+            'updated_at': now,
+        })
+    UserStats.objects.mongo_delete_many({})
+    if documents:
+        UserStats.objects.mongo_insert_many(documents)
+    response_cache.bump(UserStats)
+    return len(documents)
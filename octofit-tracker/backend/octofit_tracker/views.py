@@ -1,30 +1,121 @@
+import copy
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from pymongo.errors import BulkWriteError
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ParseError, ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.response import Response
-from .models import User, Team, Activity, Leaderboard, Workout
+from rest_framework.views import APIView
+from .models import User, Team, Activity, Leaderboard, DailyTotal, Workout, UserStats
+from .conditional import ConditionalGetMixin
+from .permissions import IsInternalRequest
+from .pagination import ActivityPagination, LeaderboardPagination
+from .parsers import NDJSONParser, NDJSONRows
+from .renderers import CSVRenderer, NDJSONRenderer, PrometheusRenderer
+from . import analytics, exports, leaderboard, lookups, metrics, mongo, monitoring, user_stats
+from .response_cache import bump, cached_response
+from .ranking import COMPETITION, RANKING_METHODS
 from .serializers import (
     UserSerializer, 
     TeamSerializer, 
     ActivitySerializer, 
     LeaderboardSerializer, 
-    WorkoutSerializer
+    WorkoutSerializer,
+    readable_fields,
+    requested_fields
 )
 #test
 
-class UserViewSet(viewsets.ModelViewSet):
+
+def sparse_queryset(request, queryset, serializer_class, required=()):
+    """Project a queryset onto the model fields selected by ?fields= / ?exclude="""
+    selected = requested_fields(request, readable_fields(serializer_class))
+    if selected is None:
+        return queryset
+    model_fields = {field.name for field in queryset.model._meta.concrete_fields}
+    columns = {name for name in selected if name in model_fields}
+    columns.update(name.lstrip('-') for name in required)
+    return queryset.only(*columns)
+
+
+class SparseFieldsMixin:
+    """Narrows the database query to the fields a request asks for"""
+    
+    # Fields the view itself reads, loaded even when the client did not ask for them
+    required_fields = ()
+    
+    def get_queryset(self):
+        # Keyset cursors are built from the ordering fields, so always load them
+        ordering = getattr(self.pagination_class, 'ordering', ())
+        return sparse_queryset(
+            self.request,
+            super().get_queryset(),
+            self.get_serializer_class(),
+            tuple(ordering) + tuple(self.required_fields)
+        )
+    
+    def paginate_queryset(self, queryset):
+        """Page plain rows from values() so the list serializer's fast path reads them directly"""
+        if self.paginator is not None:
+            ordering = getattr(self.paginator, 'ordering', ())
+            queryset = self.get_serializer(many=True).rows(
+                queryset, [name.lstrip('-') for name in ordering]
+            )
+        return super().paginate_queryset(queryset)
+
+
+class ExpandMixin:
+    """Joins user and team names into list rows for ?expand=user,team"""
+    
+    def expand(self, rows):
+        return lookups.expand(rows, lookups.requested_expansions(self.request))
+    
+    def get_etag_models(self):
+        models = super().get_etag_models()
+        if self.request.query_params.get('expand'):
+            models = (*models, User, Team)
+        return models
+    
+    def get_paginated_response(self, data):
+        return super().get_paginated_response(self.expand(data))
+
+
+class UserViewSet(ConditionalGetMixin, SparseFieldsMixin, viewsets.ModelViewSet):
     """
     ViewSet for User model
     Provides CRUD operations for users
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    etag_models = (User, UserStats)
+    
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """Get a user's activity totals by period and type, streaks and personal bests"""
+        user = self.get_object()
+        return Response(user_stats.summary_for(str(user._id)))
+    
+    @action(detail=False, methods=['get'])
+    def batch(self, request):
+        """Get many users by ?ids= with a single query"""
+        ids = lookups.requested_ids(request)
+        users = self.get_queryset().filter(_id__in=lookups.object_ids(ids))
+        serializer = self.get_serializer(users, many=True)
+        return Response(lookups.in_request_order(serializer.data, ids))
     
     @action(detail=False, methods=['get'])
     def by_team(self, request):
         """Get users by team_id"""
         team_id = request.query_params.get('team_id')
         if team_id:
-            users = User.objects.filter(team_id=team_id)
+            users = self.get_queryset().filter(team_id=team_id)
             serializer = self.get_serializer(users, many=True)
             return Response(serializer.data)
         return Response(
@@ -38,7 +129,7 @@ class UserViewSet(viewsets.ModelViewSet):
         email = request.query_params.get('email')
         if email:
             try:
-                user = User.objects.get(email=email)
+                user = self.get_queryset().get(email=email)
                 serializer = self.get_serializer(user)
                 return Response(serializer.data)
             except User.DoesNotExist:
@@ -52,58 +143,240 @@ class UserViewSet(viewsets.ModelViewSet):
         )
 
 
-class TeamViewSet(viewsets.ModelViewSet):
+class TeamViewSet(ConditionalGetMixin, SparseFieldsMixin, viewsets.ModelViewSet):
     """
     ViewSet for Team model
     Provides CRUD operations for teams
     """
     queryset = Team.objects.all()
     serializer_class = TeamSerializer
+    etag_models = (Team, User, Leaderboard)
+    
+    @action(detail=False, methods=['get'])
+    def batch(self, request):
+        """Get many teams by ?ids= with a single query"""
+        ids = lookups.requested_ids(request)
+        teams = self.get_queryset().filter(_id__in=lookups.object_ids(ids))
+        serializer = self.get_serializer(teams, many=True)
+        return Response(lookups.in_request_order(serializer.data, ids))
     
     @action(detail=True, methods=['get'])
     def members(self, request, pk=None):
         """Get all members of a team"""
         team = self.get_object()
-        users = User.objects.filter(team_id=str(team._id))
-        serializer = UserSerializer(users, many=True)
+        users = sparse_queryset(
+            request, User.objects.filter(team_id=str(team._id)), UserSerializer
+        )
+        serializer = UserSerializer(users, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
+    @cached_response(Team, User, Leaderboard)
+    def dashboard(self, request, pk=None):
+        """Get a team with its members, totals and ranked leaderboard in a single database round trip"""
+        try:
+            team_oid = ObjectId(pk)
+        except (InvalidId, TypeError):
+            raise NotFound()
+        dashboard = leaderboard.team_dashboard(team_oid)
+        if dashboard is None:
+            raise NotFound()
+        entries = LeaderboardSerializer(dashboard['leaderboard'], many=True).data
+        for entry, document in zip(entries, dashboard['leaderboard']):
+            entry['team_rank'] = document['team_rank']
+        team = Team(**{field.attname: dashboard.get(field.attname) for field in Team._meta.concrete_fields})
+        return Response({
+            'team': TeamSerializer(team, context=self.get_serializer_context()).data,
+            'members': UserSerializer(dashboard['members'], many=True).data,
+            'stats': {
+                'team_id': str(team_oid),
+                'team_name': dashboard['name'],
+                **dashboard['stats'],
+            },
+            'leaderboard': entries,
+        })
+    
+    @action(detail=True, methods=['get'])
+    @cached_response(Team, User, Leaderboard)
     def stats(self, request, pk=None):
-        """Get team statistics"""
-        team = self.get_object()
-        leaderboard_entries = Leaderboard.objects.filter(team_id=str(team._id))
-        
-        total_activities = sum(entry.total_activities for entry in leaderboard_entries)
-        total_calories = sum(entry.total_calories for entry in leaderboard_entries)
-        total_distance = sum(entry.total_distance for entry in leaderboard_entries)
-        
+        """Get team statistics in a single database round trip"""
+        try:
+            team_oid = ObjectId(pk)
+        except (InvalidId, TypeError):
+            raise NotFound()
+        stats = leaderboard.team_stats(team_oid)
+        if stats is None:
+            raise NotFound()
         return Response({
-            'team_id': str(team._id),
-            'team_name': team.name,
-            'total_activities': total_activities,
-            'total_calories': total_calories,
-            'total_distance': round(total_distance, 2),
-            'member_count': User.objects.filter(team_id=str(team._id)).count()
+            'team_id': stats['team_id'],
+            'team_name': stats['team_name'],
+            'total_activities': stats['total_activities'],
+            'total_calories': stats['total_calories'],
+            'total_distance': stats['total_distance'],
+            'member_count': stats['member_count']
         })
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(ExpandMixin, ConditionalGetMixin, SparseFieldsMixin, viewsets.ModelViewSet):
     """
     ViewSet for Activity model
     Provides CRUD operations for activities
     """
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
+    pagination_class = ActivityPagination
+    
+    def paginated(self, queryset):
+        """Respond with one keyset page of a queryset"""
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+    
+    def perform_create(self, serializer):
+        """Create the activity and add it to the owner's leaderboard totals and stats"""
+        leaderboard.wait_for_rebuild()
+        activity = serializer.save()
+        leaderboard.activity_created(activity)
+        user_stats.activity_created(activity)
+    
+    def perform_update(self, serializer):
+        """Update the activity and apply the difference to the leaderboard and stats"""
+        previous = copy.copy(serializer.instance)
+        leaderboard.wait_for_rebuild()
+        activity = serializer.save()
+        leaderboard.activity_updated(previous, activity)
+        user_stats.activity_updated(previous, activity)
+    
+    def perform_destroy(self, instance):
+        """Delete the activity and withdraw it from the leaderboard and stats"""
+        leaderboard.wait_for_rebuild()
+        instance.delete()
+        leaderboard.activity_deleted(instance)
+        user_stats.activity_deleted(instance)
+    
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        """
+        Create many activities from a JSON array or an NDJSON stream
+        
+        Rows are validated and inserted in batches; invalid rows, and rows
+        MongoDB rejects, are reported by their array index, or their 1-based
+        line number for NDJSON, without failing the rest of the upload.
+        """
+        rows = request.data
+        if isinstance(rows, (dict, str)) or not hasattr(rows, '__iter__'):
+            return Response(
+                {'error': 'Expected a JSON array or an NDJSON stream of activities'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if isinstance(rows, NDJSONRows):
+            position, numbered = 'line', rows.numbered()
+        else:
+            position, numbered = 'index', enumerate(rows)
+        
+        validator = self.get_serializer()
+        created, errors = 0, []
+        for batch in mongo.chunked(numbered, settings.ACTIVITY_BULK_BATCH_SIZE):
+            activities, numbers = [], []
+            for number, row in batch:
+                if isinstance(row, ParseError):
+                    errors.append({position: number, 'errors': {'non_field_errors': [row.detail]}})
+                    continue
+                try:
+                    activities.append(Activity(**validator.run_validation(row)))
+                    numbers.append(number)
+                except ValidationError as exc:
+                    errors.append({position: number, 'errors': exc.detail})
+            if not activities:
+                continue
+            leaderboard.wait_for_rebuild()
+            now = timezone.now()
+            try:
+                Activity.objects.mongo_insert_many([
+                    {
+                        'user_id': activity.user_id,
+                        'activity_type': activity.activity_type,
+                        'duration': activity.duration,
+                        'calories_burned': activity.calories_burned,
+                        'distance': activity.distance,
+                        'date': leaderboard.mongo_day(activity.date),
+                        'created_at': now,
+                    }
+                    for activity in activities
+                ], ordered=False)
+            except BulkWriteError as exc:
+                # Unordered: every document but the rejected ones was inserted
+                rejected = {error['index'] for error in exc.details['writeErrors']}
+                for error in exc.details['writeErrors']:
+                    errors.append({position: numbers[error['index']], 'errors': {
+                        'non_field_errors': [f"Rejected by the database (error {error['code']})"]
+                    }})
+                activities = [activity for index, activity in enumerate(activities) if index not in rejected]
+                if not activities:
+                    continue
+            bump(Activity)
+            leaderboard.activities_created(activities)
+            user_stats.activities_created(activities)
+            created += len(activities)
+        
+        errors.sort(key=lambda error: error[position])
+        if not errors:
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response(
+            {'created': created, 'failed': len(errors), 'errors': errors}, 
+            status=response_status
+        )
+    
+    @action(detail=False, methods=['get'], renderer_classes=[CSVRenderer, NDJSONRenderer])
+    def export(self, request):
+        """Stream activities as ?format=csv or ndjson, optionally by user_id, since a date, and gzipped"""
+        query = {}
+        user_id = request.query_params.get('user_id')
+        if user_id:
+            query['user_id'] = user_id
+        since = request.query_params.get('since')
+        if since:
+            try:
+                since_date = parse_date(since)
+            except ValueError:
+                since_date = None
+            if since_date is None:
+                return Response(
+                    {'error': 'since must be a date in YYYY-MM-DD format'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            query['date'] = {'$gte': leaderboard.mongo_day(since_date)}
+        
+        batch_size = settings.ACTIVITY_EXPORT_BATCH_SIZE
+        rows = exports.activity_documents(query, batch_size)
+        renderer = request.accepted_renderer
+        if renderer.format == 'ndjson':
+            chunks = exports.ndjson_chunks(rows, batch_size)
+        else:
+            chunks = exports.csv_chunks(rows, batch_size)
+        filename = f'activities.{renderer.format}'
+        if request.query_params.get('gzip') in ('1', 'true'):
+            chunks = exports.gzip_chunks(chunks)
+            filename += '.gz'
+            content_type = 'application/gzip'
+        else:
+            content_type = f'{renderer.media_type}; charset=utf-8'
+        
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
     
     @action(detail=False, methods=['get'])
     def by_user(self, request):
         """Get activities by user_id"""
         user_id = request.query_params.get('user_id')
         if user_id:
-            activities = Activity.objects.filter(user_id=user_id)
-            serializer = self.get_serializer(activities, many=True)
-            return Response(serializer.data)
+            activities = self.get_queryset().filter(user_id=user_id)
+            return self.paginated(activities)
         return Response(
             {'error': 'user_id parameter is required'}, 
             status=status.HTTP_400_BAD_REQUEST
@@ -114,46 +387,140 @@ class ActivityViewSet(viewsets.ModelViewSet):
         """Get activities by activity_type"""
         activity_type = request.query_params.get('activity_type')
         if activity_type:
-            activities = Activity.objects.filter(activity_type=activity_type)
-            serializer = self.get_serializer(activities, many=True)
-            return Response(serializer.data)
+            activities = self.get_queryset().filter(activity_type=activity_type)
+            return self.paginated(activities)
         return Response(
             {'error': 'activity_type parameter is required'}, 
             status=status.HTTP_400_BAD_REQUEST
         )
 
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+class LeaderboardViewSet(ExpandMixin, ConditionalGetMixin, SparseFieldsMixin, viewsets.ModelViewSet):
     """
     ViewSet for Leaderboard model
     Provides CRUD operations for leaderboard entries
     """
-    queryset = Leaderboard.objects.all().order_by('rank')
+    queryset = Leaderboard.objects.all().order_by('-total_calories', '_id')
     serializer_class = LeaderboardSerializer
+    pagination_class = LeaderboardPagination
+    etag_models = (Leaderboard, DailyTotal)
+    required_fields = ('user_id', leaderboard.RANK_FIELD)
+    
+    def get_object(self):
+        """Look up the entry, with its live rank on reads"""
+        entry = super().get_object()
+        if self.request.method in SAFE_METHODS:
+            leaderboard.live_ranks([entry])
+        return entry
+    
+    def paginate_queryset(self, queryset):
+        """Page entries best first with their live ranks"""
+        page = super().paginate_queryset(queryset)
+        return None if page is None else leaderboard.live_ranks(page)
+    
+    def ranked_rows(self, queryset):
+        """Plain rows of a best-first queryset, for the list serializer"""
+        return list(self.get_serializer(many=True).rows(queryset, [leaderboard.RANK_FIELD]))
+    
+    def windowed(self, request, team_id=None, limit=None):
+        """Respond with the board for the requested ?window=, e.g. 7d, 30d or month"""
+        window = request.query_params.get('window')
+        if window not in leaderboard.WINDOWS:
+            return Response(
+                {'error': f"window must be one of: {', '.join(leaderboard.WINDOWS)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        board = self.expand(leaderboard.windowed_board(window, team_id=team_id, limit=limit))
+        selected = requested_fields(request, leaderboard.WINDOWED_FIELDS)
+        if selected is not None:
+            keep = [*selected, *(name for name in lookups.EXPANDED_FIELDS if board and name in board[0])]
+            board = [{name: row[name] for name in keep} for row in board]
+        return Response(board)
+    
+    def list(self, request, *args, **kwargs):
+        """List leaderboard entries, all-time or over a ?window="""
+        if 'window' in request.query_params:
+            return self.windowed(request)
+        return super().list(request, *args, **kwargs)
     
     @action(detail=False, methods=['get'])
+    @cached_response(Leaderboard, DailyTotal, User, Team)
     def top(self, request):
         """Get top N entries from leaderboard"""
-        limit = int(request.query_params.get('limit', 10))
-        top_entries = Leaderboard.objects.all().order_by('rank')[:limit]
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            limit = None
+        if limit is None or not 1 <= limit <= leaderboard.MAX_TOP_LIMIT:
+            return Response(
+                {'error': f'limit must be an integer between 1 and {leaderboard.MAX_TOP_LIMIT}'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if 'window' in request.query_params:
+            return self.windowed(request, limit=limit)
+        top_entries = leaderboard.ranks_from_top(self.ranked_rows(self.get_queryset()[:limit]))
         serializer = self.get_serializer(top_entries, many=True)
-        return Response(serializer.data)
+        return Response(self.expand(serializer.data))
     
     @action(detail=False, methods=['get'])
     def by_team(self, request):
         """Get leaderboard entries by team_id"""
         team_id = request.query_params.get('team_id')
         if team_id:
-            entries = Leaderboard.objects.filter(team_id=team_id).order_by('rank')
+            if 'window' in request.query_params:
+                return self.windowed(request, team_id=team_id)
+            entries = leaderboard.live_ranks(self.ranked_rows(self.get_queryset().filter(team_id=team_id)))
             serializer = self.get_serializer(entries, many=True)
-            return Response(serializer.data)
+            return Response(self.expand(serializer.data))
         return Response(
             {'error': 'team_id parameter is required'}, 
             status=status.HTTP_400_BAD_REQUEST
         )
+    
+    @action(detail=False, methods=['get'])
+    def around(self, request):
+        """Get the entries ranked within `window` places of a user, with live ranks"""
+        user_id = request.query_params.get('user_id')
+        if not user_id:
+            return Response(
+                {'error': 'user_id parameter is required'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        ranking = request.query_params.get('ranking', COMPETITION)
+        if ranking not in RANKING_METHODS:
+            return Response(
+                {'error': f"ranking must be one of: {', '.join(RANKING_METHODS)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            window = min(max(int(request.query_params.get('window', 5)), 0), 100)
+        except ValueError:
+            return Response(
+                {'error': 'window must be an integer'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        neighbours = leaderboard.rank_engine().around(user_id, window, ranking)
+        if not neighbours:
+            return Response(
+                {'error': 'User not found on leaderboard'}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+        entries = {
+            entry.user_id: entry
+            for entry in self.get_queryset().filter(user_id__in=[uid for _, uid, _ in neighbours])
+        }
+        data = []
+        for rank, neighbour_id, _ in neighbours:
+            if neighbour_id in entries:
+                item = self.get_serializer(entries[neighbour_id]).data
+                if 'rank' in item:
+                    item['rank'] = rank
+                data.append(item)
+        return Response(self.expand(data))
 
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+class WorkoutViewSet(ConditionalGetMixin, SparseFieldsMixin, viewsets.ModelViewSet):
     """
     ViewSet for Workout model
     Provides CRUD operations for workout suggestions
@@ -161,12 +528,18 @@ class WorkoutViewSet(viewsets.ModelViewSet):
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
     
+    @cached_response(Workout)
+    def list(self, request, *args, **kwargs):
+        """List workouts"""
+        return super().list(request, *args, **kwargs)
+    
     @action(detail=False, methods=['get'])
+    @cached_response(Workout)
     def by_difficulty(self, request):
         """Get workouts by difficulty level"""
         difficulty = request.query_params.get('difficulty')
         if difficulty:
-            workouts = Workout.objects.filter(difficulty=difficulty)
+            workouts = self.get_queryset().filter(difficulty=difficulty)
             serializer = self.get_serializer(workouts, many=True)
             return Response(serializer.data)
         return Response(
@@ -175,14 +548,129 @@ class WorkoutViewSet(viewsets.ModelViewSet):
         )
     
     @action(detail=False, methods=['get'])
+    @cached_response(Workout)
     def by_activity_type(self, request):
         """Get workouts by activity_type"""
         activity_type = request.query_params.get('activity_type')
         if activity_type:
-            workouts = Workout.objects.filter(activity_type=activity_type)
+            workouts = self.get_queryset().filter(activity_type=activity_type)
             serializer = self.get_serializer(workouts, many=True)
             return Response(serializer.data)
         return Response(
             {'error': 'activity_type parameter is required'}, 
             status=status.HTTP_400_BAD_REQUEST
         )
+
+
+class AnalyticsViewSet(ConditionalGetMixin, viewsets.ViewSet):
+    """
+    ViewSet for activity analytics
+    Answers distribution questions from a cached columnar snapshot
+    """
+    etag_models = (Activity, User)
+    
+    def get_etag_extra(self):
+        """Tie validators to the snapshot answering the request, if one is loaded"""
+        loaded_at = analytics.snapshot_loaded_at()
+        return None if loaded_at is None else (loaded_at,)
+    
+    def filters(self, request):
+        """Parse the shared ?activity_type= and ?since= filters"""
+        since = request.query_params.get('since')
+        if since:
+            try:
+                since = parse_date(since)
+            except ValueError:
+                since = None
+            if since is None:
+                raise ValidationError({'error': 'since must be a date in YYYY-MM-DD format'})
+        return request.query_params.get('activity_type') or None, since
+    
+    def list(self, request):
+        """Get an overview of the analytics snapshot"""
+        snapshot = analytics.get_snapshot()
+        return Response({
+            'activities': len(snapshot),
+            'activity_types': sorted(snapshot.activity_types.tolist()),
+            'teams': len(snapshot.team_ids),
+        })
+    
+    @action(detail=False, methods=['get'])
+    def durations(self, request):
+        """Get duration percentiles per activity type, e.g. ?percentiles=50,90"""
+        try:
+            percentiles = [
+                float(value) for value in request.query_params.get('percentiles', '50,90').split(',')
+            ]
+        except ValueError:
+            percentiles = []
+        if not percentiles or not all(0 <= value <= 100 for value in percentiles):
+            return Response(
+                {'error': 'percentiles must be comma-separated numbers between 0 and 100'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        _, since = self.filters(request)
+        return Response(
+            analytics.duration_percentiles(analytics.get_snapshot(), percentiles, since=since)
+        )
+    
+    @action(detail=False, methods=['get'], url_path='calories-per-minute')
+    def calories_per_minute(self, request):
+        """Get a histogram of calories burned per minute"""
+        try:
+            bins = min(max(int(request.query_params.get('bins', 20)), 1), 200)
+        except ValueError:
+            return Response(
+                {'error': 'bins must be an integer'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        activity_type, since = self.filters(request)
+        return Response(analytics.calories_per_minute_histogram(
+            analytics.get_snapshot(), bins=bins, activity_type=activity_type, since=since
+        ))
+    
+    @action(detail=False, methods=['get'])
+    def teams(self, request):
+        """Compare teams by totals, means and calories-per-minute percentiles"""
+        activity_type, since = self.filters(request)
+        return Response(analytics.team_comparison(
+            analytics.get_snapshot(), activity_type=activity_type, since=since
+        ))
+
+
+class MongoPoolView(APIView):
+    """
+    Internal view of this process's MongoDB connection pools
+    Shows the configured pool options and usage counted by the pool listener
+    """
+    permission_classes = [IsInternalRequest]
+    pool_options = (
+        'maxPoolSize', 'minPoolSize', 'waitQueueTimeoutMS', 'maxIdleTimeMS', 'compressors',
+        'readConcernLevel',
+    )
+    
+    def get(self, request):
+        """Get pool options and per-server pool statistics"""
+        client = settings.DATABASES['default'].get('CLIENT', {})
+        return Response({
+            'options': {name: client[name] for name in self.pool_options if name in client},
+            'async_max_pool_size': settings.ASYNC_MONGO_POOL_SIZE,
+            'pools': monitoring.pool_stats.snapshot(),
+        })
+
+
+class MetricsView(APIView):
+    """
+    Prometheus scrape endpoint
+    Request counts, latency histograms, MongoDB command and response cache
+    counters per route, summed over every worker when METRICS_DIR is set
+    """
+    permission_classes = [IsInternalRequest]
+    renderer_classes = [PrometheusRenderer]
+    
+    def get(self, request):
+        """Get every metric in the text exposition format"""
+        return Response(
+            metrics.exposition(*metrics.aggregate()),
+            content_type='text/plain; version=0.0.4; charset=utf-8',
+        )
@@ -6,7 +6,7 @@ function Leaderboard() {
   const [error, setError] = useState(null);
 
   useEffect(() => {
-    const apiUrl = `https://${process.env.REACT_APP_CODESPACE_NAME}-8000.app.github.dev/api/leaderboard/`;
+    const apiUrl = `https://${process.env.REACT_APP_CODESPACE_NAME}-8000.app.github.dev/api/leaderboard/?expand=user,team`;
     console.log('Fetching leaderboard from:', apiUrl);
 
     fetch(apiUrl)
@@ -53,7 +53,7 @@ function Leaderboard() {
             {leaderboard.map((entry, index) => (
               <tr key={entry.id || index}>
                 <td>{index + 1}</td>
-                <td>{entry.user_username || entry.username}</td>
+                <td>{entry.user_name || entry.user_username || entry.username}</td>
                 <td>{entry.team_name || 'N/A'}</td>
                 <td>{entry.total_points || 0}</td>
                 <td>{entry.total_activities || 0}</td>